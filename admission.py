@@ -0,0 +1,236 @@
+"""
+Admission Control Module for Ask Druk
+Bounds concurrent model calls and queues the rest by priority
+
+A request must be admitted before it calls a model. At most max_concurrent
+requests run at once in total, and each model deployment has its own lower
+limit so translations can't crowd out chat (or the reverse). Requests that
+can't run yet wait in one bounded queue ordered by priority: interactive web
+users first, then WhatsApp, then batch/admin work. A request still waiting
+at its deadline is rejected, and when the queue is full a higher-priority
+arrival displaces the lowest-priority waiter instead of being turned away.
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from metrics import registry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Lower value = served first
+INTERACTIVE = 0
+WHATSAPP = 1
+BATCH = 2
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", WHATSAPP: "whatsapp", BATCH: "batch"}
+
+# How long each class may wait for a slot before it is rejected
+DEFAULT_DEADLINES = {INTERACTIVE: 10.0, WHATSAPP: 20.0, BATCH: 120.0}
+
+admission_wait_seconds = registry.histogram(
+    "druk_admission_wait_seconds",
+    "Time requests waited for a model slot, by priority",
+    ["priority"]
+)
+admission_rejections = registry.counter(
+    "druk_admission_rejections_total",
+    "Requests refused a model slot, by priority and reason (queue_full, deadline, displaced)",
+    ["priority", "reason"]
+)
+
+class AdmissionRejected(RuntimeError):
+    """Raised when a request can't get a model slot in time"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request not admitted ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class _Waiter:
+    __slots__ = ("priority", "model", "future", "enqueued_at")
+
+    def __init__(self, priority: int, model: str, future: asyncio.Future):
+        self.priority = priority
+        self.model = model
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+class AdmissionController:
+    """Global and per-model concurrency limits with a bounded priority queue"""
+
+    def __init__(self, max_concurrent: int = 8, model_limits: Optional[Dict[str, int]] = None,
+                 max_queue: int = 64, deadlines: Optional[Dict[int, float]] = None):
+        """
+        Args:
+            max_concurrent: Requests allowed to call models at the same time
+            model_limits: Lower limits for individual models, e.g. {"gpt-4": 6}
+            max_queue: Requests allowed to wait for a slot
+            deadlines: Seconds each priority may wait before it is rejected
+        """
+        self.max_concurrent = max_concurrent
+        self.model_limits = dict(model_limits or {})
+        self.max_queue = max_queue
+        self.deadlines = {**DEFAULT_DEADLINES, **(deadlines or {})}
+
+        # Only touched from the event loop, so no lock is needed
+        self._in_flight = 0
+        self._in_flight_by_model: Dict[str, int] = {}
+        self._queue: List[Tuple[int, int, _Waiter]] = []
+        self._sequence = itertools.count()
+
+    @asynccontextmanager
+    async def admit(self, priority: int, model: str, deadline: Optional[float] = None) -> AsyncIterator[None]:
+        """
+        Hold a model slot for the enclosed call
+
+        Raises:
+            AdmissionRejected: The queue is full or no slot freed up before the deadline
+        """
+        await self._acquire(priority, model, self.deadlines.get(priority, 30.0) if deadline is None else deadline)
+        try:
+            yield
+        finally:
+            self._release(model)
+
+    def _has_capacity(self, model: str) -> bool:
+        if self._in_flight >= self.max_concurrent:
+            return False
+        limit = self.model_limits.get(model)
+        return limit is None or self._in_flight_by_model.get(model, 0) < limit
+
+    def _take(self, model: str):
+        self._in_flight += 1
+        self._in_flight_by_model[model] = self._in_flight_by_model.get(model, 0) + 1
+
+    async def _acquire(self, priority: int, model: str, deadline: float):
+        priority_name = PRIORITY_NAMES.get(priority, str(priority))
+        self._prune()
+        if len(self._queue) >= self.max_queue:
+            worst = max(self._queue, key=lambda entry: (entry[0], entry[1]))
+            if worst[0] <= priority:
+                admission_rejections.inc(1, priority_name, "queue_full")
+                raise AdmissionRejected("queue_full", self._retry_after())
+            # Displace the lowest-priority, most recent waiter
+            self._queue.remove(worst)
+            heapq.heapify(self._queue)
+            displaced = worst[2]
+            admission_rejections.inc(1, PRIORITY_NAMES.get(displaced.priority, str(displaced.priority)), "displaced")
+            displaced.future.set_exception(AdmissionRejected("displaced", self._retry_after()))
+
+        # Every request goes through the queue so waiters of equal or higher priority go first
+        waiter = _Waiter(priority, model, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+        self._wake()
+
+        if not waiter.future.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout=deadline)
+            except asyncio.TimeoutError:
+                if not waiter.future.done():
+                    waiter.future.cancel()
+                    admission_rejections.inc(1, priority_name, "deadline")
+                    raise AdmissionRejected("deadline", self._retry_after())
+                # Admitted (or displaced) just as the deadline passed
+                waiter.future.result()
+            except asyncio.CancelledError:
+                # The client went away; give back a slot granted in the meantime
+                if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                    self._release(model)
+                waiter.future.cancel()
+                raise
+        admission_wait_seconds.observe(time.monotonic() - waiter.enqueued_at, priority_name)
+
+    def _release(self, model: str):
+        self._in_flight -= 1
+        self._in_flight_by_model[model] -= 1
+        self._wake()
+
+    def _prune(self):
+        """Drop waiters that were rejected, cancelled or already admitted"""
+        live = [entry for entry in self._queue if not entry[2].future.done()]
+        if len(live) != len(self._queue):
+            self._queue = live
+            heapq.heapify(self._queue)
+
+    def _wake(self):
+        """Admit queued requests, best priority first, while slots are free"""
+        self._prune()
+        skipped = []
+        while self._queue and self._in_flight < self.max_concurrent:
+            entry = heapq.heappop(self._queue)
+            waiter = entry[2]
+            if waiter.future.done():
+                continue
+            if not self._has_capacity(waiter.model):
+                # Its model is saturated; let requests for other models through
+                skipped.append(entry)
+                continue
+            self._take(waiter.model)
+            waiter.future.set_result(None)
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+
+    def _retry_after(self) -> float:
+        """Rough seconds until a slot frees up, for the Retry-After header"""
+        return max(1.0, round(len(self._queue) / max(1, self.max_concurrent)))
+
+    def queue_depths(self) -> Dict[Tuple, float]:
+        """Waiting requests per priority, for /metrics"""
+        depths = {(name,): 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, waiter in list(self._queue):
+            if not waiter.future.done():
+                key = (PRIORITY_NAMES.get(priority, str(priority)),)
+                depths[key] = depths.get(key, 0) + 1
+        return depths
+
+    def in_flight(self) -> Dict[Tuple, float]:
+        """Admitted requests per model, for /metrics"""
+        return {(model,): count for model, count in self._in_flight_by_model.items()}
+
+    def get_status(self) -> Dict:
+        return {
+            "in_flight": self._in_flight,
+            "max_concurrent": self.max_concurrent,
+            "in_flight_by_model": dict(self._in_flight_by_model),
+            "model_limits": dict(self.model_limits),
+            "queued": {labels[0]: depth for labels, depth in self.queue_depths().items()},
+            "max_queue": self.max_queue,
+        }
+
+def parse_model_limits(spec: str) -> Dict[str, int]:
+    """Parse "gpt-4=6,gpt-4.1-mini=4" into {"gpt-4": 6, "gpt-4.1-mini": 4}"""
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        model, _, limit = part.partition("=")
+        limits[model.strip()] = int(limit)
+    return limits
+
+def controller_from_env() -> AdmissionController:
+    """Controller configured by the ADMISSION_* environment variables"""
+    controller = AdmissionController(
+        max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "8")),
+        model_limits=parse_model_limits(os.getenv("ADMISSION_MODEL_LIMITS", "")),
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "64")),
+    )
+    registry.callback(
+        "druk_admission_queue_depth",
+        "Requests waiting for a model slot, by priority",
+        ["priority"],
+        controller.queue_depths
+    )
+    registry.callback(
+        "druk_admission_in_flight",
+        "Requests holding a model slot, by model",
+        ["model"],
+        controller.in_flight
+    )
+    return controller
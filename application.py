@@ -1,13 +1,16 @@
 # application.py - Ask Druk - Bhutan's Sovereign AI Citizen Assistant
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Request
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, Response, JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from llama_index.core.llms import ChatMessage, MessageRole
 from twilio.twiml.messaging_response import MessagingResponse
 import os
 import json
 import datetime
+import time
 from pathlib import Path
 from dotenv import load_dotenv
 from typing import List, Dict, Optional, Literal
@@ -16,21 +19,45 @@ import uvicorn
 import tempfile 
 import shutil
 import uuid
+import hmac
 import re
+import asyncio
 
 # Import helpers (adapted from EmbeddedChatbot)
 from document_loader import DocumentLoader
 from index_manager import IndexManager
-from druk_system_prompt import DRUK_SYSTEM_PROMPT, get_citizen_context_prompt
+from model_provider import get_model_provider
+from druk_system_prompt import DRUK_SYSTEM_PROMPT
+from static_content import EMERGENCY_CONTACTS, AVAILABLE_SERVICES
 from azure_helpers import parse_azure_error, get_user_friendly_error_message, create_safe_chat_prompt
+from dzongkha_catalog import DzongkhaCatalog, collect_static_sources, is_dzongkha
+from office_index import OfficeIndex
+from knowledge_tables import KnowledgeTables, CompiledEntry, render_json_envelope
+from intent_router import IntentRouter, LLM_ROUTE, DEGRADED_ROUTE
+from query_classifier import QueryClassifier, keyword_query_type
+from entity_extractor import KnowledgeEntityExtractor
+from summary_memory import RollingSummaryMemory
+from circuit_breaker import BREAKERS, OPEN, llm_breaker
+from degraded_mode import DegradedResponder
+from admission import AdmissionRejected, controller_from_env, INTERACTIVE, WHATSAPP, BATCH
+from rate_limiter import RateLimitExceeded, rate_limiter_from_env
+from ingestion_jobs import IngestionQueueFull, job_queue_from_env
+from metrics import registry, CONTENT_TYPE
+from tracing import tracer, configure_tracing, current_span
+from llamaindexchatengine import get_synthesis_prefix
+from druk_system_prompt import get_prompt_for_variant
 
 # Import WhatsApp integration
 from whatsapp_integration import (
     verify_twilio_signature, 
+    verify_status_callback_signature,
     process_whatsapp_message, 
     send_whatsapp_message,
-    whatsapp_sessions
+    whatsapp_sessions,
+    twilio_client,
+    TWILIO_PHONE_NUMBER
 )
+from whatsapp_broadcast import broadcast_scheduler_from_env, normalize_whatsapp_number
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
@@ -43,6 +70,9 @@ azure_endpoint = os.getenv("AZURE_ENDPOINT")
 api_version = os.getenv("AZURE_API_VERSION")
 azure_endpoint_embedding = os.getenv("AZURE_ENDPOINT_EMBEDDING")
 
+# Request tracing (TRACE_EXPORTER, TRACE_SAMPLE_RATE, TRACE_SLOW_MS, ...)
+configure_tracing()
+
 # Initialize FastAPI app
 app = FastAPI(title="Ask Druk - Bhutan's AI Citizen Assistant")
 
@@ -55,6 +85,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Requests not worth a trace
+UNTRACED_PATHS = ("/static", "/metrics")
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Open the root span of each request's trace"""
+    if not tracer.enabled or request.url.path.startswith(UNTRACED_PATHS):
+        return await call_next(request)
+    with tracer.trace(f"{request.method} {request.url.path}") as span:
+        response = await call_next(request)
+        span.set_attribute("status_code", response.status_code)
+    if span.trace_id:
+        response.headers["X-Trace-Id"] = span.trace_id
+    return response
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -63,14 +108,131 @@ chat_sessions = {}
 
 # Initialize document loader and index manager
 document_loader = DocumentLoader()
+model_provider = get_model_provider(
+    api_key=api_key,
+    azure_endpoint=azure_endpoint,
+    api_version=api_version,
+    azure_endpoint_embedding=azure_endpoint_embedding
+)
 index_manager = IndexManager(
     document_loader=document_loader,
     api_key=api_key,
     azure_endpoint=azure_endpoint,
     api_version=api_version,
     azure_endpoint_embedding=azure_endpoint_embedding,
-    system_prompt=DRUK_SYSTEM_PROMPT
+    system_prompt=DRUK_SYSTEM_PROMPT,
+    provider=model_provider
+)
+
+# Embedding-based query type classification (keyword rules as fallback)
+query_classifier = QueryClassifier(
+    embed_model_fn=lambda: index_manager.embed_model,
+    embedding_cache=index_manager.query_embedding_cache
+)
+
+# Structured office lookup built from knowledge_base/offices
+office_index = OfficeIndex()
+
+# Precompiled service guide and rights tables built from knowledge_base
+knowledge_tables = KnowledgeTables()
+
+# Pre-translated Dzongkha strings (built offline with dzongkha_catalog.py)
+dzongkha_catalog = DzongkhaCatalog.load()
+
+WELCOME_MESSAGE = "Kuzuzangpo! Welcome to Ask Druk. I'm here to help you with government services and your rights as a Bhutanese citizen."
+
+# Knowledge-linked extraction of offices, laws and actions from responses
+entity_extractor = KnowledgeEntityExtractor()
+
+# Deterministic answers for structured intents (greetings, contacts, offices, fees)
+intent_router = IntentRouter(
+    office_index=office_index,
+    knowledge_tables=knowledge_tables,
+    emergency_contacts=EMERGENCY_CONTACTS,
+    welcome_message=WELCOME_MESSAGE
+)
+
+# Answers without the LLM while its circuit breaker is open
+degraded_responder = DegradedResponder(index_manager, intent_router)
+
+# Concurrency limits and priority queueing for model calls
+admission = controller_from_env()
+
+# Admission priority by the platform a session was opened from
+PLATFORM_PRIORITIES = {"whatsapp": WHATSAPP, "batch": BATCH, "admin": BATCH}
+
+# Token buckets per session, phone number and client IP, shared by all workers
+rate_limiter = rate_limiter_from_env()
+registry.callback(
+    "druk_rate_limit_buckets",
+    "Token buckets in use in the shared rate limit table",
+    [],
+    lambda: {(): rate_limiter.table.occupancy()}
+)
+
+# Admin uploads parsed, embedded and indexed in the background
+ingestion_jobs = job_queue_from_env(document_loader, index_manager)
+
+# Bulk WhatsApp advisories from a persistent outbox, paced through the shared bucket table
+broadcast_outbox, broadcast_scheduler = broadcast_scheduler_from_env(
+    twilio_client, TWILIO_PHONE_NUMBER, rate_limiter.table
 )
+BROADCAST_MAX_RECIPIENTS = int(os.getenv("BROADCAST_MAX_RECIPIENTS", "100000"))
+
+# Batch chat: largest accepted batch and syntheses run at once per batch
+BATCH_CHAT_MAX_QUESTIONS = int(os.getenv("BATCH_CHAT_MAX_QUESTIONS", "200"))
+BATCH_CHAT_CONCURRENCY = int(os.getenv("BATCH_CHAT_CONCURRENCY", "4"))
+
+# Proxies in front of the app that append to X-Forwarded-For; 0 when clients connect directly
+TRUSTED_PROXY_COUNT = int(os.environ["TRUSTED_PROXY_COUNT"]) if os.getenv("TRUSTED_PROXY_COUNT") else None
+if TRUSTED_PROXY_COUNT is None:
+    logging.warning("TRUSTED_PROXY_COUNT is not set; per-IP rate limits are disabled")
+
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
+# Explicit opt-in to unauthenticated admin endpoints, e.g. for local development
+ADMIN_API_OPEN = os.getenv("ADMIN_API_OPEN", "false").lower() == "true"
+if not ADMIN_API_TOKEN:
+    if ADMIN_API_OPEN:
+        logging.warning("ADMIN_API_OPEN is set; admin endpoints are open to anyone who can reach the app")
+    else:
+        logging.warning("ADMIN_API_TOKEN is not set; admin endpoints are disabled")
+
+def require_admin(request: Request):
+    """Check the X-Admin-Token header; without ADMIN_API_TOKEN only ADMIN_API_OPEN lets requests through"""
+    if not ADMIN_API_TOKEN:
+        if ADMIN_API_OPEN:
+            return
+        raise HTTPException(status_code=503, detail="Admin API is not configured")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_API_TOKEN):
+        raise HTTPException(status_code=401, detail="Admin token required")
+
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    """429 with Retry-After for requests over their rate limit"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests. Please wait a moment before asking again."},
+        headers={"Retry-After": str(max(1, int(exc.retry_after + 0.999)))}
+    )
+
+def client_ip(http_request: Optional[Request]) -> Optional[str]:
+    """
+    Client address for the per-IP rate limits, or None to skip them
+    
+    Behind TRUSTED_PROXY_COUNT proxies that each append to X-Forwarded-For
+    (e.g. 2 for an ALB in front of the Elastic Beanstalk nginx), the client
+    is that many entries from the right; entries further left are whatever
+    the client sent. Without TRUSTED_PROXY_COUNT the socket peer may be a
+    proxy shared by every citizen, so no address is returned.
+    """
+    if http_request is None or TRUSTED_PROXY_COUNT is None:
+        return None
+    if TRUSTED_PROXY_COUNT == 0:
+        return http_request.client.host if http_request.client else None
+    hops = [hop.strip() for hop in http_request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    if len(hops) < TRUSTED_PROXY_COUNT:
+        return None
+    return hops[-TRUSTED_PROXY_COUNT]
 
 # Pydantic models
 class ChatRequest(BaseModel):
@@ -85,8 +247,24 @@ class ChatResponse(BaseModel):
     query_type: Optional[str] = None
     suggested_actions: Optional[List[str]] = None
     office_locations: Optional[List[Dict]] = None
+    laws: Optional[List[Dict]] = None
     debug_info: Optional[List[str]] = None
 
+class BatchChatItem(BaseModel):
+    message: str
+    id: Optional[str] = None  # Echoed back so results can be matched in any order
+    query_type: Optional[str] = None
+    citizen_context: Optional[Dict] = None  # Overrides the batch's citizen_context
+
+class BatchChatRequest(BaseModel):
+    questions: List[BatchChatItem]
+    citizen_context: Optional[Dict] = None
+
+class BroadcastRequest(BaseModel):
+    message: str
+    recipients: List[str]  # Phone numbers, with or without the whatsapp: prefix
+    name: Optional[str] = None  # e.g. "Thimphu passport office closure"
+
 class InitSessionRequest(BaseModel):
     session_id: str
     citizen_context: Optional[Dict] = None  # Age, location, language preference
@@ -99,6 +277,7 @@ class SessionResponse(BaseModel):
 
 class QuickGuideRequest(BaseModel):
     service_type: str  # passport, driving_license, business_registration, etc.
+    language: Optional[str] = "en"
 
 class RightsCheckRequest(BaseModel):
     scenario: str
@@ -120,9 +299,32 @@ async def startup_event():
         # Initialize the index manager
         await index_manager.initialize()
         
+        # Load or compute query classifier centroids
+        query_classifier.initialize()
+        
+        # Every service guide should point citizens to an office
+        intent_router.check_service_offices()
+        
+        # Detect Dzongkha translations whose English source has changed
+        dzongkha_catalog.check_sources(
+            collect_static_sources(AVAILABLE_SERVICES, EMERGENCY_CONTACTS)
+        )
+        
         logging.info("Ask Druk initialized successfully with Bhutan knowledge base")
     except Exception as e:
         logging.error(f"Error initializing Ask Druk: {str(e)}")
+    
+    # Resume broadcasts left in the outbox by a previous run
+    if broadcast_scheduler is not None:
+        await broadcast_scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Hand unsent broadcast messages back to the outbox and close Twilio connections"""
+    if broadcast_scheduler is not None:
+        await broadcast_scheduler.stop()
+    if twilio_client is not None:
+        await twilio_client.aclose()
 
 async def load_bhutan_knowledge_base():
     """Load Bhutan-specific documents from knowledge_base directory"""
@@ -166,7 +368,7 @@ async def initialize_session(request: InitSessionRequest):
         return SessionResponse(
             session_id=session_id,
             status="initialized",
-            message="Kuzuzangpo! Welcome to Ask Druk. I'm here to help you with government services and your rights as a Bhutanese citizen.",
+            message=WELCOME_MESSAGE,
             available_services=available_services
         )
     except Exception as e:
@@ -174,116 +376,239 @@ async def initialize_session(request: InitSessionRequest):
         raise HTTPException(status_code=500, detail=f"Error initializing session: {str(e)}")
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat_with_druk(request: ChatRequest):
+async def chat_with_druk(request: ChatRequest, background_tasks: BackgroundTasks = None,
+                         http_request: Request = None):
     """Main chat endpoint with Druk"""
+    # Direct HTTP calls only; WhatsApp messages are limited per number in the webhook
+    if http_request is not None:
+        rate_limiter.check("chat_ip", client_ip(http_request))
+        rate_limiter.check("chat_session", request.session_id)
+    
     try:
         session_id = request.session_id
+        current_span().set_attribute("session_id", session_id)
         
         # Initialize session if it doesn't exist
         if session_id not in chat_sessions:
             await initialize_session(InitSessionRequest(session_id=session_id))
         
-        # Detect query type if not provided
-        if not request.query_type:
-            request.query_type = detect_query_type(request.message)
-        
-        # Create citizen-aware chat engine if not exists
-        if "chat_engine" not in chat_sessions[session_id]:
-            if not index_manager.global_documents:
-                return ChatResponse(
-                    session_id=session_id,
-                    response="I apologize, but my knowledge base is not available right now. Please try again later.",
-                    debug_info=["No documents in knowledge base"]
-                )
+        # Answer high-confidence structured intents without the RAG pipeline;
+        # routing only needs the keyword rules, not a query embedding
+        route_started = time.perf_counter()
+        routed = intent_router.route(request.message, request.query_type or keyword_query_type(request.message))
+        if routed is not None:
+            chat_sessions[session_id]["query_history"].append({
+                "query": request.message,
+                "query_type": routed.query_type,
+                "route": routed.route,
+                "timestamp": datetime.datetime.now().isoformat()
+            })
+            # Keep the turn in the conversation so follow-ups sent to the LLM have it
+            chat_session = session_chat_state(session_id)
+            if chat_session is not None:
+                chat_session.memory.put(ChatMessage(role=MessageRole.USER, content=request.message))
+                chat_session.memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=routed.response))
+                schedule_memory_summary(chat_session, background_tasks)
+            
+            intent_router.metrics.record(routed.route, time.perf_counter() - route_started)
+            current_span().set_attribute("route", routed.route)
             
-            # Create chat engine with Druk personality
-            chat_engine, debug_info = index_manager.init_chat_engine(
-                session_id, 
-                system_prompt=get_citizen_context_prompt(
-                    chat_sessions[session_id].get("citizen_context", {})
-                )
+            # Handler answers are complete markdown, not LLM text to post-process
+            return ChatResponse(
+                session_id=session_id,
+                response=routed.response,
+                query_type=routed.query_type,
+                suggested_actions=routed.suggested_actions,
+                office_locations=routed.office_locations,
+                debug_info=chat_sessions[session_id].get("debug_info")
+            )
+        
+        # Detect query type if not provided (embeds the query, so off the event loop)
+        if not request.query_type:
+            request.query_type = await run_in_threadpool(detect_query_type, request.message)
+        
+        chat_session = session_chat_state(session_id)
+        if chat_session is None:
+            return ChatResponse(
+                session_id=session_id,
+                response="I apologize, but my knowledge base is not available right now. Please try again later.",
+                debug_info=["No documents in knowledge base"]
             )
-            chat_sessions[session_id]["chat_engine"] = chat_engine
-            chat_sessions[session_id]["debug_info"].extend(debug_info)
         
-        chat_engine = chat_sessions[session_id]["chat_engine"]
+        # Azure is failing or too slow: answer from the knowledge base right away
+        if llm_breaker.state == OPEN:
+            return await degraded_chat_response(session_id, request, route_started, "LLM circuit open")
+        
+        # Only answers to standalone questions are safe to reuse in degraded mode
+        standalone = not chat_session.memory.get_all()
         
         # Enhance prompt based on query type
         enhanced_prompt = enhance_prompt_by_type(request.message, request.query_type)
         
-        # Get response from chat engine
+        # The enhancement is an instruction for the LLM, so retrieval reuses
+        # the embedding already computed for the raw message
+        index_manager.query_embedding_cache.alias(enhanced_prompt, request.message)
+        
+        # Get response from chat engine once a model slot is free; the engine
+        # blocks, so it runs in the threadpool and leaves the event loop responsive
+        platform = chat_sessions[session_id].get("citizen_context", {}).get("platform")
+        priority = PLATFORM_PRIORITIES.get(platform, INTERACTIVE)
         try:
-            response = chat_engine.chat(enhanced_prompt)
+            async with admission.admit(priority, index_manager.llm.metadata.model_name):
+                response = await run_in_threadpool(chat_session.chat, enhanced_prompt, request.query_type)
             response_text = str(response)
             
-            # Post-process response for Bhutanese context
-            processed_response = process_druk_response(response_text, request.query_type)
+            with tracer.stage("post_processing"):
+                # Post-process response for Bhutanese context
+                processed_response = process_druk_response(response_text, request.query_type)
+                
+                # Extract suggested actions, office locations and laws in one pass
+                entities = entity_extractor.extract(response_text)
             
-            # Extract suggested actions and office locations
-            suggested_actions = extract_suggested_actions(response_text)
-            office_locations = extract_office_locations(response_text)
+            if standalone:
+                degraded_responder.answer_cache.put(request.message, request.query_type, processed_response)
             
             # Store query in history
             chat_sessions[session_id]["query_history"].append({
                 "query": request.message,
                 "query_type": request.query_type,
+                "route": LLM_ROUTE,
                 "timestamp": datetime.datetime.now().isoformat()
             })
+            intent_router.metrics.record(LLM_ROUTE, time.perf_counter() - route_started)
+            current_span().set_attribute("route", LLM_ROUTE)
+            
+            # Fold turns that left the memory window into the summary after responding
+            schedule_memory_summary(chat_session, background_tasks)
             
             return ChatResponse(
                 session_id=session_id,
                 response=processed_response,
                 query_type=request.query_type,
-                suggested_actions=suggested_actions,
-                office_locations=office_locations,
+                suggested_actions=entities.suggested_actions,
+                office_locations=entities.office_locations,
+                laws=[{"name": law["name"], "source": law["source"]} for law in entities.laws],
                 debug_info=chat_sessions[session_id].get("debug_info")
             )
             
+        except AdmissionRejected as e:
+            logging.warning(f"Chat request for session {session_id} not admitted: {e.reason}")
+            raise HTTPException(
+                status_code=503,
+                detail="Druk is handling many questions right now. Please try again in a moment.",
+                headers={"Retry-After": str(int(e.retry_after))}
+            )
         except Exception as e:
             logging.error(f"Error getting response from chat engine: {str(e)}")
-            return ChatResponse(
-                session_id=session_id,
-                response="I understand your question, but I'm having trouble accessing the specific information right now. Could you please rephrase your question or try asking about a different topic?",
-                debug_info=[f"Chat engine error: {str(e)}"]
-            )
+            return await degraded_chat_response(session_id, request, route_started, f"Chat engine error: {str(e)}")
             
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error in chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
 
+def session_chat_state(session_id: str):
+    """The session's chat state (served by the shared engine), created if needed; None without documents"""
+    session = chat_sessions[session_id]
+    if "chat_session" not in session:
+        if not index_manager.global_documents:
+            return None
+        
+        # Druk personality with this citizen's context
+        chat_session, debug_info = index_manager.init_chat_engine(
+            session_id,
+            citizen_context=session.get("citizen_context", {})
+        )
+        session["chat_session"] = chat_session
+        session["debug_info"].extend(debug_info)
+    return session["chat_session"]
+
+async def degraded_chat_response(session_id: str, request: ChatRequest, route_started: float, reason: str) -> ChatResponse:
+    """Answer from cached answers or the knowledge base when the chat engine can't be used"""
+    answer = await degraded_responder.respond(request.message, request.query_type)
+    chat_sessions[session_id]["query_history"].append({
+        "query": request.message,
+        "query_type": request.query_type,
+        "route": DEGRADED_ROUTE,
+        "timestamp": datetime.datetime.now().isoformat()
+    })
+    intent_router.metrics.record(DEGRADED_ROUTE, time.perf_counter() - route_started)
+    current_span().set_attribute("route", DEGRADED_ROUTE)
+    current_span().set_attribute("degraded_source", answer.source)
+    
+    return ChatResponse(
+        session_id=session_id,
+        response=answer.response,
+        query_type=request.query_type,
+        suggested_actions=answer.suggested_actions,
+        office_locations=answer.office_locations,
+        debug_info=[reason, f"Degraded answer from {answer.source}"]
+    )
+
+def schedule_memory_summary(chat_session, background_tasks: Optional[BackgroundTasks]):
+    """Run the conversation summary off the request path"""
+    memory = chat_session.memory
+    if not isinstance(memory, RollingSummaryMemory) or not memory.needs_summary():
+        return
+    if background_tasks is not None:
+        background_tasks.add_task(summarize_memory, memory)
+    else:
+        asyncio.get_running_loop().create_task(summarize_memory(memory))
+
+async def summarize_memory(memory: RollingSummaryMemory):
+    """Fold evicted turns into the summary once a low-priority model slot is free"""
+    try:
+        async with admission.admit(BATCH, index_manager.llm.metadata.model_name):
+            await memory.asummarize()
+    except AdmissionRejected:
+        # Model calls are saturated; the turns are folded after a later one
+        logging.info("Conversation summary skipped: no model slot available")
+
 @app.post("/quick-guide")
-async def get_quick_guide(request: QuickGuideRequest):
+async def get_quick_guide(request: QuickGuideRequest, http_request: Request):
     """Get step-by-step guide for common services"""
     try:
-        # Load service-specific guide
-        guide = load_service_guide(request.service_type)
+        # Load precompiled service guide
+        guide = knowledge_tables.get_service_guide(request.service_type)
         
-        return {
-            "service_type": request.service_type,
-            "guide": guide,
-            "status": "success"
-        }
+        if is_dzongkha(request.language):
+            guide = guide.variant(
+                f"dz:{dzongkha_catalog.artifact_version}", dzongkha_catalog.localize
+            )
+        
+        return compiled_json_response(
+            [("service_type", request.service_type)], "guide", guide, http_request
+        )
     except Exception as e:
         logging.error(f"Error getting quick guide: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting guide: {str(e)}")
 
 @app.post("/rights-check")
-async def check_rights(request: RightsCheckRequest):
+async def check_rights(request: RightsCheckRequest, http_request: Request):
     """Check rights for specific scenarios"""
     try:
-        # Load rights information
-        rights_info = load_rights_info(request.category, request.scenario)
+        # Load precompiled rights information
+        rights_info = knowledge_tables.get_rights(request.category, request.scenario)
         
-        return {
-            "scenario": request.scenario,
-            "category": request.category,
-            "rights": rights_info,
-            "status": "success"
-        }
+        return compiled_json_response(
+            [("scenario", request.scenario), ("category", request.category)],
+            "rights", rights_info, http_request
+        )
     except Exception as e:
         logging.error(f"Error checking rights: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error checking rights: {str(e)}")
 
+def compiled_json_response(fields: List, entry_field: str, entry: CompiledEntry, http_request: Request) -> Response:
+    """Serve a precompiled entry with an ETag, answering 304 when the client's copy is current"""
+    body, etag = render_json_envelope(fields, entry_field, entry)
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=300"}
+    
+    if http_request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.get("/office-finder")
 async def find_office(service_type: str, dzongkhag: Optional[str] = None):
     """Find relevant government offices"""
@@ -301,59 +626,34 @@ async def find_office(service_type: str, dzongkhag: Optional[str] = None):
         raise HTTPException(status_code=500, detail=f"Error finding offices: {str(e)}")
 
 @app.get("/emergency-contacts")
-async def get_emergency_contacts():
+async def get_emergency_contacts(language: Optional[str] = None):
     """Get emergency contact numbers"""
-    return {
-        "emergency_contacts": [
-            {"service": "Police", "number": "113", "available": "24/7"},
-            {"service": "Fire Department", "number": "110", "available": "24/7"},
-            {"service": "Medical Emergency", "number": "112", "available": "24/7"},
-            {"service": "National Emergency", "number": "111", "available": "24/7"},
-            {"service": "Tourist Helpline", "number": "+975-2-323251", "available": "Office hours"}
-        ]
-    }
+    if is_dzongkha(language):
+        return {"emergency_contacts": dzongkha_catalog.localize(EMERGENCY_CONTACTS)}
+    
+    return {"emergency_contacts": EMERGENCY_CONTACTS}
 
 @app.post("/translate")
-async def translate_text(request: TranslationRequest):
+async def translate_text(request: TranslationRequest, http_request: Request):
     """Translate English text to Dzongkha using vanilla chat completion"""
     try:
-        from openai import AzureOpenAI
-        
-        # Initialize Azure OpenAI client
-        client = AzureOpenAI(
-            api_key=api_key,
-            api_version=api_version,
-            azure_endpoint=azure_endpoint
-        )
-        
-        # Create translation prompt
-        translation_prompt = f"""You are a professional translator specializing in English to Dzongkha translation.
-
-Please translate the following English text to Dzongkha script. Maintain the original structure, formatting, and meaning:
-
-{request.text}
-
-Important guidelines:
-- Use proper Dzongkha script (འབྲུག་ཁ)
-- Preserve any formatting like bullet points, numbers, headers
-- Keep technical terms clear and understandable
-- Maintain the helpful and respectful tone
-- If certain English terms don't have direct Dzongkha equivalents, you may keep them in English within the Dzongkha text
-
-Translation:"""
+        # Static content is served from the pre-translated catalog
+        if is_dzongkha(request.target_language):
+            cached_translation = dzongkha_catalog.translate(request.text)
+            if cached_translation is not None:
+                return {
+                    "original_text": request.text,
+                    "translated_text": cached_translation,
+                    "target_language": request.target_language,
+                    "status": "success"
+                }
         
-        # Get translation from Azure OpenAI
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",  # or your deployed model name
-            messages=[
-                {"role": "system", "content": "You are a professional English to Dzongkha translator. Provide accurate, culturally appropriate translations."},
-                {"role": "user", "content": translation_prompt}
-            ],
-            temperature=0.3,
-            max_tokens=20000
-        )
+        # Only model translations count against the limit
+        rate_limiter.check("translate_ip", client_ip(http_request))
         
-        translated_text = response.choices[0].message.content.strip()
+        # Get translation from the configured model provider
+        async with admission.admit(INTERACTIVE, model_provider.translation_model):
+            translated_text = await run_in_threadpool(model_provider.translate, request.text)
         
         return {
             "original_text": request.text,
@@ -362,6 +662,8 @@ Translation:"""
             "status": "success"
         }
         
+    except RateLimitExceeded:
+        raise
     except Exception as e:
         logging.error(f"Translation error: {str(e)}")
         return {
@@ -374,7 +676,7 @@ Translation:"""
 
 # WhatsApp Integration Endpoints
 @app.post("/webhook/whatsapp")
-async def whatsapp_webhook(request: Request):
+async def whatsapp_webhook(request: Request, background_tasks: BackgroundTasks):
     """Webhook endpoint for incoming WhatsApp messages from Twilio"""
     try:
         # Get the raw body for signature verification
@@ -397,11 +699,19 @@ async def whatsapp_webhook(request: Request):
         
         logging.info(f"WhatsApp message received from {from_number}: {message_body}")
         
+        # Over the limit: acknowledge without replying, so a spam loop gets nothing back
+        try:
+            rate_limiter.check("whatsapp_number", from_number)
+        except RateLimitExceeded as e:
+            logging.warning(f"Rate limited WhatsApp messages from {from_number}: {str(e)}")
+            return Response(content=str(MessagingResponse()), media_type="application/xml")
+        
         # Process the message
         response_text = await process_whatsapp_message(
             from_number=from_number,
             message_body=message_body,
-            profile_name=profile_name
+            profile_name=profile_name,
+            background_tasks=background_tasks
         )
         
         # Create Twilio response
@@ -432,17 +742,26 @@ async def whatsapp_webhook(request: Request):
 @app.post("/webhook/whatsapp/status")
 async def whatsapp_status_callback(request: Request):
     """Webhook endpoint for WhatsApp message status updates"""
+    form_data = await request.form()
+    # Callbacks move broadcast deliveries on; only Twilio may send them
+    if not verify_status_callback_signature(request, dict(form_data)):
+        logging.warning("Rejected WhatsApp status callback with an invalid signature")
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    
     try:
-        form_data = await request.form()
-        
         message_sid = form_data.get("MessageSid", "")
         message_status = form_data.get("MessageStatus", "")
         to_number = form_data.get("To", "")
+        error_code = form_data.get("ErrorCode", "")
         
         logging.info(f"WhatsApp status update: {message_sid} - {message_status} to {to_number}")
         
-        # You can store status updates in database if needed
-        # update_message_status(message_sid, message_status)
+        # Reconcile broadcast deliveries; other messages have no stored state
+        if message_sid and message_status:
+            await run_in_threadpool(
+                broadcast_outbox.record_status, message_sid, message_status.lower(),
+                int(error_code) if error_code.isdigit() else None
+            )
         
         return {"status": "ok"}
         
@@ -472,6 +791,162 @@ async def send_whatsapp_endpoint(
         logging.error(f"Error sending WhatsApp message: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error sending message: {str(e)}")
 
+# WhatsApp broadcast endpoints
+@app.post("/admin/broadcasts", status_code=202, dependencies=[Depends(require_admin)])
+async def create_broadcast(request: BroadcastRequest):
+    """
+    Queue an advisory for many WhatsApp subscribers
+    
+    Recipients are deduplicated and stored in the outbox, then sent in the
+    background at the sender's rate limit. Twilio only accepts free-form
+    messages within 24 hours of the subscriber's last message; outside that
+    window the delivery fails (error 63016) and an approved template is needed.
+    """
+    message = request.message.strip()
+    if not message:
+        raise HTTPException(status_code=400, detail="Message is empty")
+    if len(message) > 1600:
+        raise HTTPException(status_code=400, detail="Message is longer than WhatsApp's 1600 characters")
+    if len(request.recipients) > BROADCAST_MAX_RECIPIENTS:
+        raise HTTPException(status_code=400, detail=f"Too many recipients ({len(request.recipients)}; "
+                                                    f"limit {BROADCAST_MAX_RECIPIENTS})")
+    
+    recipients, invalid = [], []
+    for number in request.recipients:
+        normalized = normalize_whatsapp_number(number)
+        if normalized:
+            recipients.append(normalized)
+        else:
+            invalid.append(number)
+    recipients = list(dict.fromkeys(recipients))
+    if not recipients:
+        raise HTTPException(status_code=400, detail="No valid recipients")
+    
+    broadcast_id = await run_in_threadpool(broadcast_outbox.create_broadcast, request.name, message, recipients)
+    if broadcast_scheduler is not None:
+        broadcast_scheduler.wake()
+    summary = await run_in_threadpool(broadcast_outbox.summary, broadcast_id)
+    summary["invalid_recipients"] = invalid[:100]
+    summary["invalid_count"] = len(invalid)
+    summary["sending"] = broadcast_scheduler is not None
+    return summary
+
+@app.get("/admin/broadcasts", dependencies=[Depends(require_admin)])
+async def list_broadcasts():
+    """Recent broadcasts with delivery counts by status, newest first"""
+    return {"broadcasts": await run_in_threadpool(broadcast_outbox.list_broadcasts)}
+
+@app.get("/admin/broadcasts/{broadcast_id}", dependencies=[Depends(require_admin)])
+async def get_broadcast(broadcast_id: str):
+    """Progress of a broadcast"""
+    summary = await run_in_threadpool(broadcast_outbox.summary, broadcast_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+    return summary
+
+@app.get("/admin/broadcasts/{broadcast_id}/deliveries", dependencies=[Depends(require_admin)])
+async def get_broadcast_deliveries(broadcast_id: str, status: Optional[str] = None,
+                                   limit: int = 100, offset: int = 0):
+    """Per-recipient delivery state, optionally only one status (e.g. failed)"""
+    if await run_in_threadpool(broadcast_outbox.summary, broadcast_id) is None:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+    deliveries = await run_in_threadpool(
+        broadcast_outbox.deliveries, broadcast_id, status, min(max(limit, 1), 1000), max(offset, 0)
+    )
+    return {"broadcast_id": broadcast_id, "deliveries": deliveries}
+
+@app.post("/admin/broadcasts/{broadcast_id}/cancel", dependencies=[Depends(require_admin)])
+async def cancel_broadcast(broadcast_id: str):
+    """Stop sending a broadcast; messages already accepted by Twilio are not recalled"""
+    if await run_in_threadpool(broadcast_outbox.summary, broadcast_id) is None:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+    await run_in_threadpool(broadcast_outbox.cancel, broadcast_id)
+    return await run_in_threadpool(broadcast_outbox.summary, broadcast_id)
+
+@app.post("/chat/batch", dependencies=[Depends(require_admin)])
+async def chat_batch(request: BatchChatRequest):
+    """
+    Answer many independent questions, streamed back as NDJSON
+    
+    For regression checks and bulk FAQ generation. The questions are embedded
+    in one call and retrieved together, then answered BATCH_CHAT_CONCURRENCY at
+    a time at batch admission priority. Each line is one result, in completion
+    order, with its index, id and timings; questions have no session or memory.
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions given")
+    if len(request.questions) > BATCH_CHAT_MAX_QUESTIONS:
+        raise HTTPException(status_code=400,
+                            detail=f"Too many questions ({len(request.questions)}; limit {BATCH_CHAT_MAX_QUESTIONS})")
+    if not index_manager.global_documents:
+        raise HTTPException(status_code=503, detail="Knowledge base is not available")
+    if llm_breaker.state == OPEN:
+        raise HTTPException(status_code=503, detail="The language model is unavailable", headers={"Retry-After": "30"})
+    
+    questions = [{
+        "id": item.id,
+        "message": item.message,
+        "query_type": item.query_type,
+        "citizen_context": item.citizen_context if item.citizen_context is not None else request.citizen_context,
+    } for item in request.questions]
+    model_name = index_manager.llm.metadata.model_name
+    
+    async def results():
+        async for result in index_manager.abatch_chat(
+            questions,
+            concurrency=BATCH_CHAT_CONCURRENCY,
+            classify=detect_query_type,
+            enhance=enhance_prompt_by_type,
+            slot=lambda: admission.admit(BATCH, model_name),
+        ):
+            if result["response"] is not None:
+                result["response"] = process_druk_response(result["response"], result["query_type"])
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+# Knowledge base ingestion endpoints
+@app.post("/admin/ingestion-jobs", status_code=202, dependencies=[Depends(require_admin)])
+async def create_ingestion_job(request: Request, filename: str):
+    """
+    Upload a document for background ingestion
+    
+    The request body is the raw file (e.g. curl --data-binary @act.pdf
+    "/admin/ingestion-jobs?filename=act.pdf"); it is written to disk as it
+    arrives and the job is queued once the upload completes.
+    """
+    content_length = request.headers.get("content-length")
+    try:
+        job = ingestion_jobs.create_job(filename, int(content_length) if content_length else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except IngestionQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    
+    await ingestion_jobs.spool(job, request.stream())
+    return job.to_dict()
+
+@app.get("/admin/ingestion-jobs", dependencies=[Depends(require_admin)])
+async def list_ingestion_jobs():
+    """Recent ingestion jobs, newest first"""
+    return {"jobs": ingestion_jobs.list_jobs()}
+
+@app.get("/admin/ingestion-jobs/{job_id}", dependencies=[Depends(require_admin)])
+async def get_ingestion_job(job_id: str):
+    """Status and progress of an ingestion job"""
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job.to_dict()
+
+@app.post("/admin/ingestion-jobs/{job_id}/cancel", dependencies=[Depends(require_admin)])
+async def cancel_ingestion_job(job_id: str):
+    """Stop an ingestion job at its next checkpoint; nothing is added to the index"""
+    job = ingestion_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return job.to_dict()
+
 @app.get("/whatsapp/sessions")
 async def get_whatsapp_sessions():
     """Get active WhatsApp sessions (for admin/monitoring)"""
@@ -484,23 +959,45 @@ async def get_whatsapp_sessions():
         logging.error(f"Error getting WhatsApp sessions: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting sessions: {str(e)}")
 
+@app.get("/metrics/routing")
+async def get_routing_metrics():
+    """Share of chat traffic answered without an LLM call and latency per route"""
+    return intent_router.metrics.snapshot()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Stage latencies, token counts, cache hit rates and sessions in Prometheus text format"""
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
+
+def _cache_requests() -> Dict[tuple, int]:
+    """Hits and misses of the caches on the chat path"""
+    counts = {
+        ("query_embedding", "hit"): index_manager.query_embedding_cache.hits,
+        ("query_embedding", "miss"): index_manager.query_embedding_cache.misses,
+    }
+    for name, cached in (("synthesis_prefix", get_synthesis_prefix), ("prompt_variant", get_prompt_for_variant)):
+        info = cached.cache_info()
+        counts[(name, "hit")] = info.hits
+        counts[(name, "miss")] = info.misses
+    return counts
+
+def _session_counts() -> Dict[tuple, int]:
+    """Web sessions (and those with a chat history) and WhatsApp sessions"""
+    return {
+        ("web",): len(chat_sessions),
+        ("web_chat",): sum(1 for session in list(chat_sessions.values()) if "chat_session" in session),
+        ("whatsapp",): len(whatsapp_sessions),
+    }
+
+# Read at scrape time, so nothing is recorded on the request path
+registry.callback("druk_cache_requests_total", "Cache lookups by cache and result",
+                  ["cache", "result"], _cache_requests, kind="counter")
+registry.callback("druk_sessions", "Active sessions by kind", ["kind"], _session_counts)
+
 # Helper functions
 def detect_query_type(message: str) -> str:
-    """Detect the type of query based on keywords"""
-    message_lower = message.lower()
-    
-    if any(word in message_lower for word in ["right", "rights", "fired", "unfair", "discriminat"]):
-        return "rights_inquiry"
-    elif any(word in message_lower for word in ["apply", "application", "register", "license", "permit"]):
-        return "service_guide"
-    elif any(word in message_lower for word in ["office", "where", "location", "contact"]):
-        return "office_finder"
-    elif any(word in message_lower for word in ["law", "legal", "regulation", "rule"]):
-        return "law_explanation"
-    elif any(word in message_lower for word in ["document", "documents", "need", "required"]):
-        return "document_help"
-    else:
-        return "general_inquiry"
+    """Detect the type of query from its embedding, falling back to keywords"""
+    return query_classifier.classify(message)
 
 def enhance_prompt_by_type(message: str, query_type: str) -> str:
     """Enhance the prompt based on query type"""
@@ -530,114 +1027,26 @@ def process_druk_response(response: str, query_type: str) -> str:
     
     return response
 
-def extract_suggested_actions(response: str) -> List[str]:
-    """Extract action items from response"""
-    actions = []
-    
-    # Look for numbered lists or bullet points
-    import re
-    
-    # Pattern for numbered actions
-    numbered_actions = re.findall(r'\d+\.\s*([^.\n]+)', response)
-    actions.extend(numbered_actions[:5])  # Limit to 5 actions
-    
-    # Pattern for bullet points
-    bullet_actions = re.findall(r'[-•]\s*([^.\n]+)', response)
-    actions.extend(bullet_actions[:3])
-    
-    return actions[:5]  # Return max 5 actions
-
-def extract_office_locations(response: str) -> List[Dict]:
-    """Extract office information from response"""
-    offices = []
-    
-    # This would be enhanced with actual office data
-    if "immigration" in response.lower():
-        offices.append({
-            "name": "Immigration Office, Thimphu",
-            "address": "Thimphu, Bhutan",
-            "contact": "+975-2-322526",
-            "hours": "9:00 AM - 5:00 PM (Mon-Fri)"
-        })
-    
-    return offices
-
 def get_available_services(citizen_context: Optional[Dict]) -> List[Dict]:
     """Get available services based on citizen context"""
-    services = [
-        {"name": "Passport Application", "icon": "🛂", "category": "Travel Documents"},
-        {"name": "Driving License", "icon": "🚗", "category": "Transportation"},
-        {"name": "Business Registration", "icon": "💼", "category": "Business"},
-        {"name": "Birth Certificate", "icon": "📄", "category": "Civil Documents"},
-        {"name": "Employment Rights", "icon": "⚖️", "category": "Legal Rights"},
-        {"name": "Land Registration", "icon": "🏠", "category": "Property"}
-    ]
+    services = [dict(service) for service in AVAILABLE_SERVICES]
+    
+    if citizen_context and is_dzongkha(citizen_context.get("language")):
+        return dzongkha_catalog.localize(services)
     
     return services
 
 def load_service_guide(service_type: str) -> Dict:
     """Load service guide from knowledge base"""
-    # This would load from actual JSON files
-    guides = {
-        "passport": {
-            "title": "Passport Application Guide",
-            "steps": [
-                {"step": 1, "title": "Gather Required Documents", "description": "Collect citizenship ID, birth certificate, and photographs", "documents": ["Citizenship ID", "Birth Certificate"], "time_estimate": "1 day"},
-                {"step": 2, "title": "Visit Immigration Office", "description": "Go to Immigration Office in Thimphu with all documents", "time_estimate": "1 day"},
-                {"step": 3, "title": "Submit Application", "description": "Fill out application form and submit with documents", "time_estimate": "30 minutes"},
-                {"step": 4, "title": "Pay Fees", "description": "Pay passport fee (Nu. 500 for regular, Nu. 1000 for urgent)", "time_estimate": "15 minutes"},
-                {"step": 5, "title": "Collect Passport", "description": "Return after 7-10 working days to collect passport", "time_estimate": "7-10 working days"}
-            ],
-            "total_time": "7-10 working days",
-            "fees": {"regular": 500, "urgent": 1000},
-            "offices": ["Immigration Office, Thimphu"],
-            "tips": ["Apply early during non-peak seasons", "Bring photocopies of all documents"]
-        }
-    }
-    
-    return guides.get(service_type, {"error": "Guide not found"})
+    return knowledge_tables.get_service_guide(service_type).data
 
 def load_rights_info(category: str, scenario: str) -> Dict:
     """Load rights information"""
-    rights = {
-        "employment": {
-            "unfair_dismissal": {
-                "rights": [
-                    "Right to written notice (usually 1 month)",
-                    "Right to severance pay if employed >1 year", 
-                    "Right to know the reason for dismissal",
-                    "Right to appeal the decision"
-                ],
-                "relevant_laws": ["Labour Act 2007, Section 45"],
-                "next_steps": ["File complaint with Labour Ministry within 30 days"],
-                "simplified_explanation": "If you're fired without cause, you have specific rights and can take action."
-            }
-        }
-    }
-    
-    return rights.get(category, {}).get(scenario, {"error": "Rights information not found"})
+    return knowledge_tables.get_rights(category, scenario).data
 
 def find_government_offices(service_type: str, dzongkhag: Optional[str] = None) -> List[Dict]:
     """Find relevant government offices"""
-    offices = [
-        {
-            "name": "Immigration Office",
-            "services": ["passport", "visa", "work_permit"],
-            "address": "Thimphu, Bhutan",
-            "contact": "+975-2-322526",
-            "hours": "9:00 AM - 5:00 PM (Mon-Fri)",
-            "dzongkhag": "Thimphu"
-        }
-    ]
-    
-    # Filter by service type and dzongkhag
-    relevant_offices = []
-    for office in offices:
-        if service_type in office.get("services", []):
-            if not dzongkhag or office.get("dzongkhag") == dzongkhag:
-                relevant_offices.append(office)
-    
-    return relevant_offices
+    return office_index.find(service_type, dzongkhag)
 
 async def create_sample_knowledge_base():
     """Create sample knowledge base files"""
@@ -687,6 +1096,8 @@ async def health_check():
     return {
         "status": "healthy", 
         "service": "Ask Druk - Bhutan's AI Citizen Assistant", 
+        "circuits": {breaker.name: breaker.state for breaker in BREAKERS},
+        "admission": admission.get_status(),
         "timestamp": datetime.datetime.now().isoformat()
     }
 
@@ -7,6 +7,8 @@ import json
 import re
 from typing import Dict, Any, Optional
 from druk_system_prompt import DRUK_SYSTEM_PROMPT
+from metrics import record_tokens
+from tracing import tracer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
@@ -126,3 +128,62 @@ def create_safe_chat_prompt(user_message: str) -> str:
         A safely formatted prompt
     """
     return f"Please help me with this question about Bhutanese government services or citizen rights: {user_message}"
+
+# Deployment used for English -> Dzongkha translation
+TRANSLATION_MODEL = "gpt-4.1-mini"
+
+def create_translation_messages(text: str) -> list:
+    """
+    Create the chat messages used to translate English text to Dzongkha
+    
+    Args:
+        text: The English text to translate
+        
+    Returns:
+        Chat completion messages for the translation request
+    """
+    translation_prompt = f"""You are a professional translator specializing in English to Dzongkha translation.
+
+Please translate the following English text to Dzongkha script. Maintain the original structure, formatting, and meaning:
+
+{text}
+
+Important guidelines:
+- Use proper Dzongkha script (འབྲུག་ཁ)
+- Preserve any formatting like bullet points, numbers, headers
+- Keep technical terms clear and understandable
+- Maintain the helpful and respectful tone
+- If certain English terms don't have direct Dzongkha equivalents, you may keep them in English within the Dzongkha text
+
+Translation:"""
+    
+    return [
+        {"role": "system", "content": "You are a professional English to Dzongkha translator. Provide accurate, culturally appropriate translations."},
+        {"role": "user", "content": translation_prompt}
+    ]
+
+def translate_to_dzongkha(client: Any, text: str, model: str = TRANSLATION_MODEL) -> str:
+    """
+    Translate English text to Dzongkha with an Azure OpenAI client
+    
+    Args:
+        client: An initialized openai.AzureOpenAI client
+        text: The English text to translate
+        model: The deployed translation model name
+        
+    Returns:
+        The translated text
+    """
+    with tracer.stage("translation"):
+        response = client.chat.completions.create(
+            model=model,
+            messages=create_translation_messages(text),
+            temperature=0.3,
+            max_tokens=20000
+        )
+    
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        record_tokens("translation", model, usage.prompt_tokens, usage.completion_tokens)
+    
+    return response.choices[0].message.content.strip()
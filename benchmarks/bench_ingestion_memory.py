@@ -0,0 +1,211 @@
+# bench_ingestion_memory.py - Peak memory of ingesting large uploads, by file size
+#
+# Usage:
+#     python benchmarks/bench_ingestion_memory.py [--pdf-pages 50,150,300] [--csv-rows 10000,40000]
+#                                                 [--text-mb 1,4] [--report report.json]
+#
+# Generates synthetic PDFs, CSVs and text files and runs each through two
+# pipelines: loading the whole file into Documents, chunking everything and
+# then embedding (how uploads were ingested before), and the streaming path of
+# the ingestion jobs (DocumentLoader.stream_uploaded_file, chunking each part
+# and embedding through a bounded batch buffer). Every measurement runs in a
+# fresh subprocess and reports the Python heap peak (tracemalloc), the heap
+# still held at the end (the chunks, embeddings and documents that go into the
+# index) and the growth of the process RSS high-water mark. Embeddings are an
+# in-process stand-in with Azure's 1536 dimensions.
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Dict, List
+
+# Add the repository root to Python path
+repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_root))
+
+EMBED_DIM = 1536
+EMBED_BATCH_SIZE = 16
+
+SENTENCES = [
+    "An employer shall provide every employee with a written contract of employment.",
+    "The Dzongkhag administration may issue a permit after inspecting the premises.",
+    "Applications are processed within fifteen working days of receipt of all documents.",
+    "A citizen may appeal the decision to the Ministry within thirty days.",
+    "Fees are payable in Ngultrum at the counter or through the online payment gateway.",
+    "The Labour and Employment Act applies to every workplace in the Kingdom of Bhutan.",
+]
+
+def sentence(i: int) -> str:
+    return f"Section {i}. {SENTENCES[i % len(SENTENCES)]}"
+
+def write_pdf(path: str, pages: int, lines_per_page: int = 45):
+    """Minimal text-only PDF with one content stream per page"""
+    objects: Dict[int, bytes] = {}
+    page_ids = []
+    next_id = 4
+    for page in range(pages):
+        lines = [sentence(page * lines_per_page + line) for line in range(lines_per_page)]
+        text = " T* ".join("(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") Tj"
+                           for line in lines)
+        stream = f"BT /F1 9 Tf 11 TL 36 806 Td {text} ET".encode("latin-1")
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        objects[page_id] = (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(page_id)
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[2] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % page_id for page_id in page_ids), pages)
+    objects[3] = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = {}
+        for object_id in sorted(objects):
+            offsets[object_id] = f.tell()
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (object_id, objects[object_id]))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for object_id in sorted(objects):
+            f.write(b"%010d 00000 n \n" % offsets[object_id])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+def write_csv(path: str, rows: int):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("id,dzongkhag,service,status,notes\n")
+        for i in range(rows):
+            f.write(f"{i},Thimphu,Trade licence renewal,approved,\"{sentence(i)}\"\n")
+
+def write_text(path: str, megabytes: float):
+    target = int(megabytes * 1024 * 1024)
+    with open(path, "w", encoding="utf-8") as f:
+        i = 0
+        while f.tell() < target:
+            f.write(" ".join(sentence(i + j) for j in range(6)) + "\n\n")
+            i += 6
+
+def run_pipeline(mode: str, path: str, filename: str) -> Dict:
+    """Ingest one file in this process and measure it (run in a subprocess)"""
+    import gc
+    import logging
+    import resource
+    import tracemalloc
+
+    import pandas  # noqa: F401 - imported by the tabular readers; kept out of the measurement
+    import llama_index.readers.file  # noqa: F401
+    from llama_index.core import Document, SimpleDirectoryReader
+    from llama_index.core.embeddings import MockEmbedding
+    from llama_index.core.node_parser import SentenceSplitter
+    from llama_index.core.schema import MetadataMode
+
+    from document_loader import DocumentLoader
+
+    logging.disable(logging.WARNING)
+    loader = DocumentLoader()
+    splitter = SentenceSplitter(chunk_size=2048, chunk_overlap=200)
+    embed_model = MockEmbedding(embed_dim=EMBED_DIM)
+
+    def embed(batch):
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+        for node, embedding in zip(batch, embed_model.get_text_embedding_batch(texts)):
+            node.embedding = embedding
+        return batch
+
+    # Load the tokenizer and reader modules before measuring
+    embed(splitter.get_nodes_from_documents([Document(text=" ".join(SENTENCES))]))
+
+    gc.collect()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    if mode == "whole_file":
+        documents = SimpleDirectoryReader(input_files=[path], filename_as_id=True).load_data()
+        nodes = splitter.get_nodes_from_documents(documents)
+        for start in range(0, len(nodes), EMBED_BATCH_SIZE):
+            embed(nodes[start:start + EMBED_BATCH_SIZE])
+    else:
+        documents, nodes, pending = [], [], []
+        for document, _ in loader.stream_uploaded_file(path, filename):
+            documents.append(document)
+            pending.extend(splitter.get_nodes_from_documents([document]))
+            while len(pending) >= EMBED_BATCH_SIZE:
+                nodes.extend(embed(pending[:EMBED_BATCH_SIZE]))
+                del pending[:EMBED_BATCH_SIZE]
+        if pending:
+            nodes.extend(embed(pending))
+
+    seconds = time.perf_counter() - started
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "seconds": round(seconds, 2),
+        "documents": len(documents),
+        "nodes": len(nodes),
+        "heap_peak_mb": round(peak / 2**20, 1),
+        "heap_retained_mb": round(retained / 2**20, 1),
+        # ru_maxrss is in KiB on Linux
+        "rss_growth_mb": round((rss_after - rss_before) / 1024, 1),
+    }
+
+def measure(mode: str, path: str, filename: str) -> Dict:
+    """run_pipeline in a fresh interpreter so RSS high-water marks are independent"""
+    output = subprocess.run(
+        [sys.executable, __file__, "--measure", mode, path, filename],
+        capture_output=True, text=True, check=True, cwd=str(repo_root),
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def parse_sizes(spec: str, cast=int) -> List:
+    return [cast(value) for value in spec.split(",") if value.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of ingesting large uploads, by file size")
+    parser.add_argument("--pdf-pages", default="50,150,300", help="PDF sizes in pages")
+    parser.add_argument("--csv-rows", default="10000,40000", help="CSV sizes in rows")
+    parser.add_argument("--text-mb", default="1,4", help="Text file sizes in MiB")
+    parser.add_argument("--report", help="Write results as JSON to this file")
+    parser.add_argument("--measure", nargs=3, metavar=("MODE", "PATH", "FILENAME"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(run_pipeline(*args.measure)))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        cases = (
+            [(f"act_{pages}p.pdf", write_pdf, pages, f"{pages} pages") for pages in parse_sizes(args.pdf_pages)] +
+            [(f"register_{rows}.csv", write_csv, rows, f"{rows} rows") for rows in parse_sizes(args.csv_rows)] +
+            [(f"notes_{mb:g}mb.txt", write_text, mb, f"{mb:g} MiB text") for mb in parse_sizes(args.text_mb, float)]
+        )
+        print(f"{'file':<22} {'size MiB':>8}  {'mode':<11} {'nodes':>6} {'heap peak':>10} "
+              f"{'retained':>9} {'overhead':>9} {'RSS +':>8} {'time':>6}")
+        for filename, write, size, label in cases:
+            path = os.path.join(workdir, filename)
+            write(path, size)
+            file_mb = os.path.getsize(path) / 2**20
+            for mode in ("whole_file", "streaming"):
+                result = measure(mode, path, filename)
+                result.update({"file": filename, "size": label, "file_mb": round(file_mb, 2), "mode": mode})
+                results.append(result)
+                overhead = result["heap_peak_mb"] - result["heap_retained_mb"]
+                print(f"{filename:<22} {file_mb:>8.2f}  {mode:<11} {result['nodes']:>6} "
+                      f"{result['heap_peak_mb']:>8.1f}MB {result['heap_retained_mb']:>7.1f}MB "
+                      f"{overhead:>7.1f}MB {result['rss_growth_mb']:>6.1f}MB {result['seconds']:>5.1f}s")
+
+    print("\noverhead = heap peak minus what ends up in the index: the working set of parsing and chunking")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Report written to {args.report}")
+
+if __name__ == "__main__":
+    main()
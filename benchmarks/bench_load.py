@@ -0,0 +1,312 @@
+# bench_load.py - Offline load test of the app against local Azure OpenAI and Twilio stand-ins
+#
+# Usage:
+#     python benchmarks/bench_load.py [--rps 10] [--duration 60] [--mix chat=0.5,translate=0.2,whatsapp=0.25,send=0.05]
+#                                     [--chat SPEC] [--embedding SPEC] [--twilio SPEC] [--workers N]
+#                                     [--app-url URL] [--rate-limits] [--report report.json]
+#
+# Starts the stub servers (see stub_servers.py), launches the app with uvicorn
+# pointed at them and drives mixed /chat, /translate, /webhook/whatsapp and
+# /send-whatsapp traffic at a fixed arrival rate (open loop: latency is
+# measured from each request's scheduled start, so a stalled server cannot
+# hide its queueing). Reports throughput, p50/p95/p99 latency and error rates
+# per endpoint. No Azure quota or Twilio messages are used.
+#
+# "errors" are transport failures and non-2xx responses; "degraded" are 200
+# responses carrying the app's fallback message after an upstream failure.
+#
+# All traffic comes from one address and a few sessions, so the launched app
+# runs with rate limiting off; --rate-limits turns it on (the default
+# RATE_LIMITS, keyed on the socket address) to measure 429s under load. The
+# app always gets its own bucket table so it never shares state with another
+# app on the machine.
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import tempfile
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+from twilio.request_validator import RequestValidator
+
+# Add the repository root to Python path
+repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_root))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from stub_servers import add_behaviour_arguments, servers_from_args
+
+STUB_ACCOUNT_SID = "AC" + "0" * 32
+STUB_AUTH_TOKEN = "stub-auth-token"
+
+TRANSLATE_TEXTS = [
+    "Please bring your citizenship ID card to the office.",
+    "The office is open from 9 AM to 5 PM on weekdays.",
+    "Your application has been received and is being processed.",
+    "Emergency contacts",
+]
+
+def load_questions() -> List[str]:
+    """Citizen questions from the query type evaluation set"""
+    path = repo_root / "benchmarks" / "query_type_eval.jsonl"
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["message"] for line in f if line.strip()]
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - {"chat", "translate", "whatsapp", "send"}
+    if unknown:
+        raise ValueError(f"Unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+class Result:
+    __slots__ = ("endpoint", "latency", "outcome")
+
+    def __init__(self, endpoint: str, latency: float, outcome: str):
+        self.endpoint = endpoint
+        self.latency = latency
+        self.outcome = outcome
+
+class TrafficGenerator:
+    """Builds and sends one request of each kind"""
+
+    def __init__(self, client: httpx.AsyncClient, base_url: str, sessions: int, seed: int):
+        self.client = client
+        self.base_url = base_url
+        self.sessions = sessions
+        self.rng = random.Random(seed)
+        self.questions = load_questions()
+        self.validator = RequestValidator(STUB_AUTH_TOKEN)
+
+    async def chat(self) -> str:
+        session = self.rng.randrange(self.sessions)
+        response = await self.client.post("/chat", json={
+            "session_id": f"load-{session}",
+            "message": self.rng.choice(self.questions),
+        })
+        if response.status_code != 200:
+            return f"http_{response.status_code}"
+        debug_info = response.json().get("debug_info") or []
+        return "degraded" if any("Chat engine error" in str(item) for item in debug_info) else "ok"
+
+    async def translate(self) -> str:
+        response = await self.client.post("/translate", json={"text": self.rng.choice(TRANSLATE_TEXTS)})
+        if response.status_code != 200:
+            return f"http_{response.status_code}"
+        return "degraded" if response.json().get("status") == "error" else "ok"
+
+    async def whatsapp(self) -> str:
+        session = self.rng.randrange(self.sessions)
+        form = {
+            "From": f"whatsapp:+9751700{session:04d}",
+            "To": "whatsapp:+14155238886",
+            "Body": self.rng.choice(self.questions),
+            "ProfileName": f"Load {session}",
+            "MessageSid": f"SM{self.rng.getrandbits(128):032x}",
+        }
+        url = f"{self.base_url}/webhook/whatsapp"
+        response = await self.client.post(
+            "/webhook/whatsapp", data=form,
+            headers={"X-Twilio-Signature": self.validator.compute_signature(url, form)},
+        )
+        if response.status_code != 200:
+            return f"http_{response.status_code}"
+        return "degraded" if "technical difficulties" in response.text else "ok"
+
+    async def send(self) -> str:
+        response = await self.client.post("/send-whatsapp", data={
+            "to_number": f"+9751700{self.rng.randrange(self.sessions):04d}",
+            "message": "Your passport application is ready for collection.",
+        })
+        if response.status_code != 200:
+            return f"http_{response.status_code}"
+        return "ok" if response.json().get("status") == "sent" else "degraded"
+
+async def timed(generator: TrafficGenerator, endpoint: str, scheduled: float, results: List[Result]):
+    try:
+        outcome = await getattr(generator, endpoint)()
+    except httpx.TimeoutException:
+        outcome = "timeout"
+    except httpx.HTTPError as e:
+        outcome = type(e).__name__
+    results.append(Result(endpoint, time.perf_counter() - scheduled, outcome))
+
+async def run_load(base_url: str, rps: float, duration: float, warmup: float, mix: Dict[str, float],
+                   sessions: int, timeout: float, poisson: bool, seed: int) -> List[Result]:
+    """Send requests at rps for warmup + duration seconds; returns results after warmup"""
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        generator = TrafficGenerator(client, base_url, sessions, seed)
+        rng = random.Random(seed + 1)
+        endpoints, weights = zip(*mix.items())
+        warmup_results: List[Result] = []
+        results: List[Result] = []
+        tasks = []
+
+        started = time.perf_counter()
+        scheduled = started
+        while scheduled - started < warmup + duration:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            target = warmup_results if scheduled - started < warmup else results
+            endpoint = rng.choices(endpoints, weights)[0]
+            tasks.append(asyncio.create_task(timed(generator, endpoint, scheduled, target)))
+            scheduled += rng.expovariate(rps) if poisson else 1.0 / rps
+
+        await asyncio.gather(*tasks)
+        return results
+
+def summarize(results: List[Result], duration: float) -> Dict[str, Dict]:
+    by_endpoint: Dict[str, List[Result]] = {}
+    for result in results:
+        by_endpoint.setdefault(result.endpoint, []).append(result)
+    by_endpoint["all"] = results
+
+    report = {}
+    for endpoint, items in by_endpoint.items():
+        if not items:
+            continue
+        latencies = np.array([item.latency for item in items]) * 1000
+        outcomes: Dict[str, int] = {}
+        for item in items:
+            outcomes[item.outcome] = outcomes.get(item.outcome, 0) + 1
+        errors = sum(count for outcome, count in outcomes.items() if outcome not in ("ok", "degraded"))
+        report[endpoint] = {
+            "requests": len(items),
+            "throughput_rps": len(items) / duration,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+            "error_rate": errors / len(items),
+            "degraded_rate": outcomes.get("degraded", 0) / len(items),
+            "outcomes": outcomes,
+        }
+    return report
+
+def print_report(report: Dict[str, Dict], stub_stats: Optional[Dict[str, Dict[str, int]]]):
+    print(f"\n{'endpoint':10s} {'reqs':>6s} {'rps':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} "
+          f"{'errors':>7s} {'degraded':>8s}")
+    for endpoint, row in report.items():
+        print(f"{endpoint:10s} {row['requests']:6d} {row['throughput_rps']:7.2f} {row['p50_ms']:8.1f} "
+              f"{row['p95_ms']:8.1f} {row['p99_ms']:8.1f} {row['error_rate']:7.1%} {row['degraded_rate']:8.1%}")
+    if stub_stats:
+        print("\nStub responses by status:")
+        for service, counts in stub_stats.items():
+            print(f"  {service:10s} " + (", ".join(f"{status}: {n}" for status, n in sorted(counts.items())) or "-"))
+
+def launch_app(stub_url: str, port: int, workers: int, cache_dir: str,
+               rate_limits: bool = False) -> subprocess.Popen:
+    """Start the app with uvicorn, configured to use the stubs"""
+    env = dict(os.environ)
+    env.update({
+        "AZURE_API_KEY": "stub-key",
+        "AZURE_ENDPOINT": stub_url,
+        "AZURE_ENDPOINT_EMBEDDING": stub_url,
+        "AZURE_API_VERSION": "2024-05-01-preview",
+        "TWILIO_ACCOUNT_SID": STUB_ACCOUNT_SID,
+        "TWILIO_AUTH_TOKEN": STUB_AUTH_TOKEN,
+        "TWILIO_PHONE_NUMBER": "+14155238886",
+        "TWILIO_API_BASE_URL": stub_url,
+        # Stub embeddings must not overwrite the real classifier centroid cache
+        "QUERY_CLASSIFIER_CACHE_PATH": os.path.join(cache_dir, "query_classifier_centroids.json"),
+        "RATE_LIMIT_STORE_PATH": os.path.join(cache_dir, "rate_limits.bin"),
+        "RATE_LIMIT_ENABLED": "true" if rate_limits else "false",
+        "TRUSTED_PROXY_COUNT": "0",
+    })
+    command = [sys.executable, "-m", "uvicorn", "application:app", "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=str(repo_root), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def wait_until_ready(base_url: str, process: Optional[subprocess.Popen], timeout: float):
+    """uvicorn only accepts connections once the startup event (index build) has finished"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"App exited with code {process.returncode} during startup")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"App not ready after {timeout:.0f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test against local Azure OpenAI and Twilio stubs")
+    parser.add_argument("--rps", type=float, default=10.0, help="Target request rate")
+    parser.add_argument("--duration", type=float, default=60.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Unmeasured seconds before measuring")
+    parser.add_argument("--mix", default="chat=0.5,translate=0.2,whatsapp=0.25,send=0.05",
+                        help="Endpoint weights (chat, translate, whatsapp, send)")
+    parser.add_argument("--sessions", type=int, default=50, help="Distinct chat sessions / phone numbers")
+    parser.add_argument("--poisson", action="store_true", help="Poisson arrivals instead of evenly spaced")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the traffic")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the launched app")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--startup-timeout", type=float, default=300.0, help="Seconds to wait for the app")
+    parser.add_argument("--app-url", help="Load an already running app instead of launching one")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="Keep the launched app's rate limits on (429s count as errors)")
+    parser.add_argument("--report", help="Also write the report as JSON to this path")
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    stubs = None
+    process = None
+    with tempfile.TemporaryDirectory() as cache_dir:
+        try:
+            if args.app_url:
+                base_url = args.app_url.rstrip("/")
+            else:
+                stubs = servers_from_args(args).start()
+                print(f"Stub servers on {stubs.url}")
+                for name, behaviour in stubs.behaviours.items():
+                    print(f"  {name:10s} {behaviour}")
+                process = launch_app(stubs.url, args.port, args.workers, cache_dir, args.rate_limits)
+                base_url = f"http://127.0.0.1:{args.port}"
+            print(f"Waiting for the app at {base_url} ...")
+            wait_until_ready(base_url, process, args.startup_timeout)
+            if stubs is not None:
+                # Only count traffic caused by the load, not the index build
+                stubs.stats = {name: {} for name in stubs.behaviours}
+
+            print(f"Sending {args.rps:g} req/s for {args.warmup:g}s warmup + {args.duration:g}s "
+                  f"({', '.join(f'{k}={v:g}' for k, v in mix.items())})")
+            results = asyncio.run(run_load(base_url, args.rps, args.duration, args.warmup, mix,
+                                           args.sessions, args.timeout, args.poisson, args.seed))
+        finally:
+            if process is not None:
+                process.send_signal(signal.SIGINT)
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            if stubs is not None:
+                stubs.stop()
+
+    report = summarize(results, args.duration)
+    print_report(report, stubs.stats if stubs is not None else None)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "endpoints": report,
+                       "stubs": stubs.stats if stubs is not None else None}, f, indent=2)
+        print(f"\nReport written to {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# bench_metadata_overhead.py - Tokens and memory spent on document metadata
+#
+# Usage:
+#     python benchmarks/bench_metadata_overhead.py [--report report.json]
+#
+# Loads the knowledge base with the earlier loader's metadata ("full": the
+# parsed JSON copied into every document and all keys embedded and prompted)
+# and with DocumentLoader's current policy ("lean"), splits it with the
+# production splitter and reports chunks, tokens sent to the embedding model
+# at ingestion, LLM-visible tokens per chunk and for a top-2 prompt, and the
+# memory and serialized size of the resulting index. Embeddings are an
+# in-process stand-in with Azure's 1536 dimensions.
+import sys
+import json
+import logging
+import argparse
+import tracemalloc
+from pathlib import Path
+
+# Add the repository root to Python path
+repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_root))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode
+from llama_index.core.utilities.token_counting import TokenCounter
+
+from eval_retrieval import load_documents
+
+def measure(metadata_mode: str, token_counter: TokenCounter) -> dict:
+    documents = load_documents(metadata_mode)
+    nodes = SentenceSplitter(chunk_size=2048, chunk_overlap=200).get_nodes_from_documents(documents)
+
+    embed_tokens = [token_counter.get_string_tokens(node.get_content(metadata_mode=MetadataMode.EMBED))
+                    for node in nodes]
+    llm_tokens = sorted((token_counter.get_string_tokens(node.get_content(metadata_mode=MetadataMode.LLM))
+                         for node in nodes), reverse=True)
+    text_tokens = sum(token_counter.get_string_tokens(node.get_content(metadata_mode=MetadataMode.NONE))
+                      for node in nodes)
+
+    tracemalloc.start()
+    index = VectorStoreIndex(nodes)
+    index_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    serialized = len(json.dumps(index.storage_context.to_dict()))
+
+    return {
+        "documents": len(documents),
+        "nodes": len(nodes),
+        "embedding_tokens": sum(embed_tokens),
+        "metadata_share_of_embedding": round(1 - text_tokens / sum(embed_tokens), 3),
+        "llm_tokens_per_chunk": round(sum(llm_tokens) / len(nodes), 1),
+        "llm_tokens_top2_worst": sum(llm_tokens[:2]),
+        "index_memory_mb": round(index_bytes / 2**20, 2),
+        "index_serialized_mb": round(serialized / 2**20, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokens and memory spent on document metadata")
+    parser.add_argument("--report", help="Also write results as JSON to this path")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    Settings.embed_model = MockEmbedding(embed_dim=1536)
+    token_counter = TokenCounter()
+
+    results = {mode: measure(mode, token_counter) for mode in ("full", "lean")}
+    print(f"{'':28s} {'full':>10s} {'lean':>10s} {'saving':>8s}")
+    for key in results["full"]:
+        full, lean = results["full"][key], results["lean"][key]
+        saving = f"{1 - lean / full:8.1%}" if full and key != "metadata_share_of_embedding" else ""
+        print(f"{key:28s} {full:>10} {lean:>10} {saving}")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Report written to {args.report}")
+
+if __name__ == "__main__":
+    main()
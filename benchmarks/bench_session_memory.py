@@ -0,0 +1,101 @@
+# bench_session_memory.py - Memory and setup time per chat session
+#
+# Usage:
+#     python benchmarks/bench_session_memory.py [--sessions N]
+#
+# Compares building a retriever, memory and CondensePlusContextChatEngine per
+# session (with a freshly concatenated citizen system prompt) against
+# IndexManager's shared engine with a small ChatSession record per session.
+# Runs offline: embeddings and the LLM are in-process stand-ins.
+import io
+import sys
+import time
+import logging
+import argparse
+import tracemalloc
+import contextlib
+from pathlib import Path
+
+# Add the repository root to Python path
+repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_root))
+
+from llama_index.core import Document, Settings
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.llms import MockLLM
+from llama_index.core.memory import ChatMemoryBuffer
+
+from document_loader import DocumentLoader
+from druk_system_prompt import DRUK_SYSTEM_PROMPT
+from index_manager import IndexManager
+from llamaindexchatengine import CondensePlusContextChatEngine
+
+DZONGKHAGS = ["Thimphu", "Paro", "Punakha", "Bumthang", "Chukha", "Trashigang"]
+
+def citizen_context(i: int) -> dict:
+    return {"platform": "whatsapp", "phone_number": f"whatsapp:+9751700{i:04d}",
+            "dzongkhag": DZONGKHAGS[i % len(DZONGKHAGS)], "age": 20 + i % 40}
+
+def per_session_engine(index_manager: IndexManager, i: int):
+    """How each session was set up before the shared engine"""
+    context = citizen_context(i)
+    # get_citizen_context_prompt used to concatenate the full prompt per session
+    system_prompt = DRUK_SYSTEM_PROMPT + f"""
+## Citizen Context
+- Language preference: English
+- Age group considerations: {"Young adult services" if context["age"] < 30 else "General services"}
+- Location: {context["dzongkhag"]} - prioritize local office information"""
+    return CondensePlusContextChatEngine.from_defaults(
+        retriever=index_manager.global_index.as_retriever(similarity_top_k=2),
+        memory=ChatMemoryBuffer.from_defaults(token_limit=500),
+        system_prompt=system_prompt,
+        query_embedding_cache=index_manager.query_embedding_cache,
+    )
+
+def shared_engine_session(index_manager: IndexManager, i: int):
+    return index_manager.init_chat_engine(f"session-{i}", citizen_context(i))[0]
+
+def measure(name: str, build, sessions: int) -> list:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    built = [build(i) for i in range(sessions)]
+    elapsed = time.perf_counter() - started
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print(f"{name:32s} {allocated / sessions / 1024:8.1f} KiB/session  "
+          f"{elapsed / sessions * 1e6:8.0f} us/session")
+    return built
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and setup time per chat session")
+    parser.add_argument("--sessions", type=int, default=1000, help="Sessions to create")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    index_manager = IndexManager(DocumentLoader(), "offline", "https://localhost", "2024-02-01", "https://localhost")
+    Settings.llm = index_manager.llm = MockLLM(max_tokens=64)
+    Settings.embed_model = index_manager.embed_model = MockEmbedding(embed_dim=64)
+    index_manager.global_documents = [
+        Document(text=f"Service {i}: apply at the regional office with your CID.") for i in range(20)
+    ]
+    index_manager.global_index_needs_update = True
+    index_manager.get_chat_engine()
+
+    print(f"Creating {args.sessions} sessions")
+    engines = measure("engine per session", lambda i: per_session_engine(index_manager, i), args.sessions)
+    del engines
+    sessions = measure("shared engine + ChatSession", lambda i: shared_engine_session(index_manager, i), args.sessions)
+
+    # One turn per session through the shared engine
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for session in sessions[:100]:
+            session.chat("How do I apply for a passport?")
+    print(f"shared engine turn (mock LLM):   {(time.perf_counter() - started) / 100 * 1e3:8.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# bench_turn_overhead.py - Per-turn chat engine overhead, excluding network time
+#
+# Usage:
+#     python benchmarks/bench_turn_overhead.py [--turns N] [--history-turns N]
+#
+# Compares rebuilding the synthesis prompt on every turn (prefix messages via
+# get_prefix_messages_with_context, a new synthesizer via
+# get_response_synthesizer, a budget computed by tokenizing the whole prompt)
+# with the engine's cached prefixes and token counts. The LLM and retriever
+# are in-process stand-ins, so the numbers are pure Python overhead.
+import sys
+import time
+import logging
+import argparse
+from pathlib import Path
+
+# Add the repository root to Python path
+repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_root))
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.chat_engine.utils import (
+    get_prefix_messages_with_context,
+    get_response_synthesizer,
+)
+from llama_index.core.llms import MockLLM
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from druk_system_prompt import get_citizen_context_prompt
+from llamaindexchatengine import CondensePlusContextChatEngine
+from summary_memory import RollingSummaryMemory
+
+NODE_TEXT = (
+    "To apply for a passport, visit the Department of Immigration in Thimphu. "
+    "Bring your citizenship ID card, two passport photos and the fee of Nu. 500. "
+) * 12
+
+class StaticRetriever(BaseRetriever):
+    """Returns the same two large chunks for every query"""
+
+    def __init__(self):
+        super().__init__()
+        self.nodes = [
+            NodeWithScore(node=TextNode(text=f"Chunk {i}. {NODE_TEXT}"), score=0.9 - i * 0.1)
+            for i in range(2)
+        ]
+
+    def _retrieve(self, query_bundle):
+        return list(self.nodes)
+
+def make_history(turns: int) -> list:
+    history = []
+    for i in range(turns):
+        history.append(ChatMessage(role=MessageRole.USER, content=f"Question {i} about passport fees and documents?"))
+        history.append(ChatMessage(role=MessageRole.ASSISTANT, content=f"Answer {i}: " + "details " * 60))
+    return history
+
+def time_per_call(fn, repeats: int) -> float:
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - started) / repeats * 1e6
+
+def uncached_turn(engine, history, message, nodes):
+    """The per-turn work before prefixes and token counts were cached"""
+    system_prompt = engine._system_prompt or ""
+    qa_messages = get_prefix_messages_with_context(
+        engine._context_prompt_template, system_prompt, [], history, engine._llm.metadata.system_role
+    )
+    refine_messages = get_prefix_messages_with_context(
+        engine._context_refine_prompt_template, system_prompt, [], history, engine._llm.metadata.system_role
+    )
+    synthesizer = get_response_synthesizer(engine._llm, engine.callback_manager, qa_messages, refine_messages)
+    templates = (synthesizer._text_qa_template, synthesizer._refine_template)
+    packer = engine._context_packer
+    budget = packer.context_budget(templates, message)
+    packer._node_tokens.clear()
+    return packer.pack(nodes, budget, message)
+
+def cached_turn(engine, history, message, nodes):
+    """The per-turn work with cached prefixes and token counts"""
+    templates = engine._get_synthesis_templates(history)
+    engine._get_response_synthesizer(templates)
+    return engine._pack_context(message, message, history, nodes)
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-turn chat engine overhead")
+    parser.add_argument("--turns", type=int, default=300, help="Repetitions per measurement")
+    parser.add_argument("--history-turns", type=int, default=4, help="User/assistant pairs in history")
+    args = parser.parse_args()
+
+    # Per-turn token logging would dominate the timings
+    logging.disable(logging.INFO)
+
+    llm = MockLLM(max_tokens=64)
+    retriever = StaticRetriever()
+    engine = CondensePlusContextChatEngine.from_defaults(
+        retriever,
+        llm=llm,
+        memory=RollingSummaryMemory.from_defaults(llm=llm),
+        system_prompt=get_citizen_context_prompt({"dzongkhag": "Thimphu", "age": 28}),
+    )
+    history = make_history(args.history_turns)
+    message = "How much is the passport fee and what documents do I need?"
+
+    print(f"History: {len(history)} messages, {args.turns} repetitions")
+    uncached = time_per_call(lambda: uncached_turn(engine, history, message, retriever.nodes), args.turns)
+    cached = time_per_call(lambda: cached_turn(engine, history, message, retriever.nodes), args.turns)
+    print(f"prompt + synthesizer + packing, rebuilt every turn: {uncached:8.0f} us")
+    print(f"prompt + synthesizer + packing, cached:             {cached:8.0f} us")
+    print(f"speedup: {uncached / cached:.1f}x")
+
+    # Whole turns through the engine with a zero-latency LLM
+    engine.memory.set(history)
+    full = time_per_call(lambda: engine.chat(message), max(1, args.turns // 10))
+    print(f"full engine.chat turn (mock LLM, no network):       {full:8.0f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# bench_twilio_transport.py - Event loop latency and send throughput of the Twilio transports
+#
+# Usage:
+#     python benchmarks/bench_twilio_transport.py [--sends 300] [--concurrency 20]
+#                                                 [--twilio SPEC] [--report report.json]
+#
+# Starts the Twilio stand-in from stub_servers.py and sends the same messages
+# from `--concurrency` async callers (like concurrent /send-whatsapp requests
+# or broadcast senders) three ways:
+#
+#     sync_client      twilio.rest.Client.messages.create inside async def
+#                      (how send_whatsapp_message worked before)
+#     sync_threadpool  the same Client call moved to the threadpool
+#     async_pooled     twilio_transport.AsyncTwilioClient (one keep-alive pool)
+#
+# While the sends run, a probe task sleeps 5 ms at a time and records how late
+# it wakes up: the time any other request on the same worker would wait for
+# the event loop. Reports sends/sec, send latency, loop lag and the number of
+# TCP connections the stand-in accepted. The stand-in runs in its own process
+# so its request handling doesn't compete with the client for the GIL. No
+# Twilio messages are sent.
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+
+# Add the repository root to Python path
+repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_root))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import httpx
+
+STUB_ACCOUNT_SID = "AC" + "0" * 32
+STUB_AUTH_TOKEN = "stub-auth-token"
+SENDER = "whatsapp:+14155238886"
+MESSAGE = "The Thimphu passport office is closed on Friday for the national holiday."
+
+PROBE_INTERVAL = 0.005
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_stub(twilio_spec: str) -> (subprocess.Popen, str):
+    """The Twilio stand-in in a subprocess, once it answers"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve().parent / "stub_servers.py"),
+         "--port", str(port), "--twilio", twilio_spec],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(f"{url}/stats", timeout=1.0)
+            return process, url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Twilio stand-in did not start")
+
+def stub_connections(url: str) -> int:
+    return httpx.get(f"{url}/stats").json()["connections"]
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    data = np.asarray(values) * 1000
+    return {"p50": round(float(np.percentile(data, 50)), 1),
+            "p95": round(float(np.percentile(data, 95)), 1),
+            "p99": round(float(np.percentile(data, 99)), 1),
+            "max": round(float(data.max()), 1)}
+
+def sync_sender(base_url: str) -> Callable:
+    from twilio.rest import Client
+
+    client = Client(STUB_ACCOUNT_SID, STUB_AUTH_TOKEN)
+    client.api.base_url = base_url
+
+    async def send(to: str):
+        client.messages.create(body=MESSAGE, from_=SENDER, to=to)
+    return send
+
+def threadpool_sender(base_url: str) -> Callable:
+    from twilio.rest import Client
+    from fastapi.concurrency import run_in_threadpool
+
+    client = Client(STUB_ACCOUNT_SID, STUB_AUTH_TOKEN)
+    client.api.base_url = base_url
+
+    async def send(to: str):
+        await run_in_threadpool(client.messages.create, body=MESSAGE, from_=SENDER, to=to)
+    return send
+
+def async_sender(base_url: str, concurrency: int) -> Callable:
+    from twilio_transport import AsyncTwilioClient
+
+    client = AsyncTwilioClient(STUB_ACCOUNT_SID, STUB_AUTH_TOKEN, base_url=base_url, max_concurrency=concurrency)
+
+    async def send(to: str):
+        await client.send_message(to, MESSAGE, SENDER)
+    send.aclose = client.aclose
+    return send
+
+async def run_mode(send: Callable, sends: int, concurrency: int) -> Dict:
+    """Send `sends` messages from `concurrency` callers while probing loop lag"""
+    lags: List[float] = []
+    latencies: List[float] = []
+    errors = 0
+    done = asyncio.Event()
+
+    async def probe():
+        while not done.is_set():
+            expected = time.perf_counter() + PROBE_INTERVAL
+            await asyncio.sleep(PROBE_INTERVAL)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(sends):
+        queue.put_nowait(f"whatsapp:+9751700{i:04d}")
+
+    async def caller():
+        nonlocal errors
+        while not queue.empty():
+            to = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                await send(to)
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                errors += 1
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.sleep(PROBE_INTERVAL * 2)
+    started = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await probe_task
+    if hasattr(send, "aclose"):
+        await send.aclose()
+    return {
+        "seconds": round(elapsed, 2),
+        "sends_per_second": round(len(latencies) / elapsed, 1),
+        "errors": errors,
+        "send_ms": percentiles(latencies),
+        "loop_lag_ms": percentiles(lags),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Event loop latency and send throughput of the Twilio transports")
+    parser.add_argument("--sends", type=int, default=300, help="Messages sent per transport")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent async callers")
+    parser.add_argument("--twilio", default="median_ms=150,sigma=0.3", help="Twilio stand-in behaviour")
+    parser.add_argument("--modes", default="sync_client,sync_threadpool,async_pooled",
+                        help="Transports to compare")
+    parser.add_argument("--report", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    stub, url = start_stub(args.twilio)
+    factories = {
+        "sync_client": lambda: sync_sender(url),
+        "sync_threadpool": lambda: threadpool_sender(url),
+        "async_pooled": lambda: async_sender(url, args.concurrency),
+    }
+    print(f"Twilio stand-in: {args.twilio}; {args.sends} sends from {args.concurrency} callers\n")
+    print(f"{'transport':<16} {'sends/s':>8} {'send p50':>9} {'send p95':>9} "
+          f"{'lag p50':>8} {'lag p99':>8} {'lag max':>8} {'conns':>6} {'errors':>6}")
+
+    results = []
+    try:
+        for mode in filter(None, (m.strip() for m in args.modes.split(","))):
+            send = factories[mode]()
+            connections_before = stub_connections(url)
+            result = asyncio.run(run_mode(send, args.sends, args.concurrency))
+            result.update({"transport": mode, "connections": stub_connections(url) - connections_before - 1})
+            results.append(result)
+            print(f"{mode:<16} {result['sends_per_second']:>8.1f} {result['send_ms']['p50']:>7.1f}ms "
+                  f"{result['send_ms']['p95']:>7.1f}ms {result['loop_lag_ms']['p50']:>6.1f}ms "
+                  f"{result['loop_lag_ms']['p99']:>6.1f}ms {result['loop_lag_ms']['max']:>6.1f}ms "
+                  f"{result['connections']:>6} {result['errors']:>6}")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print("\nlag = how late a 5 ms timer fires on the same event loop while the sends run")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Report written to {args.report}")
+
+if __name__ == "__main__":
+    main()
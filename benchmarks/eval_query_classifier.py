@@ -0,0 +1,132 @@
+# eval_query_classifier.py - Accuracy/latency of keyword vs embedding query classification
+#
+# Usage:
+#     python benchmarks/eval_query_classifier.py [eval_set.jsonl]
+#
+# The embedding classifier uses Azure embeddings when the credentials are
+# configured and MODEL_PROVIDER is not "offline"; otherwise it runs on the
+# offline provider's hashed n-gram embeddings, so the comparison with the
+# keyword rules is always reported.
+import os
+import sys
+import json
+import time
+import tempfile
+from pathlib import Path
+from collections import Counter
+
+# Add the repository root to Python path
+repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_root))
+
+from dotenv import load_dotenv
+from kb_utils import normalize_text
+from query_classifier import QueryClassifier, keyword_query_type, DEFAULT_CENTROID_CACHE_PATH, LABEL_EXAMPLES
+
+DEFAULT_EVAL_SET = Path(__file__).resolve().parent / "query_type_eval.jsonl"
+
+def load_eval_set(path: Path) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def check_held_out(examples: list):
+    """The eval set must not contain the classifier's few-shot examples"""
+    training = {normalize_text(text) for texts in LABEL_EXAMPLES.values() for text in texts}
+    overlap = [example["message"] for example in examples if normalize_text(example["message"]) in training]
+    if overlap:
+        raise SystemExit(f"Eval queries that are also few-shot examples: {overlap}")
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def evaluate(name: str, classify, examples: list) -> dict:
+    """Run a classifier over the eval set and print accuracy and latency"""
+    correct = 0
+    per_label_total, per_label_correct = Counter(), Counter()
+    latencies = []
+    mistakes = []
+
+    for example in examples:
+        started = time.perf_counter()
+        predicted = classify(example["message"])
+        latencies.append(time.perf_counter() - started)
+
+        per_label_total[example["label"]] += 1
+        if predicted == example["label"]:
+            correct += 1
+            per_label_correct[example["label"]] += 1
+        else:
+            mistakes.append((example["message"], example["label"], predicted))
+
+    accuracy = correct / len(examples)
+    print(f"\n== {name} ==")
+    print(f"accuracy: {accuracy:.1%} ({correct}/{len(examples)})")
+    print(f"latency:  p50 {percentile(latencies, 0.5) * 1000:.3f} ms, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.3f} ms")
+    for label in sorted(per_label_total):
+        print(f"  {label:16s} {per_label_correct[label]}/{per_label_total[label]}")
+    for message, expected, predicted in mistakes:
+        print(f"  miss: {message!r} expected {expected}, got {predicted}")
+
+    return {"accuracy": accuracy, "latencies": latencies}
+
+def build_embed_model():
+    """
+    Embedding model to evaluate and its description
+
+    Azure is configured like IndexManager; the offline provider is used
+    without credentials or when MODEL_PROVIDER=offline.
+    """
+    api_key = os.getenv("AZURE_API_KEY")
+    endpoint = os.getenv("AZURE_ENDPOINT_EMBEDDING")
+    if (os.getenv("MODEL_PROVIDER") or "azure").lower() == "offline" or not api_key or not endpoint:
+        from model_provider import get_model_provider
+
+        embed_model = get_model_provider("offline").create_embed_model()
+        return embed_model, f"offline {embed_model.model_name}"
+
+    from llama_index.embeddings.azure_openai import AzureOpenAIEmbedding
+    return AzureOpenAIEmbedding(
+        model="text-embedding-3-large",
+        deployment_name="text-embedding-3-large",
+        api_key=api_key,
+        azure_endpoint=endpoint,
+        api_version="2023-05-15",
+    ), "azure text-embedding-3-large"
+
+def main():
+    load_dotenv()
+    eval_path = Path(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_EVAL_SET
+    examples = load_eval_set(eval_path)
+    check_held_out(examples)
+    print(f"Evaluating {len(examples)} labelled queries from {eval_path}")
+
+    evaluate("keyword rules", keyword_query_type, examples)
+
+    embed_model, description = build_embed_model()
+    print(f"\nEmbedding model: {description}")
+    # Offline centroids go to a scratch file so they never replace the app's cache
+    cache_path = (os.path.join(tempfile.mkdtemp(), "query_centroids.json")
+                  if description.startswith("offline") else DEFAULT_CENTROID_CACHE_PATH)
+    classifier = QueryClassifier(embed_model_fn=lambda: embed_model, cache_path=cache_path)
+    if not classifier.initialize():
+        print("\nEmbedding classifier failed to initialize")
+        return
+
+    # Embed all queries up front so the timings below isolate classification
+    # cost; in the app this embedding is shared with retrieval
+    embeddings = dict(zip(
+        [example["message"] for example in examples],
+        embed_model.get_text_embedding_batch([example["message"] for example in examples])
+    ))
+    evaluate(
+        f"embedding centroids, {description} (excluding embedding call)",
+        lambda message: classifier.classify_embedding(embeddings[message]) or keyword_query_type(message),
+        examples
+    )
+    # What /chat pays per unrouted message: query embedding plus centroids
+    evaluate(f"embedding centroids, {description} (including embedding call)", classifier.classify, examples)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# eval_retrieval.py - Retrieval quality, prompt size and latency over the knowledge base
+#
+# Usage:
+#     python benchmarks/eval_retrieval.py [--eval-set retrieval_eval.jsonl]
+#         [--chunking sentence:256,sentence:512,sentence:1024,sentence:2048,document]
+#         [--metadata full,lean] [--retrievers vector,partitioned,keyword,hybrid,bm25] [--top-k 1,2,3,5]
+#         [--report report.json]
+#
+# Each question in the eval set names the knowledge base file that answers it
+# and a snippet of the answering section; a retrieved chunk is relevant when
+# it comes from that file and contains the snippet (chunks from the stale
+# *_old.json copies do not count). For every chunking strategy, metadata
+# mode and retriever type it reports recall@k, MRR, prompt tokens of the
+# top-k chunks per query and retrieval latency.
+#
+# "lean" metadata is what DocumentLoader produces today: only source and
+# category are embedded and shown to the LLM, and the raw JSON stays in its
+# file. "full" reproduces the earlier loader, which copied the parsed JSON
+# into every document's metadata and embedded and prompted all of it.
+# "partitioned" is the production PartitionedRetriever, routed by the
+# keyword query type of each question (the embedding classifier needs Azure).
+#
+# Runs offline with HashingEmbedding, so results are reproducible; absolute
+# recall is lower than with text-embedding-3-large but the comparison between
+# settings holds. The row marked * is the current production setting.
+import sys
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Add the repository root to Python path
+repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(repo_root))
+
+from llama_index.core import Settings, SimpleKeywordTableIndex, VectorStoreIndex
+from llama_index.core.llms import MockLLM
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.retrievers import QueryFusionRetriever
+from llama_index.core.schema import MetadataMode
+from llama_index.core.utilities.token_counting import TokenCounter
+
+from document_loader import DocumentLoader
+from offline_models import HashingEmbedding
+from partitioned_retriever import PartitionedRetriever, retrieval_scope
+from query_classifier import keyword_query_type
+
+DEFAULT_EVAL_SET = Path(__file__).resolve().parent / "retrieval_eval.jsonl"
+
+# Settings used by IndexManager / the shared chat engine
+PRODUCTION = ("sentence:2048", "lean", "partitioned", 2)
+
+def load_eval_set(path: Path) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def load_documents(metadata_mode: str) -> list:
+    loader = DocumentLoader()
+    documents, _ = loader.load_from_directory(str(repo_root / "knowledge_base"), recursive=True)
+    if metadata_mode == "full":
+        # The earlier loader: raw JSON inline and every key embedded and prompted
+        for document in documents:
+            payload = loader.load_payload(document.metadata)
+            if payload is not None:
+                document.metadata["original_data"] = payload
+            document.metadata.pop("payload_ref", None)
+            document.excluded_embed_metadata_keys = []
+            document.excluded_llm_metadata_keys = []
+    return documents
+
+def split_documents(documents: list, strategy: str) -> list:
+    """Nodes for a chunking strategy: "sentence:<chunk_size>" or "document" """
+    if strategy == "document":
+        splitter = SentenceSplitter(chunk_size=100000, chunk_overlap=0)
+    else:
+        chunk_size = int(strategy.split(":", 1)[1])
+        # Same ~10% overlap as Settings.chunk_overlap=200 for 2048-token chunks
+        splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_size // 10)
+    return splitter.get_nodes_from_documents(documents)
+
+def build_retriever(kind: str, nodes: list, top_k: int):
+    """A retriever of the given kind over nodes, or None if unavailable"""
+    if kind == "vector":
+        return VectorStoreIndex(nodes).as_retriever(similarity_top_k=top_k)
+    if kind == "partitioned":
+        return PartitionedRetriever(VectorStoreIndex(nodes), similarity_top_k=top_k)
+    if kind == "keyword":
+        return SimpleKeywordTableIndex(nodes).as_retriever(num_chunks_per_query=top_k)
+    if kind == "hybrid":
+        return QueryFusionRetriever(
+            [VectorStoreIndex(nodes).as_retriever(similarity_top_k=top_k),
+             SimpleKeywordTableIndex(nodes).as_retriever(num_chunks_per_query=top_k)],
+            similarity_top_k=top_k, num_queries=1, mode="reciprocal_rerank", use_async=False,
+        )
+    if kind == "bm25":
+        try:
+            from llama_index.retrievers.bm25 import BM25Retriever
+        except ImportError:
+            return None
+        return BM25Retriever.from_defaults(nodes=nodes, similarity_top_k=min(top_k, len(nodes)))
+    raise ValueError(f"Unknown retriever type: {kind}")
+
+def is_relevant(node, example: dict) -> bool:
+    if node.metadata.get("source") != example["source"]:
+        return False
+    snippet = example.get("contains")
+    return snippet is None or snippet.lower() in node.get_content().lower()
+
+def evaluate(retriever, examples: list, ks: List[int], token_counter: TokenCounter,
+             routed: bool = False) -> Dict:
+    """Recall@k, MRR, prompt tokens@k and latency over the eval set"""
+    hits = {k: 0 for k in ks}
+    tokens = {k: 0 for k in ks}
+    reciprocal_ranks = []
+    latencies = []
+    misses = []
+
+    for example in examples:
+        query_type = keyword_query_type(example["question"]) if routed else None
+        started = time.perf_counter()
+        with retrieval_scope(query_type):
+            results = retriever.retrieve(example["question"])
+        latencies.append(time.perf_counter() - started)
+
+        rank = next((i + 1 for i, result in enumerate(results) if is_relevant(result.node, example)), None)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+        if rank is None:
+            misses.append(example["question"])
+        chunk_tokens = [
+            token_counter.get_string_tokens(result.node.get_content(metadata_mode=MetadataMode.LLM))
+            for result in results
+        ]
+        for k in ks:
+            if rank is not None and rank <= k:
+                hits[k] += 1
+            tokens[k] += sum(chunk_tokens[:k])
+
+    n = len(examples)
+    return {
+        "recall": {k: hits[k] / n for k in ks},
+        "mrr": sum(reciprocal_ranks) / n,
+        "prompt_tokens": {k: tokens[k] / n for k in ks},
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency_p95_ms": percentile(latencies, 0.95) * 1000,
+        "misses": misses,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval quality and latency over the knowledge base")
+    parser.add_argument("--eval-set", type=Path, default=DEFAULT_EVAL_SET, help="Labelled questions (JSONL)")
+    parser.add_argument("--chunking", default="sentence:256,sentence:512,sentence:1024,sentence:2048,document",
+                        help="Chunking strategies")
+    parser.add_argument("--metadata", default="full,lean", help="Metadata modes (full, lean)")
+    parser.add_argument("--retrievers", default="vector,partitioned,keyword,hybrid,bm25", help="Retriever types")
+    parser.add_argument("--top-k", default="1,2,3,5", help="Cut-offs for recall and prompt tokens")
+    parser.add_argument("--embed-dim", type=int, default=1024, help="HashingEmbedding dimensions")
+    parser.add_argument("--show-misses", action="store_true", help="List questions with no relevant chunk")
+    parser.add_argument("--report", help="Also write results as JSON to this path")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    Settings.embed_model = HashingEmbedding(embed_dim=args.embed_dim)
+    # Only hybrid retrieval resolves an LLM, and with num_queries=1 it is never called
+    Settings.llm = MockLLM()
+
+    examples = load_eval_set(args.eval_set)
+    ks = sorted(int(k) for k in args.top_k.split(","))
+    token_counter = TokenCounter()
+    rows = []
+
+    print(f"{len(examples)} questions; recall@k and tokens@k for k = {', '.join(map(str, ks))}\n")
+    header = (f"  {'chunking':15s} {'metadata':8s} {'retriever':9s} {'nodes':>5s} "
+              + " ".join(f"{'R@' + str(k):>6s}" for k in ks) + f" {'MRR':>6s} "
+              + " ".join(f"{'tok@' + str(k):>7s}" for k in ks) + f" {'p50 ms':>7s} {'p95 ms':>7s}")
+    print(header)
+
+    for metadata_mode in args.metadata.split(","):
+        documents = load_documents(metadata_mode)
+        for strategy in args.chunking.split(","):
+            try:
+                nodes = split_documents(documents, strategy)
+            except ValueError as e:
+                # SentenceSplitter refuses chunks smaller than the node's metadata
+                print(f"  {strategy:15s} {metadata_mode:8s} skipped: {str(e).splitlines()[0][:70]}")
+                rows.append({"chunking": strategy, "metadata": metadata_mode, "skipped": str(e)})
+                continue
+
+            for kind in args.retrievers.split(","):
+                retriever = build_retriever(kind, nodes, max(ks))
+                if retriever is None:
+                    print(f"  {strategy:15s} {metadata_mode:8s} {kind:9s} skipped: "
+                          f"pip install llama-index-retrievers-bm25")
+                    continue
+                result = evaluate(retriever, examples, ks, token_counter, routed=kind == "partitioned")
+                marker = "*" if (strategy, metadata_mode, kind) == PRODUCTION[:3] else " "
+                print(f"{marker} {strategy:15s} {metadata_mode:8s} {kind:9s} {len(nodes):5d} "
+                      + " ".join(f"{result['recall'][k]:6.1%}" for k in ks) + f" {result['mrr']:6.3f} "
+                      + " ".join(f"{result['prompt_tokens'][k]:7.0f}" for k in ks)
+                      + f" {result['latency_p50_ms']:7.2f} {result['latency_p95_ms']:7.2f}")
+                if args.show_misses:
+                    for question in result["misses"]:
+                        print(f"      miss: {question}")
+                rows.append({"chunking": strategy, "metadata": metadata_mode, "retriever": kind,
+                             "nodes": len(nodes), **result})
+
+    print(f"\n* production: {PRODUCTION[0]}, {PRODUCTION[1]} metadata, {PRODUCTION[2]} retriever, "
+          f"similarity_top_k={PRODUCTION[3]}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"config": {k: str(v) for k, v in vars(args).items()}, "results": rows}, f, indent=2)
+        print(f"Report written to {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+# stub_servers.py - Local stand-ins for Azure OpenAI and Twilio's REST API
+#
+# Usage:
+#     python benchmarks/stub_servers.py [--port 9100] [--chat SPEC] [--embedding SPEC] [--twilio SPEC]
+#
+# One HTTP server answers:
+#     POST /openai/deployments/<deployment>/chat/completions
+#     POST /openai/deployments/<deployment>/embeddings
+#     POST /2010-04-01/Accounts/<sid>/Messages.json
+#     GET  /stats (responses per service and TCP connections accepted)
+#
+# Each service has its own behaviour SPEC, e.g.
+#     "median_ms=800,sigma=0.4,errors=0.01,throttle=0.02,retry_after=1"
+# Latency is log-normal around median_ms; a share of requests fail with
+# 500 (errors) or 429 with a Retry-After header (throttle). Embeddings are
+# deterministic per input text, so retrieval behaves the same on every run.
+import re
+import sys
+import json
+import time
+import uuid
+import base64
+import random
+import struct
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import numpy as np
+
+CHAT_PATH = re.compile(r"^/openai/deployments/[^/]+/chat/completions")
+EMBEDDING_PATH = re.compile(r"^/openai/deployments/[^/]+/embeddings")
+TWILIO_MESSAGES_PATH = re.compile(r"^/2010-04-01/Accounts/([^/]+)/Messages\.json")
+
+EMBEDDING_DIM = 256
+
+ANSWER = (
+    "Kuzuzangpo! To apply, visit the Department of Immigration in Thimphu with your "
+    "citizenship ID card, two passport photos and the fee of Nu. 500. Processing takes "
+    "about 10 working days. You can also check the status online. Tashi Delek!"
+)
+DZONGKHA_ANSWER = "ཀུ་ཟུ་ཟང་པོ། ཁྱོད་ཀྱི་ཞུ་ཡིག་ལག་ལེན་འཐབ་ཡོདཔ་ཨིན།"
+SUMMARY = "The citizen from Thimphu asked about passport fees and the documents needed."
+
+class StubBehaviour:
+    """Latency, error and throttling distribution of one stubbed service"""
+
+    def __init__(self, median_ms: float = 50.0, sigma: float = 0.3, errors: float = 0.0,
+                 throttle: float = 0.0, retry_after: float = 1.0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.errors = errors
+        self.throttle = throttle
+        self.retry_after = retry_after
+
+    @classmethod
+    def parse(cls, spec: str) -> "StubBehaviour":
+        """Build from "median_ms=800,sigma=0.4,errors=0.01,throttle=0.02" (any subset)"""
+        kwargs = {}
+        for part in filter(None, (p.strip() for p in spec.split(","))):
+            key, _, value = part.partition("=")
+            kwargs[key.strip()] = float(value)
+        return cls(**kwargs)
+
+    def sample(self, rng: random.Random) -> Tuple[float, int]:
+        """Delay in seconds and HTTP status for one request"""
+        delay = self.median_ms / 1000 * rng.lognormvariate(0, self.sigma) if self.median_ms > 0 else 0.0
+        roll = rng.random()
+        if roll < self.throttle:
+            return delay * 0.1, 429
+        if roll < self.throttle + self.errors:
+            return delay, 500
+        return delay, 200
+
+    def __repr__(self):
+        return (f"median {self.median_ms:g} ms, sigma {self.sigma:g}, "
+                f"errors {self.errors:.1%}, 429s {self.throttle:.1%}")
+
+def stub_embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    """Unit vector seeded by the text, identical across runs"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def _chat_reply(messages: List[Dict]) -> str:
+    """A plausible reply for the prompts the app sends"""
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    if "Follow Up Input:" in prompt:
+        # Condense: echo the follow-up question as the standalone question
+        return prompt.split("Follow Up Input:", 1)[1].split("\n", 1)[0].strip() or ANSWER
+    if "Dzongkha" in prompt and "Translation:" in prompt:
+        return DZONGKHA_ANSWER
+    if "Updated summary:" in prompt:
+        return SUMMARY
+    return ANSWER
+
+class StubServers:
+    """Azure OpenAI chat/embeddings and Twilio Messages stand-ins on one local port"""
+
+    def __init__(self, chat: Optional[StubBehaviour] = None, embedding: Optional[StubBehaviour] = None,
+                 twilio: Optional[StubBehaviour] = None, host: str = "127.0.0.1", port: int = 0,
+                 seed: int = 0):
+        self.behaviours = {
+            "chat": chat or StubBehaviour(median_ms=800, sigma=0.4),
+            "embedding": embedding or StubBehaviour(median_ms=40, sigma=0.3),
+            "twilio": twilio or StubBehaviour(median_ms=150, sigma=0.3),
+        }
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, int]] = {name: {} for name in self.behaviours}
+        # TCP connections accepted, to see how well clients reuse them
+        self.connections = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServers":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-servers", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _sample(self, service: str) -> Tuple[float, int]:
+        with self._rng_lock:
+            return self.behaviours[service].sample(self._rng)
+
+    def _count(self, service: str, status: int):
+        with self._stats_lock:
+            counts = self.stats[service]
+            counts[str(status)] = counts.get(str(status), 0) + 1
+
+    def _handler_class(self):
+        stubs = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without TCP_NODELAY a
+            # keep-alive client waits on delayed ACKs (~40 ms) for every response
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with stubs._stats_lock:
+                    stubs.connections += 1
+
+            def _send(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path != "/stats":
+                    self._send(404, {"error": {"message": f"No stub for {self.path}"}})
+                    return
+                with stubs._stats_lock:
+                    self._send(200, {"responses": stubs.stats, "connections": stubs.connections})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if CHAT_PATH.match(self.path):
+                    service = "chat"
+                elif EMBEDDING_PATH.match(self.path):
+                    service = "embedding"
+                elif TWILIO_MESSAGES_PATH.match(self.path):
+                    service = "twilio"
+                else:
+                    self._send(404, {"error": {"message": f"No stub for {self.path}"}})
+                    return
+
+                delay, status = stubs._sample(service)
+                time.sleep(delay)
+                stubs._count(service, status)
+                behaviour = stubs.behaviours[service]
+                if status == 429:
+                    self._send(429, {"error": {"code": "429", "message": "Rate limit exceeded (stub)"}},
+                               {"Retry-After": f"{behaviour.retry_after:g}"})
+                elif status != 200:
+                    self._send(status, {"error": {"code": str(status), "message": "Internal error (stub)"}})
+                elif service == "chat":
+                    self._send(200, self._chat(json.loads(body or b"{}")))
+                elif service == "embedding":
+                    self._send(200, self._embeddings(json.loads(body or b"{}")))
+                else:
+                    self._send(201, self._twilio_message(parse_qs(body.decode("utf-8"))))
+
+            def _chat(self, request: Dict) -> Dict:
+                messages = request.get("messages", [])
+                reply = _chat_reply(messages)
+                prompt_tokens = sum(_tokens(str(message.get("content", ""))) for message in messages)
+                return {
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "gpt-4"),
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": reply},
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": _tokens(reply),
+                        "total_tokens": prompt_tokens + _tokens(reply),
+                    },
+                }
+
+            def _embeddings(self, request: Dict) -> Dict:
+                inputs = request.get("input", [])
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+                data = []
+                for i, text in enumerate(inputs):
+                    vector = stub_embedding(str(text))
+                    if request.get("encoding_format") == "base64":
+                        vector = base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode("ascii")
+                    data.append({"object": "embedding", "index": i, "embedding": vector})
+                tokens = sum(_tokens(str(text)) for text in inputs)
+                return {
+                    "object": "list",
+                    "data": data,
+                    "model": request.get("model", "text-embedding-3-large"),
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                }
+
+            def _twilio_message(self, form: Dict[str, List[str]]) -> Dict:
+                account_sid = TWILIO_MESSAGES_PATH.match(self.path).group(1)
+                return {
+                    "sid": f"SM{uuid.uuid4().hex}",
+                    "account_sid": account_sid,
+                    "to": form.get("To", [""])[0],
+                    "from": form.get("From", [""])[0],
+                    "body": form.get("Body", [""])[0],
+                    "status": "queued",
+                    "num_segments": "1",
+                    "direction": "outbound-api",
+                    "api_version": "2010-04-01",
+                }
+
+        return Handler
+
+def add_behaviour_arguments(parser: argparse.ArgumentParser):
+    """--chat/--embedding/--twilio behaviour specs shared with the load test"""
+    parser.add_argument("--chat", default="median_ms=800,sigma=0.4",
+                        help="Chat completions behaviour (median_ms, sigma, errors, throttle, retry_after)")
+    parser.add_argument("--embedding", default="median_ms=40,sigma=0.3", help="Embeddings behaviour")
+    parser.add_argument("--twilio", default="median_ms=150,sigma=0.3", help="Twilio Messages behaviour")
+
+def servers_from_args(args, port: int = 0) -> StubServers:
+    return StubServers(
+        chat=StubBehaviour.parse(args.chat),
+        embedding=StubBehaviour.parse(args.embedding),
+        twilio=StubBehaviour.parse(args.twilio),
+        port=port,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Azure OpenAI and Twilio stand-ins")
+    parser.add_argument("--port", type=int, default=9100, help="Port to listen on")
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+
+    stubs = servers_from_args(args, port=args.port).start()
+    print(f"Stub servers on {stubs.url}")
+    for name, behaviour in stubs.behaviours.items():
+        print(f"  {name:10s} {behaviour}")
+    print(f"Point the app at them with AZURE_ENDPOINT={stubs.url} AZURE_ENDPOINT_EMBEDDING={stubs.url} "
+          f"TWILIO_API_BASE_URL={stubs.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stubs.stop()
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Circuit Breaker Module for Ask Druk
+Fails fast when Azure OpenAI is slow or down instead of tying up workers
+
+Each breaker keeps a rolling window of recent calls. When enough of them
+failed or were slow, the breaker opens: guarded calls raise CircuitOpenError
+at once and /chat answers in degraded mode. While open, a background thread
+probes the service with a tiny request and closes the breaker once a probe
+succeeds quickly. Without a probe function the breaker half-opens after a
+cool-down and lets a single live call decide.
+
+Only errors that say the service itself is in trouble count as failures:
+timeouts, connection errors and 5xx responses. A 4xx means the service
+answered, and a cancelled call (e.g. the client disconnected) says nothing
+about it either way.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import httpx
+import openai
+
+from metrics import registry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+breaker_transitions = registry.counter(
+    "druk_circuit_transitions_total",
+    "Circuit breaker state changes by breaker and new state",
+    ["breaker", "state"]
+)
+breaker_rejections = registry.counter(
+    "druk_circuit_rejections_total",
+    "Calls refused without reaching the service because the breaker was open",
+    ["breaker"]
+)
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a service whose breaker is open"""
+
+    def __init__(self, breaker: str):
+        super().__init__(f"Circuit '{breaker}' is open; the service is unavailable")
+        self.breaker = breaker
+
+# Raised when a request never got an answer; openai's APITimeoutError is an APIConnectionError
+TRANSPORT_ERRORS = (TimeoutError, ConnectionError, httpx.TransportError, openai.APIConnectionError)
+
+def is_service_failure(error: BaseException) -> bool:
+    """Whether an error means the service is down or overloaded (timeout, connection error, 5xx)"""
+    if isinstance(error, TRANSPORT_ERRORS):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    return isinstance(status, int) and status >= 500
+
+class CircuitBreaker:
+    """Rolling-window error and latency breaker around one external service"""
+
+    def __init__(self, name: str, window_seconds: float = 60.0, min_calls: int = 5,
+                 failure_rate: float = 0.5, slow_call_seconds: float = 20.0,
+                 slow_rate: float = 0.5, open_seconds: float = 30.0,
+                 probe_interval: float = 15.0):
+        """
+        Args:
+            name: Breaker name used in logs and metrics ("llm", "embedding")
+            window_seconds: Age of the oldest call the rates are computed over
+            min_calls: Calls needed in the window before the breaker may open
+            failure_rate: Share of failed calls that opens the breaker
+            slow_call_seconds: Calls slower than this count as slow
+            slow_rate: Share of slow calls that opens the breaker
+            open_seconds: Cool-down before the first probe (or half-open trial)
+            probe_interval: Time between background probes while open
+        """
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.probe_interval = probe_interval
+
+        self._lock = threading.Lock()
+        self._calls: deque = deque()  # (finished_at, failed, slow)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._probe: Optional[Callable[[], object]] = None
+        self._prober: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def set_probe(self, probe: Optional[Callable[[], object]]):
+        """Cheap call to the service used to detect recovery while open"""
+        self._probe = probe
+
+    def allow_request(self) -> bool:
+        """Whether a call may go to the service now"""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if self._probe is not None or time.monotonic() - self._opened_at < self.open_seconds:
+                    return False
+                self._transition(HALF_OPEN)
+            # Half-open: exactly one live call at a time decides
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record(self, seconds: float, failed: bool):
+        """Record the outcome of a call that was allowed through"""
+        now = time.monotonic()
+        slow = seconds >= self.slow_call_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trial_in_flight = False
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self._close()
+                return
+            if self._state == OPEN:
+                # A call admitted before the breaker opened
+                return
+
+            self._calls.append((now, failed, slow))
+            cutoff = now - self.window_seconds
+            while self._calls and self._calls[0][0] < cutoff:
+                self._calls.popleft()
+
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+            slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+            if failures / total >= self.failure_rate or slow_calls / total >= self.slow_rate:
+                logging.warning(f"Circuit '{self.name}' opening: {failures}/{total} failed, "
+                                f"{slow_calls}/{total} slower than {self.slow_call_seconds:g}s")
+                self._open(now)
+
+    def abandon(self):
+        """Forget a call that was allowed through but ended without an outcome"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._trial_in_flight = False
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """Run the enclosed call through the breaker, raising CircuitOpenError if open"""
+        if not self.allow_request():
+            breaker_rejections.inc(1, self.name)
+            raise CircuitOpenError(self.name)
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            # A rejected request (4xx) still shows the service is answering
+            self.record(time.perf_counter() - started, failed=is_service_failure(e))
+            raise
+        except BaseException:
+            # Cancelled or interrupted before the service answered
+            self.abandon()
+            raise
+        self.record(time.perf_counter() - started, failed=False)
+
+    def reset(self):
+        """Close the breaker and forget the window"""
+        with self._lock:
+            self._close()
+
+    def _transition(self, state: str):
+        # Caller holds the lock
+        if state != self._state:
+            logging.info(f"Circuit '{self.name}': {self._state} -> {state}")
+            self._state = state
+            breaker_transitions.inc(1, self.name, state)
+
+    def _open(self, now: float):
+        self._transition(OPEN)
+        self._opened_at = now
+        self._calls.clear()
+        self._trial_in_flight = False
+        if self._probe is not None and (self._prober is None or not self._prober.is_alive()):
+            self._wake.clear()
+            self._prober = threading.Thread(target=self._probe_until_closed,
+                                            name=f"circuit-probe-{self.name}", daemon=True)
+            self._prober.start()
+
+    def _close(self):
+        self._transition(CLOSED)
+        self._calls.clear()
+        self._trial_in_flight = False
+        self._wake.set()
+
+    def _probe_until_closed(self):
+        """Background loop probing the service while the breaker is open"""
+        delay = self.open_seconds
+        while not self._wake.wait(delay):
+            delay = self.probe_interval
+            probe = self._probe
+            if probe is None:
+                return
+            started = time.perf_counter()
+            try:
+                probe()
+            except Exception as e:
+                logging.info(f"Circuit '{self.name}' probe failed: {str(e)}")
+                continue
+            seconds = time.perf_counter() - started
+            if seconds >= self.slow_call_seconds:
+                logging.info(f"Circuit '{self.name}' probe took {seconds:.1f}s; staying open")
+                continue
+            with self._lock:
+                if self._state == OPEN:
+                    self._close()
+            return
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+# One breaker per Azure service, shared by the chat engine, classifier and memory
+llm_breaker = CircuitBreaker(
+    "llm",
+    slow_call_seconds=_env_float("LLM_SLOW_CALL_SECONDS", 20.0),
+    open_seconds=_env_float("CIRCUIT_OPEN_SECONDS", 30.0),
+)
+embedding_breaker = CircuitBreaker(
+    "embedding",
+    slow_call_seconds=_env_float("EMBEDDING_SLOW_CALL_SECONDS", 5.0),
+    open_seconds=_env_float("CIRCUIT_OPEN_SECONDS", 30.0),
+)
+
+BREAKERS = (llm_breaker, embedding_breaker)
+
+def _breaker_states() -> Dict[Tuple, float]:
+    return {(breaker.name,): STATE_VALUES[breaker.state] for breaker in BREAKERS}
+
+registry.callback(
+    "druk_circuit_state",
+    "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+    ["breaker"],
+    _breaker_states
+)
@@ -0,0 +1,218 @@
+"""
+Context Packer Module for Ask Druk
+Fits retrieved context into the synthesis prompt's token budget
+
+CompactAndRefine silently falls back to extra serial "refine" LLM calls when
+the system prompt, history and retrieved chunks overflow the context window.
+The packer measures the budget left by the prompt up front and ranks and
+trims nodes (keeping the sentences around query terms) so that synthesis is
+always a single LLM call.
+"""
+
+import re
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+from llama_index.core.indices.prompt_helper import PromptHelper
+from llama_index.core.llms.llm import LLM
+from llama_index.core.prompts import BasePromptTemplate
+from llama_index.core.prompts.prompt_utils import get_biggest_prompt
+from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from llama_index.core.utilities.token_counting import TokenCounter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Same padding CompactAndRefine's repack uses for formatting
+PACKING_PADDING = 5
+
+# Tokens of the "\n\n" CompactAndRefine puts between chunks
+SEPARATOR_TOKENS = 2
+
+# Retrieved nodes whose token counts are remembered across turns
+NODE_TOKEN_CACHE_SIZE = 1024
+
+# Only break before a capital so "Nu. 500" or "Sec. 12" stay in one sentence
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+(?=[A-Z\"(])|\n+")
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "for", "in", "on", "at", "is", "are",
+    "do", "does", "i", "my", "me", "we", "you", "your", "how", "what", "where",
+    "when", "which", "who", "can", "please", "with", "about", "be", "it", "this",
+}
+
+def query_terms(*texts: str) -> set:
+    """Content words of the query used to rank sentences"""
+    terms = set()
+    for text in texts:
+        terms.update(word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS)
+    return terms
+
+class PackedContext:
+    """Nodes that fit the budget plus the token accounting behind them"""
+
+    def __init__(self, nodes: List[NodeWithScore], budget: int, context_tokens: int,
+                 section_tokens: Dict[str, int], kept: int, trimmed: int, dropped: int):
+        self.nodes = nodes
+        self.budget = budget
+        self.context_tokens = context_tokens
+        self.section_tokens = section_tokens
+        self.kept = kept
+        self.trimmed = trimmed
+        self.dropped = dropped
+
+class ContextPacker:
+    """Ranks and trims retrieved nodes to fit one synthesis call"""
+
+    def __init__(self, llm: LLM, tokenizer=None):
+        """
+        Args:
+            llm: The synthesis LLM (its metadata gives the context window)
+            tokenizer: Optional tokenizer; defaults to Settings.tokenizer
+        """
+        self._llm = llm
+        self._token_counter = TokenCounter(tokenizer=tokenizer)
+        self.prompt_helper = PromptHelper.from_llm_metadata(llm.metadata, tokenizer=tokenizer)
+
+        # PromptHelper's budget is linear in prompt tokens, so everything but
+        # the prompt itself is computed once
+        self._base_budget = (
+            self.prompt_helper.context_window
+            - self.prompt_helper.num_output
+            - self.count(llm.system_prompt or "")
+            - PACKING_PADDING
+        )
+        self._node_tokens: "OrderedDict[tuple, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        """Number of tokens in a string"""
+        return self._token_counter.get_string_tokens(text)
+
+    def count_messages(self, messages: List[ChatMessage]) -> int:
+        """Number of prompt tokens in chat messages, counted as PromptHelper does"""
+        return self._token_counter.estimate_tokens_in_messages(messages)
+
+    def available_tokens(self, prompt_tokens: int) -> int:
+        """Tokens available for context in a prompt of prompt_tokens tokens"""
+        return max(0, self._base_budget - prompt_tokens)
+
+    def _count_node(self, node: NodeWithScore) -> int:
+        """Token count of a node's LLM content, cached by node id and hash"""
+        key = (node.node.node_id, node.node.hash)
+        with self._lock:
+            tokens = self._node_tokens.get(key)
+            if tokens is not None:
+                self._node_tokens.move_to_end(key)
+                return tokens
+        tokens = self.count(node.node.get_content(metadata_mode=MetadataMode.LLM))
+        with self._lock:
+            self._node_tokens[key] = tokens
+            while len(self._node_tokens) > NODE_TOKEN_CACHE_SIZE:
+                self._node_tokens.popitem(last=False)
+        return tokens
+
+    def context_budget(self, templates: Sequence[BasePromptTemplate], query_str: str) -> int:
+        """Tokens available for context in the biggest of the given prompts"""
+        partial = [template.partial_format(query_str=query_str) for template in templates]
+        try:
+            return self.prompt_helper.get_text_splitter_given_prompt(
+                get_biggest_prompt(partial), num_chunks=1, padding=PACKING_PADDING, llm=self._llm
+            ).chunk_size
+        except ValueError:
+            # The prompt alone fills the window; no room for context
+            return 0
+
+    def pack(self, nodes: List[NodeWithScore], budget: int, query_str: str,
+             retrieval_query: Optional[str] = None,
+             section_tokens: Optional[Dict[str, int]] = None) -> PackedContext:
+        """
+        Select and trim nodes so the context fits in a single prompt
+
+        Args:
+            nodes: Retrieved nodes
+            budget: Tokens available for context (see context_budget/available_tokens)
+            query_str: The message passed to the synthesizer
+            retrieval_query: The (condensed) question used for retrieval
+            section_tokens: Token counts of the other prompt sections, for logging
+
+        Returns:
+            PackedContext with the nodes to synthesize from
+        """
+        terms = query_terms(query_str, retrieval_query or "")
+
+        ranked = sorted(nodes, key=lambda node: node.score or 0.0, reverse=True)
+        packed: List[NodeWithScore] = []
+        used = kept = trimmed = dropped = 0
+
+        for node in ranked:
+            separator = SEPARATOR_TOKENS if packed else 0
+            remaining = budget - used - separator
+            tokens = self._count_node(node)
+
+            if tokens <= remaining:
+                packed.append(node)
+                used += tokens + separator
+                kept += 1
+                continue
+
+            trimmed_node = self._trim_node(node, terms, remaining)
+            if trimmed_node is None:
+                dropped += 1
+                continue
+
+            tokens = self.count(trimmed_node.node.get_content(metadata_mode=MetadataMode.LLM))
+            packed.append(trimmed_node)
+            used += tokens + separator
+            trimmed += 1
+
+        section_tokens = dict(section_tokens or {})
+        section_tokens["context"] = used
+
+        logging.info(
+            "Prompt tokens: "
+            + ", ".join(f"{name}={count}" for name, count in section_tokens.items())
+            + f" (context budget {budget}; nodes kept={kept} trimmed={trimmed} dropped={dropped})"
+        )
+
+        return PackedContext(packed, budget, used, section_tokens, kept, trimmed, dropped)
+
+    def _trim_node(self, node: NodeWithScore, terms: set, remaining: int) -> Optional[NodeWithScore]:
+        """Keep the sentences that mention query terms, in original order, within budget"""
+        metadata_tokens = self.count(node.node.get_metadata_str(mode=MetadataMode.LLM))
+        # Metadata is rendered above the text with a blank line in between
+        text_budget = remaining - metadata_tokens - SEPARATOR_TOKENS
+        if text_budget <= 0:
+            return None
+
+        sentences = [s.strip() for s in _SENTENCE_BOUNDARY.split(node.node.get_content()) if s.strip()]
+        if not sentences:
+            return None
+
+        # The first sentence usually names the service/law/office; keep it as an anchor
+        scored = [
+            (len(terms & set(_WORD.findall(sentence.lower()))) + (0.5 if i == 0 else 0.0), i)
+            for i, sentence in enumerate(sentences)
+        ]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+
+        chosen, used = [], 0
+        for score, i in scored:
+            if score <= 0:
+                break
+            tokens = self.count(sentences[i]) + 1
+            if used + tokens > text_budget:
+                continue
+            chosen.append(i)
+            used += tokens
+
+        if not chosen:
+            return None
+
+        text = "\n".join(sentences[i] for i in sorted(chosen))
+        trimmed = node.node.model_copy(update={"text": text})
+        return NodeWithScore(node=trimmed, score=node.score)
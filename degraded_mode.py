@@ -0,0 +1,185 @@
+"""
+Degraded Mode Module for Ask Druk
+Answers /chat without the LLM while Azure OpenAI is unavailable
+
+Answers come from, in order: a recent LLM answer to the same standalone
+question, the structured knowledge base lookups of the intent router, and
+the best matching knowledge base chunk shown as-is. Retrieval uses a cached
+or freshly computed query embedding while the embedding breaker is closed
+and keyword overlap, without an embedding call, when it is not. Retrieval
+runs in the threadpool so a slow embedding never holds up the event loop.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from llama_index.core.indices.query.schema import QueryBundle
+from llama_index.core.schema import MetadataMode
+
+from circuit_breaker import CLOSED, embedding_breaker
+from context_packer import query_terms
+from intent_router import IntentRouter
+from kb_utils import normalize_text
+from metrics import registry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+DEGRADED_NOTICE = ("⚠️ Druk's AI assistant is temporarily unavailable, so this answer comes "
+                   "straight from the knowledge base.")
+CACHED_NOTICE = ("⚠️ Druk's AI assistant is temporarily unavailable; this is the answer Druk "
+                 "recently gave to the same question.")
+NO_ANSWER = ("⚠️ Druk's AI assistant is temporarily unavailable and I couldn't find this in the "
+             "knowledge base. Please try again in a few minutes, or rephrase your question.")
+
+# Characters of a raw chunk shown to the citizen
+MAX_CHUNK_CHARS = 1500
+
+degraded_responses = registry.counter(
+    "druk_degraded_responses_total",
+    "Chat answers served without the LLM, by source",
+    ["source"]
+)
+
+class AnswerCache:
+    """Bounded LRU of recent LLM answers to standalone questions"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(message: str, query_type: Optional[str]) -> Tuple[str, str]:
+        return normalize_text(message), query_type or ""
+
+    def put(self, message: str, query_type: Optional[str], answer: str):
+        key = self._key(message, query_type)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, message: str, query_type: Optional[str]) -> Optional[str]:
+        key = self._key(message, query_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class DegradedAnswer:
+    """A fallback answer in the same shape as a chat engine response"""
+
+    def __init__(self, source: str, response: str, suggested_actions: Optional[List[str]] = None,
+                 office_locations: Optional[List[Dict]] = None):
+        self.source = source
+        self.response = response
+        self.suggested_actions = suggested_actions or []
+        self.office_locations = office_locations or []
+
+class DegradedResponder:
+    """Builds the best answer available without calling the LLM"""
+
+    def __init__(self, index_manager, intent_router: IntentRouter,
+                 answer_cache: Optional[AnswerCache] = None):
+        self.index_manager = index_manager
+        self.intent_router = intent_router
+        self.answer_cache = answer_cache or AnswerCache()
+
+        # Content words of every node, computed once per index for keyword fallback
+        self._terms_index = None
+        self._node_terms: List[Tuple[object, set]] = []
+        self._terms_lock = threading.Lock()
+
+    async def respond(self, message: str, query_type: Optional[str]) -> DegradedAnswer:
+        """Cached answer, structured lookup or top chunk, whichever comes first"""
+        answer = await self._respond(message, query_type)
+        degraded_responses.inc(1, answer.source)
+        return answer
+
+    async def _respond(self, message: str, query_type: Optional[str]) -> DegradedAnswer:
+        cached = self.answer_cache.get(message, query_type)
+        if cached is not None:
+            return DegradedAnswer("cache", f"{CACHED_NOTICE}\n\n{cached}")
+
+        routed = self.intent_router.lookup(message)
+        if routed is not None:
+            return DegradedAnswer("knowledge_base", f"{DEGRADED_NOTICE}\n\n{routed.response}",
+                                  routed.suggested_actions, routed.office_locations)
+
+        try:
+            node = await run_in_threadpool(self.top_chunk, message)
+        except Exception as e:
+            logging.error(f"Degraded retrieval failed: {str(e)}")
+            node = None
+        if node is not None:
+            return DegradedAnswer("top_chunk", f"{DEGRADED_NOTICE}\n\n{_render_chunk(node)}")
+
+        return DegradedAnswer("none", NO_ANSWER)
+
+    def top_chunk(self, message: str):
+        """Best matching knowledge base node for a message, or None (blocking)"""
+        index = self.index_manager.global_index
+        if index is None:
+            return None
+
+        embedding = self.index_manager.query_embedding_cache.get(message)
+        # Don't wait on an embedding service that is failing or on trial
+        if embedding is None and embedding_breaker.state == CLOSED:
+            try:
+                with embedding_breaker.guard():
+                    embedding = self.index_manager.embed_model.get_query_embedding(message)
+                self.index_manager.query_embedding_cache.put(message, embedding)
+            except Exception as e:
+                logging.warning(f"Degraded retrieval falling back to keywords: {str(e)}")
+
+        if embedding is not None:
+            results = index.as_retriever(similarity_top_k=1).retrieve(
+                QueryBundle(query_str=message, embedding=embedding)
+            )
+            return results[0].node if results else None
+        return self._keyword_top_chunk(index, message)
+
+    def _keyword_top_chunk(self, index, message: str):
+        """Node sharing the most content words with the message"""
+        terms = query_terms(message)
+        if not terms:
+            return None
+        with self._terms_lock:
+            if self._terms_index is not index:
+                self._node_terms = [
+                    (node, query_terms(node.get_content(metadata_mode=MetadataMode.NONE)))
+                    for node in index.docstore.docs.values()
+                ]
+                self._terms_index = index
+            node_terms = self._node_terms
+
+        best, best_overlap = None, 0
+        for node, node_words in node_terms:
+            overlap = len(terms & node_words)
+            if overlap > best_overlap:
+                best, best_overlap = node, overlap
+        return best
+
+def _render_chunk(node) -> str:
+    """Chunk text cut at a line boundary, with the file it came from"""
+    text = node.get_content(metadata_mode=MetadataMode.NONE).strip()
+    if len(text) > MAX_CHUNK_CHARS:
+        cut = text.rfind("\n", 0, MAX_CHUNK_CHARS)
+        text = text[:cut if cut > 0 else MAX_CHUNK_CHARS].rstrip() + "\n…"
+    source = node.metadata.get("source")
+    return f"{text}\n\n_Source: {source}_" if source else text
@@ -4,18 +4,26 @@ Simplified version focused on local knowledge base files
 """
 
 import os
+import io
+import csv
 import logging
 import tempfile
 import uuid
 import shutil
 import datetime
 import json
-from typing import List, Dict, Optional, BinaryIO, Tuple, Any
+from typing import List, Dict, Optional, BinaryIO, Tuple, Any, Iterator
 from pathlib import Path
 from fastapi import UploadFile
 from llama_index.core import SimpleDirectoryReader, Document
+from pypdf import PdfReader
 from dotenv import load_dotenv
 
+try:
+    import openpyxl
+except ImportError:  # .xlsx files are then loaded whole by SimpleDirectoryReader
+    openpyxl = None
+
 # Load environment variables
 load_dotenv()
 
@@ -27,11 +35,29 @@ logging.basicConfig(level=logging.INFO,
 TEMP_DIR = os.path.join(tempfile.gettempdir(), "druk_chatbot_temp")
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+# Largest block of a text file, and rows of a spreadsheet or CSV, read at once
+MAX_PART_CHARS = 64 * 1024
+ROWS_PER_PART = 500
+
+# Metadata embedded with each chunk; every other key stays out of the vectors
+EMBED_METADATA_KEYS = ("source", "category")
+
+# Metadata the LLM sees next to each retrieved chunk
+LLM_METADATA_KEYS = ("source", "category", "page_label", "sheet_name")
+
 class DocumentLoader:
     """Handles document loading for Bhutan knowledge base"""
     
-    def __init__(self):
-        """Initialize the document loader"""
+    def __init__(self, embed_metadata_keys=EMBED_METADATA_KEYS, llm_metadata_keys=LLM_METADATA_KEYS):
+        """
+        Initialize the document loader
+        
+        Args:
+            embed_metadata_keys: Metadata keys included in the embedded text of a chunk
+            llm_metadata_keys: Metadata keys included in the text the LLM sees
+        """
+        self.embed_metadata_keys = tuple(embed_metadata_keys)
+        self.llm_metadata_keys = tuple(llm_metadata_keys)
         self.supported_extensions = [
             ".pdf", 
             ".docx", 
@@ -72,51 +98,102 @@ class DocumentLoader:
             with open(temp_file_path, "wb") as buffer:
                 shutil.copyfileobj(file.file, buffer)
             
-            debug_info = [f"Processing file: {original_filename}"]
-            
             try:
-                # Use SimpleDirectoryReader to load the document
-                reader = SimpleDirectoryReader(
-                    input_files=[temp_file_path],
-                    filename_as_id=True,
-                )
-                
-                documents = reader.load_data()
-                
-                # Add additional metadata to each document
-                for doc in documents:
-                    # Store the original filename and other metadata
-                    if not hasattr(doc, 'metadata') or doc.metadata is None:
-                        doc.metadata = {}
-                    
-                    doc.metadata.update({
-                        "source": original_filename,
-                        "file_type": ext[1:],  # Remove the dot
-                        "upload_date": datetime.datetime.now().isoformat(),
-                        "category": "uploaded_document"
-                    })
-                
-                debug_info.append(f"Successfully loaded {len(documents)} document(s) from {file.filename}")
-                
-                # Clean up temporary file
-                os.remove(temp_file_path)
-                
-                return documents, debug_info
-                
-            except Exception as e:
-                logging.error(f"Error loading document: {str(e)}")
-                debug_info.append(f"Error loading document: {str(e)}")
-                
+                return self.load_uploaded_file(temp_file_path, original_filename)
+            finally:
                 # Clean up temporary file
                 if os.path.exists(temp_file_path):
                     os.remove(temp_file_path)
                 
-                return [], debug_info
-                
         except Exception as e:
             logging.error(f"Error processing upload: {str(e)}")
             return [], [f"Error processing file: {str(e)}"]
     
+    def load_uploaded_file(self, file_path: str, original_filename: str) -> Tuple[List[Document], List[str]]:
+        """
+        Load an uploaded file already saved to disk
+        
+        Args:
+            file_path: Where the upload was spooled
+            original_filename: Name of the file as uploaded
+            
+        Returns:
+            List of Document objects and debug info
+        """
+        debug_info = [f"Processing file: {original_filename}"]
+        
+        try:
+            documents = [document for document, _ in self.stream_uploaded_file(file_path, original_filename)]
+            debug_info.append(f"Successfully loaded {len(documents)} document(s) from {original_filename}")
+            return documents, debug_info
+            
+        except Exception as e:
+            logging.error(f"Error loading document: {str(e)}")
+            debug_info.append(f"Error loading document: {str(e)}")
+            return [], debug_info
+    
+    def stream_uploaded_file(self, file_path: str, original_filename: str) -> Iterator[Tuple[Document, float]]:
+        """
+        Load an uploaded file one part at a time
+        
+        PDFs are read page by page, spreadsheets and CSVs in blocks of rows and
+        text files in blocks of lines, so only one part of a large file is held
+        in memory while it is chunked and embedded. Other formats are loaded whole.
+        
+        Args:
+            file_path: Where the upload was spooled
+            original_filename: Name of the file as uploaded
+            
+        Yields:
+            A document per part and the share of the file read so far
+        """
+        ext = os.path.splitext(original_filename)[1].lower()
+        metadata = {
+            "source": original_filename,
+            "file_type": ext[1:],  # Remove the dot
+            "upload_date": datetime.datetime.now().isoformat(),
+            "category": "uploaded_document"
+        }
+        for text, fraction, part_metadata in self._iter_file_parts(file_path, ext):
+            if text.strip():
+                document = Document(text=text, metadata={**part_metadata, **metadata})
+                self.apply_metadata_policy(document)
+                yield document, fraction
+    
+    def apply_metadata_policy(self, document: Document) -> Document:
+        """
+        Keep bookkeeping metadata out of embeddings and prompts
+        
+        LlamaIndex prepends every metadata key to the text it embeds and
+        shows the LLM, and SentenceSplitter counts it against the chunk size.
+        Only the keys listed for each stay visible; the rest (paths, dates,
+        payload references) remain in the metadata for filtering and removal.
+        """
+        document.excluded_embed_metadata_keys = [
+            key for key in document.metadata if key not in self.embed_metadata_keys
+        ]
+        document.excluded_llm_metadata_keys = [
+            key for key in document.metadata if key not in self.llm_metadata_keys
+        ]
+        return document
+    
+    def load_payload(self, metadata: Dict) -> Optional[Any]:
+        """
+        Parsed JSON a knowledge base document was formatted from
+        
+        The raw payload is not copied into the metadata (it would be carried
+        by every chunk); it is read back from the file named by payload_ref.
+        """
+        payload_ref = metadata.get("payload_ref")
+        if not payload_ref:
+            return None
+        try:
+            with open(payload_ref, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logging.error(f"Error loading payload {payload_ref}: {str(e)}")
+            return None
+    
     def load_from_directory(self, directory: str, recursive: bool = False) -> Tuple[List[Document], List[str]]:
         """
         Load all documents from a directory
@@ -180,13 +257,11 @@ class DocumentLoader:
                 documents = self._load_json_as_document(file_path, base_directory)
                 debug_info.append(f"Loaded JSON knowledge file: {file_name}")
             else:
-                # Use SimpleDirectoryReader for other file types
-                reader = SimpleDirectoryReader(
-                    input_files=[file_path],
-                    filename_as_id=True,
-                )
-                
-                documents = reader.load_data()
+                documents = [
+                    Document(text=text, metadata=part_metadata)
+                    for text, _, part_metadata in self._iter_file_parts(file_path, ext)
+                    if text.strip()
+                ]
                 debug_info.append(f"Loaded document: {file_name}")
             
             # Add metadata to all documents
@@ -205,6 +280,7 @@ class DocumentLoader:
                     "category": category,
                     "file_path": file_path
                 })
+                self.apply_metadata_policy(doc)
             
             return documents, debug_info
             
@@ -212,12 +288,108 @@ class DocumentLoader:
             logging.error(f"Error loading file {file_path}: {str(e)}")
             return [], [f"Error loading {file_name}: {str(e)}"]
     
+    def _iter_file_parts(self, file_path: str, ext: str) -> Iterator[Tuple[str, float, Dict]]:
+        """Text, share of the file read and metadata of each page, row block or text block"""
+        if ext == ".pdf":
+            yield from self._iter_pdf_pages(file_path)
+        elif ext == ".xlsx" and openpyxl is not None:
+            yield from self._iter_xlsx_rows(file_path)
+        elif ext == ".csv":
+            yield from self._iter_csv_rows(file_path)
+        elif ext in (".txt", ".md"):
+            yield from self._iter_text_blocks(file_path)
+        else:
+            # Use SimpleDirectoryReader for formats that can't be read in parts
+            reader = SimpleDirectoryReader(
+                input_files=[file_path],
+                filename_as_id=True,
+            )
+            documents = reader.load_data()
+            for i, doc in enumerate(documents, 1):
+                yield doc.text, i / len(documents), doc.metadata or {}
+    
+    def _iter_pdf_pages(self, file_path: str) -> Iterator[Tuple[str, float, Dict]]:
+        """One page of a PDF at a time"""
+        reader = PdfReader(file_path)
+        page_count = len(reader.pages)
+        for number in range(page_count):
+            text = reader.pages[number].extract_text() or ""
+            # Parsed page objects are cached by the reader; drop them with the page
+            reader.resolved_objects.clear()
+            yield text, (number + 1) / page_count, {"page_label": str(number + 1)}
+    
+    def _iter_xlsx_rows(self, file_path: str) -> Iterator[Tuple[str, float, Dict]]:
+        """Blocks of ROWS_PER_PART rows of each sheet, each starting with the header row"""
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            sheet_count = len(workbook.sheetnames)
+            for sheet_number, sheet in enumerate(workbook.worksheets):
+                total_rows = sheet.max_row or 0
+                header, block, rows_read, yielded = None, [], 0, False
+                for row in sheet.iter_rows(values_only=True):
+                    rows_read += 1
+                    line = ", ".join("" if value is None else str(value) for value in row).rstrip(", ")
+                    if header is None:
+                        header = line
+                        continue
+                    block.append(line)
+                    if len(block) >= ROWS_PER_PART:
+                        fraction = (sheet_number + min(1.0, rows_read / total_rows if total_rows else 0.0)) / sheet_count
+                        yield "\n".join([header] + block), fraction, {"sheet_name": sheet.title}
+                        block, yielded = [], True
+                # The remaining rows, or the header alone for a sheet without data rows
+                if block or (header is not None and not yielded):
+                    yield "\n".join([header or ""] + block), (sheet_number + 1) / sheet_count, {"sheet_name": sheet.title}
+        finally:
+            workbook.close()
+    
+    def _iter_csv_rows(self, file_path: str) -> Iterator[Tuple[str, float, Dict]]:
+        """Blocks of ROWS_PER_PART rows, each starting with the header row"""
+        size = os.path.getsize(file_path) or 1
+        with open(file_path, "rb") as raw:
+            text = io.TextIOWrapper(raw, encoding="utf-8", errors="replace", newline="")
+            header, block, yielded = None, [], False
+            for row in csv.reader(text):
+                line = ", ".join(row)
+                if header is None:
+                    header = line
+                    continue
+                block.append(line)
+                if len(block) >= ROWS_PER_PART:
+                    yield "\n".join([header] + block), min(1.0, raw.tell() / size), {}
+                    block, yielded = [], True
+            # The remaining rows, or the header alone for a file without data rows
+            if block or (header is not None and not yielded):
+                yield "\n".join([header or ""] + block), 1.0, {}
+    
+    def _iter_text_blocks(self, file_path: str) -> Iterator[Tuple[str, float, Dict]]:
+        """Blocks of whole lines up to MAX_PART_CHARS, preferring to end at a blank line"""
+        size = os.path.getsize(file_path) or 1
+        position = 0
+        block, block_chars = [], 0
+        with open(file_path, "rb") as f:
+            for raw in f:
+                position += len(raw)
+                line = raw.decode("utf-8", errors="replace")
+                block.append(line)
+                block_chars += len(line)
+                if block_chars >= MAX_PART_CHARS or (block_chars >= MAX_PART_CHARS // 2 and not line.strip()):
+                    yield "".join(block), position / size, {}
+                    block, block_chars = [], 0
+        if block:
+            yield "".join(block), 1.0, {}
+    
     def _load_json_as_document(self, file_path: str, base_directory: str) -> List[Document]:
         """Load JSON file as a structured document"""
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
             
+            # Directory files get one document per office, tagged with its
+            # dzongkhag, so retrieval can filter offices by location
+            if isinstance(data, dict) and isinstance(data.get('offices'), list):
+                return self._load_office_directory(data, file_path)
+            
             # Convert JSON to readable text format
             if isinstance(data, dict):
                 # Handle service guides
@@ -242,9 +414,11 @@ class DocumentLoader:
                 text=content,
                 metadata={
                     "json_structure": True,
-                    "original_data": data
+                    "payload_ref": file_path
                 }
             )
+            if isinstance(data, dict) and data.get('dzongkhag'):
+                doc.metadata["dzongkhag"] = data['dzongkhag']
             
             return [doc]
             
@@ -252,6 +426,25 @@ class DocumentLoader:
             logging.error(f"Error loading JSON file {file_path}: {str(e)}")
             return []
     
+    def _load_office_directory(self, data: dict, file_path: str) -> List[Document]:
+        """One document per office, plus one for the directory's other lists"""
+        documents = []
+        for office in data['offices']:
+            if not isinstance(office, dict):
+                continue
+            metadata = {"json_structure": True, "payload_ref": file_path}
+            if office.get('dzongkhag'):
+                metadata["dzongkhag"] = office['dzongkhag']
+            documents.append(Document(text=self._format_office_info(office), metadata=metadata))
+        
+        rest = {key: value for key, value in data.items() if key != 'offices'}
+        if rest:
+            documents.append(Document(
+                text=self._format_generic_json(rest),
+                metadata={"json_structure": True, "payload_ref": file_path}
+            ))
+        return documents
+    
     def _format_service_guide(self, data: dict) -> str:
         """Format service guide JSON into readable text"""
         content = f"Service: {data.get('service_name', 'Unknown Service')}\n\n"
@@ -371,7 +564,7 @@ class DocumentLoader:
             return 'government_service'
         elif 'rights' in path_parts:
             return 'citizen_rights'
-        elif 'laws' in path_parts or 'legal' in path_parts:
+        elif any(part.startswith(('laws', 'legal')) for part in path_parts):
             return 'legal_information'
         elif 'offices' in path_parts:
             return 'office_information'
@@ -1,4 +1,7 @@
 # druk_system_prompt.py - System prompt for Ask Druk
+from functools import lru_cache
+from typing import Optional, Tuple
+
 DRUK_SYSTEM_PROMPT = """# Ask Druk - Bhutan's Sovereign AI Citizen Assistant
 
 You are Druk, Bhutan's friendly citizen assistant. Your role is to help citizens understand their rights and navigate government services.
@@ -89,22 +92,30 @@ Would you like directions to the office or help with any other documents?"
 Remember: You're empowering every citizen to access their rights and services. That's a winning narrative! 🏆
 """
 
-def get_citizen_context_prompt(citizen_context: dict) -> str:
-    """Generate context-aware prompt based on citizen information"""
+def get_prompt_variant_key(citizen_context: dict) -> Optional[Tuple]:
+    """Key of the citizen context fields that change the system prompt"""
+    if not citizen_context:
+        return None
+    
+    age = citizen_context.get("age")
+    age_group = ("Young adult services" if int(age) < 30 else "General services") if age else None
+    return (citizen_context.get("language", "English"), age_group, citizen_context.get("dzongkhag"))
+
+@lru_cache(maxsize=256)
+def get_prompt_for_variant(variant_key: Optional[Tuple]) -> str:
+    """System prompt for a variant key, shared by every session with that key"""
     base_prompt = DRUK_SYSTEM_PROMPT
     
-    if citizen_context:
-        age = citizen_context.get("age")
-        location = citizen_context.get("dzongkhag") 
-        language_pref = citizen_context.get("language", "English")
+    if variant_key is not None:
+        language_pref, age_group, location = variant_key
         
         context_addition = f"""
 ## Citizen Context
 - Language preference: {language_pref}"""
         
-        if age:
+        if age_group:
             context_addition += f"""
-- Age group considerations: {"Young adult services" if age and int(age) < 30 else "General services"}"""
+- Age group considerations: {age_group}"""
             
         if location:
             context_addition += f"""
@@ -113,3 +124,7 @@ def get_citizen_context_prompt(citizen_context: dict) -> str:
         base_prompt += context_addition
     
     return base_prompt
+
+def get_citizen_context_prompt(citizen_context: dict) -> str:
+    """Generate context-aware prompt based on citizen information"""
+    return get_prompt_for_variant(get_prompt_variant_key(citizen_context))
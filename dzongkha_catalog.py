@@ -0,0 +1,334 @@
+"""
+Dzongkha Catalog Module for Ask Druk
+Pre-translated Dzongkha rendering of static content and knowledge base summaries
+
+The catalog is built offline (it calls Azure OpenAI once per string) and saved
+as a versioned JSON artifact. At startup the artifact is loaded into memory so
+Dzongkha requests for fixed strings never reach the /translate model.
+
+Usage:
+    python dzongkha_catalog.py build   # translate new/changed strings
+    python dzongkha_catalog.py check   # exit 1 if any translation is stale
+"""
+
+import os
+import sys
+import json
+import hashlib
+import logging
+import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Any
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Bump when the artifact layout changes
+CATALOG_SCHEMA_VERSION = 1
+
+DEFAULT_CATALOG_PATH = os.getenv("DZONGKHA_CATALOG_PATH", "translations/dzongkha_catalog.json")
+
+DZONGKHA_LANGUAGE_CODES = {"dz", "dzongkha", "འབྲུག་ཁ"}
+
+def is_dzongkha(language: Optional[str]) -> bool:
+    """Check whether a language preference asks for Dzongkha"""
+    return bool(language) and language.strip().lower() in DZONGKHA_LANGUAGE_CODES
+
+def source_hash(text: str) -> str:
+    """Stable fingerprint of an English source string"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+def summarize_knowledge_file(data: Any) -> Optional[str]:
+    """Build a short English summary of a knowledge base JSON document"""
+    if not isinstance(data, dict):
+        return None
+
+    if "service_name" in data:
+        summary = f"{data['service_name']}: {len(data.get('steps', []))} steps"
+        if data.get("total_time"):
+            summary += f", takes {data['total_time']}"
+        fees = data.get("fees")
+        if isinstance(fees, dict) and fees.get("note"):
+            summary += f". {fees['note']}"
+        if data.get("offices"):
+            summary += f". Available at {', '.join(data['offices'])}."
+        return summary
+
+    if "scenarios" in data:
+        scenarios = [s.get("scenario", key) for key, s in data["scenarios"].items() if isinstance(s, dict)]
+        return f"{data.get('category', 'Citizen Rights')}: help with {', '.join(scenarios).lower()}."
+
+    if "law_name" in data:
+        return f"{data['law_name']}: {data.get('purpose', '')}".strip()
+
+    if "offices" in data:
+        names = [office.get("name", "") for office in data["offices"]]
+        return f"Government offices: {', '.join(names)}."
+
+    return None
+
+def collect_knowledge_base_sources(knowledge_base_dir: str = "knowledge_base") -> Dict[str, str]:
+    """Collect quick guide strings and per-document summaries from the knowledge base"""
+    sources = {}
+
+    for file_path in sorted(Path(knowledge_base_dir).rglob("*.json")):
+        # Superseded copies are kept for reference only
+        if file_path.stem.endswith("_old"):
+            continue
+
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logging.error(f"Error reading {file_path} for Dzongkha catalog: {str(e)}")
+            continue
+
+        doc_key = file_path.relative_to(knowledge_base_dir).with_suffix("").as_posix()
+        summary = summarize_knowledge_file(data)
+        if summary:
+            sources[f"kb.{doc_key}.summary"] = summary
+
+        # Quick guide strings for service documents
+        if isinstance(data, dict) and "service_name" in data:
+            sources[f"guide.{doc_key}.title"] = f"{data['service_name']} Guide"
+            if data.get("total_time"):
+                sources[f"guide.{doc_key}.total_time"] = data["total_time"]
+            for i, step in enumerate(data.get("steps", [])):
+                for field in ("title", "description", "time_estimate"):
+                    if step.get(field):
+                        sources[f"guide.{doc_key}.steps.{i}.{field}"] = step[field]
+                for j, document in enumerate(step.get("documents_required", [])):
+                    sources[f"guide.{doc_key}.steps.{i}.documents.{j}"] = document
+            for i, tip in enumerate(data.get("tips", [])):
+                sources[f"guide.{doc_key}.tips.{i}"] = tip
+
+    return sources
+
+def collect_static_sources(available_services: List[Dict],
+                           emergency_contacts: List[Dict],
+                           knowledge_base_dir: str = "knowledge_base") -> Dict[str, str]:
+    """
+    Collect every fixed English string that has a Dzongkha rendering
+
+    Args:
+        available_services: static_content.AVAILABLE_SERVICES (English)
+        emergency_contacts: Entries served by /emergency-contacts
+        knowledge_base_dir: Knowledge base root for guides and summaries
+
+    Returns:
+        Mapping of catalog key -> English source text
+    """
+    from whatsapp_integration import get_welcome_message, get_help_message
+
+    sources = {
+        "whatsapp.welcome": get_welcome_message(),
+        "whatsapp.help": get_help_message(),
+    }
+
+    for service in available_services:
+        sources[f"services.{service['name']}.name"] = service["name"]
+        sources[f"services.{service['name']}.category"] = service["category"]
+
+    for contact in emergency_contacts:
+        sources[f"emergency.{contact['number']}.service"] = contact["service"]
+        sources[f"emergency.{contact['number']}.available"] = contact["available"]
+
+    sources.update(collect_knowledge_base_sources(knowledge_base_dir))
+    return sources
+
+class DzongkhaCatalog:
+    """In-memory lookup of pre-translated Dzongkha strings"""
+
+    def __init__(self, entries: Optional[Dict[str, Dict]] = None, artifact_version: Optional[str] = None):
+        """Initialize the catalog from artifact entries"""
+        self.entries = entries or {}
+        self.artifact_version = artifact_version
+        self.stale_keys: List[str] = []
+        self.missing_keys: List[str] = []
+
+        # English source text -> Dzongkha, for exact-match lookups
+        self._by_source = {
+            entry["source"]: entry["translation"]
+            for entry in self.entries.values()
+            if entry.get("translation")
+        }
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_CATALOG_PATH) -> "DzongkhaCatalog":
+        """Load the catalog artifact, returning an empty catalog if unavailable"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                artifact = json.load(f)
+        except FileNotFoundError:
+            logging.warning(f"Dzongkha catalog not found at {path}; static content will be translated on demand")
+            return cls()
+        except Exception as e:
+            logging.error(f"Error loading Dzongkha catalog: {str(e)}")
+            return cls()
+
+        if artifact.get("schema_version") != CATALOG_SCHEMA_VERSION:
+            logging.warning(f"Ignoring Dzongkha catalog with schema version {artifact.get('schema_version')}")
+            return cls()
+
+        catalog = cls(artifact.get("entries", {}), artifact.get("artifact_version"))
+        logging.info(f"Loaded Dzongkha catalog {catalog.artifact_version} with {len(catalog.entries)} entries")
+        return catalog
+
+    def check_sources(self, sources: Dict[str, str]) -> Dict[str, List[str]]:
+        """
+        Compare the catalog against the current English sources
+
+        Stale entries (source text changed since translation) are dropped so
+        an outdated Dzongkha rendering is never served.
+
+        Returns:
+            Keys that are stale and keys that have no translation yet
+        """
+        self.stale_keys = []
+        self.missing_keys = []
+
+        for key, text in sources.items():
+            entry = self.entries.get(key)
+            if entry is None:
+                self.missing_keys.append(key)
+            elif entry.get("source_hash") != source_hash(text):
+                self.stale_keys.append(key)
+                self._by_source.pop(entry.get("source"), None)
+
+        if self.stale_keys or self.missing_keys:
+            logging.warning(
+                f"Dzongkha catalog has {len(self.stale_keys)} stale and "
+                f"{len(self.missing_keys)} missing translations; run 'python dzongkha_catalog.py build'"
+            )
+
+        return {"stale": self.stale_keys, "missing": self.missing_keys}
+
+    def translate(self, text: str) -> Optional[str]:
+        """Return the Dzongkha rendering of an exact English string, if known"""
+        return self._by_source.get(text)
+
+    def translate_or_original(self, text: str) -> str:
+        """Return the Dzongkha rendering if known, otherwise the original text"""
+        return self._by_source.get(text, text)
+
+    def localize(self, value: Any) -> Any:
+        """Replace every known English string in a JSON-like structure with its Dzongkha rendering"""
+        if isinstance(value, str):
+            return self._by_source.get(value, value)
+        if isinstance(value, list):
+            return [self.localize(item) for item in value]
+        if isinstance(value, dict):
+            return {key: self.localize(item) for key, item in value.items()}
+        return value
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get catalog status for monitoring"""
+        return {
+            "artifact_version": self.artifact_version,
+            "entries": len(self.entries),
+            "servable": len(self._by_source),
+            "stale": len(self.stale_keys),
+            "missing": len(self.missing_keys)
+        }
+
+def build_catalog(sources: Dict[str, str], translate, path: str = DEFAULT_CATALOG_PATH,
+                  model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Translate new or changed sources and write a new catalog artifact
+
+    Args:
+        sources: Mapping of catalog key -> English source text
+        translate: Callable taking English text and returning Dzongkha
+        path: Where to write the artifact
+        model: Translation model name recorded in the artifact
+
+    Returns:
+        Build summary
+    """
+    existing = DzongkhaCatalog.load(path).entries
+    entries = {}
+    translated = 0
+
+    for key, text in sorted(sources.items()):
+        digest = source_hash(text)
+        previous = existing.get(key)
+
+        # Reuse translations whose source text has not changed
+        if previous and previous.get("source_hash") == digest and previous.get("translation"):
+            entries[key] = previous
+            continue
+
+        logging.info(f"Translating {key}")
+        entries[key] = {
+            "source": text,
+            "source_hash": digest,
+            "translation": translate(text)
+        }
+        translated += 1
+
+    # The artifact version changes whenever any source or translation does
+    content_hash = hashlib.sha256(
+        json.dumps(entries, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()[:12]
+
+    artifact = {
+        "schema_version": CATALOG_SCHEMA_VERSION,
+        "artifact_version": content_hash,
+        "built_at": datetime.datetime.now().isoformat(),
+        "model": model,
+        "entries": entries
+    }
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+    return {
+        "artifact_version": content_hash,
+        "entries": len(entries),
+        "translated": translated,
+        "reused": len(entries) - translated
+    }
+
+def _current_sources() -> Dict[str, str]:
+    """Collect sources from the static content shared with the application"""
+    from static_content import AVAILABLE_SERVICES, EMERGENCY_CONTACTS
+    return collect_static_sources(AVAILABLE_SERVICES, EMERGENCY_CONTACTS)
+
+def main(argv: List[str]) -> int:
+    """Command line entry point for the offline build step"""
+    command = argv[1] if len(argv) > 1 else "check"
+    path = argv[2] if len(argv) > 2 else DEFAULT_CATALOG_PATH
+
+    sources = _current_sources()
+
+    if command == "check":
+        result = DzongkhaCatalog.load(path).check_sources(sources)
+        for key in result["stale"]:
+            print(f"stale: {key}")
+        for key in result["missing"]:
+            print(f"missing: {key}")
+        return 1 if result["stale"] or result["missing"] else 0
+
+    if command == "build":
+        from model_provider import get_model_provider
+
+        # The catalog holds real translations, so it is always built with Azure
+        provider = get_model_provider("azure")
+        summary = build_catalog(
+            sources,
+            provider.translate,
+            path=path,
+            model=provider.translation_model
+        )
+        print(json.dumps(summary, indent=2))
+        return 0
+
+    print(__doc__)
+    return 2
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
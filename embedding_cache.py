@@ -0,0 +1,67 @@
+"""
+Embedding Cache Module for Ask Druk
+Short-lived cache of query embeddings shared between classification and retrieval
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+import numpy as np
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU of query text -> embedding
+
+    A query is embedded once (for classification) and the same vector is
+    handed to the retriever, so a turn costs a single embedding call.
+    Vectors are stored as float32 arrays to keep the cache small.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        """Initialize an empty cache holding at most max_entries vectors"""
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._aliases: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, text: str, embedding: List[float]):
+        """Store the embedding for a query text"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._entries[text] = vector
+            self._entries.move_to_end(text)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def alias(self, text: str, source_text: str):
+        """Make lookups of `text` return the embedding stored for `source_text`"""
+        if text == source_text:
+            return
+        with self._lock:
+            self._aliases[text] = source_text
+            self._aliases.move_to_end(text)
+            while len(self._aliases) > self.max_entries:
+                self._aliases.popitem(last=False)
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """Return the cached embedding for a query text, if any"""
+        with self._lock:
+            key = self._aliases.get(text, text)
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return vector.tolist()
+
+    def get_or_compute(self, text: str, embed: Callable[[str], List[float]]) -> List[float]:
+        """Return the cached embedding or compute and store it"""
+        embedding = self.get(text)
+        if embedding is None:
+            embedding = embed(text)
+            self.put(text, embedding)
+        return embedding
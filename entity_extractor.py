@@ -0,0 +1,296 @@
+"""
+Entity Extractor Module for Ask Druk
+Knowledge-aware post-processing of chat responses
+
+Every office name, service name, law and phone number in knowledge_base/ is
+compiled into one Aho-Corasick automaton, so a single pass over an answer
+(linear in its length) finds all mentions and links them to their source
+records. Suggested actions are extracted in the same pass over the lines.
+"""
+
+import re
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, Iterator, List, Tuple
+
+from kb_utils import (
+    FileChangeWatcher,
+    KNOWLEDGE_BASE_DIR,
+    iter_knowledge_files,
+    load_json_file,
+)
+from office_index import office_aliases
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+MAX_ACTIONS = 5
+MAX_NUMBERED_ACTIONS = 5
+MAX_BULLET_ACTIONS = 3
+
+_NUMBERED_LINE = re.compile(r"^\s*\d+\.\s*([^.\n]+)")
+_BULLET_LINE = re.compile(r"^\s*[-•]\s*([^.\n]+)")
+_PHONE_FIELDS = ("contact", "phone", "number")
+_PHONE_LIKE = re.compile(r"^\+?[\d][\d\s\-/]{2,}$")
+
+class AhoCorasick:
+    """Multi-pattern string matcher; matching is linear in text length plus matches"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        self.patterns: List[Tuple[str, Any]] = []
+
+    def add(self, pattern: str, payload: Any):
+        """Add a (lowercased) pattern with a payload returned on match"""
+        pattern = pattern.lower()
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(len(self.patterns))
+        self.patterns.append((pattern, payload))
+
+    def build(self):
+        """Compute failure links breadth-first"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """Yield (start, end, payload) for every pattern occurrence in text"""
+        goto, fail, output, patterns = self._goto, self._fail, self._output, self.patterns
+        state = 0
+        for index, char in enumerate(text.lower()):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_id in output[state]:
+                pattern, payload = patterns[pattern_id]
+                yield index - len(pattern) + 1, index + 1, payload
+
+def _is_word_bounded(text: str, start: int, end: int) -> bool:
+    """Reject matches inside longer words or numbers"""
+    if start > 0 and text[start - 1].isalnum() and text[start].isalnum():
+        return False
+    if end < len(text) and text[end].isalnum() and text[end - 1].isalnum():
+        return False
+    return True
+
+class ExtractionResult:
+    """Entities found in one response, linked to knowledge base records"""
+
+    def __init__(self):
+        self.offices: List[Dict] = []
+        self.services: List[Dict] = []
+        self.laws: List[Dict] = []
+        self.phone_numbers: List[Dict] = []
+        self.actions: List[Dict] = []
+
+    @property
+    def suggested_actions(self) -> List[str]:
+        """Action texts in the ChatResponse.suggested_actions shape"""
+        return [action["text"] for action in self.actions]
+
+    @property
+    def office_locations(self) -> List[Dict]:
+        """Offices in the ChatResponse.office_locations shape"""
+        return [
+            {
+                "name": office["record"].get("name"),
+                "address": office["record"].get("address"),
+                "contact": office["record"].get("contact"),
+                "hours": office["record"].get("hours"),
+                "source": office["source"]
+            }
+            for office in self.offices
+        ]
+
+class _EntityAutomaton:
+    """Automaton and entity records built from one version of the knowledge base"""
+
+    def __init__(self, knowledge_base_dir: str):
+        self.automaton = AhoCorasick()
+        self.entity_count = 0
+
+        for path in iter_knowledge_files(knowledge_base_dir):
+            data = load_json_file(path)
+            if not isinstance(data, dict):
+                continue
+            source = path.relative_to(knowledge_base_dir).as_posix()
+
+            for office in data.get("offices", []) if isinstance(data.get("offices"), list) else []:
+                if not isinstance(office, dict):
+                    continue
+                entity = self._entity("office", office.get("name", ""), office, source)
+                for alias in office_aliases(office.get("name", "")):
+                    self.automaton.add(alias, entity)
+                for service in office.get("services", []):
+                    self._add("service", service.replace("_", " "), {"service": service, "office": office.get("name")}, source)
+                self._add_phones(office, entity, source)
+
+            for field in ("emergency_contacts", "utility_contacts"):
+                for contact in data.get(field, []):
+                    self._add_phones(contact, self._entity("contact", contact.get("service", ""), contact, source), source)
+
+            if "service_name" in data:
+                self._add("service", data["service_name"], {"id": data.get("id"), "service_name": data["service_name"]}, source)
+                self._add_phones(data.get("contact_info", {}), self._entity("contact", data["service_name"], data.get("contact_info", {}), source), source)
+
+            if "law_name" in data:
+                self._add("law", data["law_name"], {"id": data.get("id"), "law_name": data["law_name"]}, source)
+                for section_key, section in data.get("key_sections", {}).items():
+                    if isinstance(section, dict) and section.get("section"):
+                        name = f"{data['law_name']}, {section['section']}"
+                        self._add("law", name, {"id": data.get("id"), "law_name": name, "section": section_key}, source)
+
+            for scenario_id, scenario in data.get("scenarios", {}).items() if isinstance(data.get("scenarios"), dict) else []:
+                for law in scenario.get("relevant_laws", []):
+                    self._add("law", law, {"law_name": law, "scenario": scenario_id}, source)
+                contact = scenario.get("office_contact")
+                if isinstance(contact, dict):
+                    self._add_phones(contact, self._entity("contact", contact.get("name", ""), contact, source), source)
+
+        self.automaton.build()
+
+    def _entity(self, kind: str, name: str, record: Dict, source: str) -> Dict:
+        self.entity_count += 1
+        return {"type": kind, "name": name, "record": record, "source": source}
+
+    def _add(self, kind: str, name: str, record: Dict, source: str):
+        if name:
+            self.automaton.add(name, self._entity(kind, name, record, source))
+
+    def _add_phones(self, record: Dict, owner: Dict, source: str):
+        """Index phone numbers of a record, linked to the record that owns them"""
+        for field in _PHONE_FIELDS:
+            value = record.get(field)
+            if not isinstance(value, str) or not _PHONE_LIKE.match(value.strip()):
+                continue
+            numbers = [value.strip()]
+            # "+975-2-328236/324845" is usually written as its first number
+            if "/" in value:
+                numbers.append(value.split("/")[0].strip())
+            for number in numbers:
+                if len(number) >= 3:
+                    self.automaton.add(number, {"type": "phone", "name": number, "record": owner, "source": source})
+
+class KnowledgeEntityExtractor:
+    """Finds offices, services, laws, phone numbers and actions in responses"""
+
+    def __init__(self, knowledge_base_dir: str = KNOWLEDGE_BASE_DIR, check_interval: float = 5.0):
+        """Initialize and build the automaton from the knowledge base"""
+        self.knowledge_base_dir = knowledge_base_dir
+        self._automaton = _EntityAutomaton(knowledge_base_dir)
+        self._lock = threading.Lock()
+        self._watcher = FileChangeWatcher(lambda: iter_knowledge_files(self.knowledge_base_dir), check_interval)
+        logging.info(f"Entity extractor built with {len(self._automaton.automaton.patterns)} patterns")
+
+    def load(self):
+        """Rebuild the automaton from the knowledge base"""
+        automaton = _EntityAutomaton(self.knowledge_base_dir)
+        with self._lock:
+            self._automaton = automaton
+        logging.info(f"Entity extractor rebuilt with {len(automaton.automaton.patterns)} patterns")
+
+    def _current(self) -> _EntityAutomaton:
+        """Return the current automaton, rebuilding first if the knowledge base changed"""
+        if self._watcher.changed():
+            logging.info("Knowledge base changed, rebuilding entity extractor")
+            self.load()
+        return self._automaton
+
+    def _find_mentions(self, text: str) -> List[Tuple[int, int, Dict]]:
+        """Leftmost-longest, non-overlapping, word-bounded pattern matches"""
+        matches = [
+            match for match in self._current().automaton.iter_matches(text)
+            if _is_word_bounded(text, match[0], match[1])
+        ]
+        matches.sort(key=lambda match: (match[0], -(match[1] - match[0])))
+
+        mentions, covered_until = [], 0
+        for start, end, entity in matches:
+            if start >= covered_until:
+                mentions.append((start, end, entity))
+                covered_until = end
+        return mentions
+
+    def extract(self, text: str) -> ExtractionResult:
+        """
+        Extract knowledge base entities and suggested actions from a response
+
+        Args:
+            text: The response text
+
+        Returns:
+            ExtractionResult with entities linked to their source records
+        """
+        result = ExtractionResult()
+        mentions = self._find_mentions(text)
+
+        seen = set()
+        buckets = {
+            "office": result.offices,
+            "service": result.services,
+            "law": result.laws,
+            "phone": result.phone_numbers,
+        }
+        for _, _, entity in mentions:
+            bucket = buckets.get(entity["type"])
+            key = (entity["type"], entity["name"])
+            if bucket is None or key in seen:
+                continue
+            seen.add(key)
+            bucket.append(entity)
+
+            # A phone number belonging to an office also links that office
+            owner = entity["record"] if entity["type"] == "phone" else None
+            if owner and owner.get("type") == "office" and ("office", owner["name"]) not in seen:
+                seen.add(("office", owner["name"]))
+                result.offices.append(owner)
+
+        result.actions = self._extract_actions(text, mentions)
+        return result
+
+    def _extract_actions(self, text: str, mentions: List[Tuple[int, int, Dict]]) -> List[Dict]:
+        """Numbered and bulleted lines, each linked to the entities it mentions"""
+        numbered, bullets = [], []
+        offset, mention_index = 0, 0
+
+        for line in text.splitlines(keepends=True):
+            line_end = offset + len(line)
+            links = []
+            while mention_index < len(mentions) and mentions[mention_index][0] < line_end:
+                entity = mentions[mention_index][2]
+                links.append({"type": entity["type"], "name": entity["name"], "source": entity["source"]})
+                mention_index += 1
+
+            match = _NUMBERED_LINE.match(line)
+            target = numbered
+            if not match:
+                match = _BULLET_LINE.match(line)
+                target = bullets
+            if match:
+                target.append({"text": match.group(1).strip(), "links": links})
+
+            offset = line_end
+
+        return (numbered[:MAX_NUMBERED_ACTIONS] + bullets[:MAX_BULLET_ACTIONS])[:MAX_ACTIONS]
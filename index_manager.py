@@ -4,22 +4,71 @@ Handles creation and management of vector indices for Bhutan knowledge base
 """
 
 import os
+import time
+import asyncio
 import logging
 import json
-from typing import List, Optional, Dict, Any, Tuple
+import threading
+from typing import List, Optional, Dict, Any, Tuple, AsyncIterator, Callable
 
+from fastapi.concurrency import run_in_threadpool
 from llama_index.core import VectorStoreIndex, Document, Settings
-from llama_index.llms.azure_openai import AzureOpenAI
-from llama_index.embeddings.azure_openai import AzureOpenAIEmbedding
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.schema import BaseNode, ObjectType
 from llamaindexchatengine import CondensePlusContextChatEngine
-from llama_index.core.memory import ChatMemoryBuffer
 from document_loader import DocumentLoader
-from druk_system_prompt import DRUK_SYSTEM_PROMPT
+from druk_system_prompt import DRUK_SYSTEM_PROMPT, get_prompt_for_variant, get_prompt_variant_key
+from embedding_cache import QueryEmbeddingCache
+from partitioned_retriever import PartitionedRetriever, RetrievalScope, retrieval_scope
+from model_provider import ModelProvider, AzureOpenAIProvider
+from circuit_breaker import llm_breaker, embedding_breaker
+from summary_memory import RollingSummaryMemory
+from tracing import trace_handler, tracer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
+class ChatSession:
+    """
+    Per-session chat state served by the shared chat engine
+
+    Only the conversation memory, citizen context and prompt variant key are
+    kept per session; the retriever, engine and system prompt text are shared.
+    """
+    
+    __slots__ = ("session_id", "memory", "citizen_context", "prompt_variant", "_index_manager")
+    
+    def __init__(self, session_id: str, memory: RollingSummaryMemory, citizen_context: Optional[Dict],
+                 index_manager: "IndexManager"):
+        self.session_id = session_id
+        self.memory = memory
+        self.citizen_context = citizen_context or {}
+        self.prompt_variant = get_prompt_variant_key(self.citizen_context)
+        self._index_manager = index_manager
+    
+    @property
+    def system_prompt(self) -> str:
+        """System prompt for this session's variant (shared between sessions)"""
+        return get_prompt_for_variant(self.prompt_variant)
+    
+    def chat(self, message: str, query_type: Optional[str] = None):
+        """
+        Answer a message with the shared engine and this session's memory
+        
+        Retrieval searches the knowledge base categories for query_type and
+        skips office chunks of other dzongkhags than the citizen's.
+        """
+        engine = self._index_manager.get_chat_engine()
+        with retrieval_scope(query_type, self.citizen_context.get("dzongkhag")):
+            return engine.chat(message, memory=self.memory, system_prompt=self.system_prompt)
+    
+    async def achat(self, message: str, query_type: Optional[str] = None):
+        """Async version of chat"""
+        engine = self._index_manager.get_chat_engine()
+        with retrieval_scope(query_type, self.citizen_context.get("dzongkhag")):
+            return await engine.achat(message, memory=self.memory, system_prompt=self.system_prompt)
+
 class IndexManager:
     """Manages the creation and retrieval of vector indices for Druk"""
     
@@ -28,20 +77,41 @@ class IndexManager:
                  azure_endpoint: str, 
                  api_version: str,
                  azure_endpoint_embedding: str,
-                 system_prompt: str = DRUK_SYSTEM_PROMPT):
-        """Initialize the index manager"""
+                 system_prompt: str = DRUK_SYSTEM_PROMPT,
+                 provider: Optional[ModelProvider] = None):
+        """Initialize the index manager (provider defaults to Azure OpenAI with these credentials)"""
         self.document_loader = document_loader
         self.api_key = api_key
         self.azure_endpoint = azure_endpoint
         self.api_version = api_version
         self.azure_endpoint_embedding = azure_endpoint_embedding
         self.system_prompt = system_prompt
+        self.provider = provider or AzureOpenAIProvider(
+            api_key=api_key,
+            azure_endpoint=azure_endpoint,
+            api_version=api_version,
+            azure_endpoint_embedding=azure_endpoint_embedding,
+        )
         
         # Global state
         self.global_documents = []
         self.global_index = None
         self.global_index_needs_update = False
         
+        # Query embeddings shared between classification and retrieval
+        self.query_embedding_cache = QueryEmbeddingCache()
+        
+        # Chat engine shared by all sessions, rebuilt when the index changes
+        self._chat_engine = None
+        self._chat_engine_index = None
+        self._chat_retriever = None
+        self._engine_lock = threading.Lock()
+        
+        # Serializes every change of the documents and index (uploads,
+        # removals, rebuilds, background ingestion); reentrant because those
+        # paths call update_global_index while holding it
+        self._index_write_lock = threading.RLock()
+        
         # Initialize settings
         self._init_settings()
     
@@ -51,26 +121,23 @@ class IndexManager:
         Settings.chunk_overlap = 200
         Settings.num_output = 2048
         
-        # Azure OpenAI LLM
-        llm = AzureOpenAI(
-            model="gpt-4",
-            deployment_name="gpt-4",
-            api_key=self.api_key,
-            azure_endpoint=self.azure_endpoint,
-            api_version=self.api_version,
-        )
+        # LLM, embedding and retrieval events become spans of the request trace;
+        # set before the models so Settings hands them the same manager
+        Settings.callback_manager = CallbackManager([trace_handler])
         
-        # Azure OpenAI Embeddings
-        embed_model = AzureOpenAIEmbedding(
-            model="text-embedding-3-large",
-            deployment_name="text-embedding-3-large",
-            api_key=self.api_key,
-            azure_endpoint=self.azure_endpoint_embedding,
-            api_version="2023-05-15",
-        )
+        llm = self.provider.create_llm()
+        embed_model = self.provider.create_embed_model()
+        logging.info(f"Model provider: {self.provider.name} "
+                     f"(llm {llm.metadata.model_name}, embeddings {embed_model.model_name})")
         
         Settings.llm = llm
         Settings.embed_model = embed_model
+        
+        # While a breaker is open these tiny calls detect Azure's recovery
+        llm_breaker.set_probe(lambda: llm.complete("Reply with OK.", max_tokens=1))
+        embedding_breaker.set_probe(lambda: embed_model.get_query_embedding("ping"))
+        self.llm = llm
+        self.embed_model = embed_model
     
     async def initialize(self):
         """Initialize the index manager with Bhutan knowledge base"""
@@ -86,56 +153,231 @@ class IndexManager:
         try:
             # If index doesn't exist or needs update
             if self.global_index is None or self.global_index_needs_update:
-                if not self.global_documents:
-                    logging.warning("No documents available to create index")
-                    return False
-                
-                # Create index from global documents
-                logging.info(f"Creating Druk index from {len(self.global_documents)} documents")
-                self.global_index = VectorStoreIndex.from_documents(self.global_documents)
-                self.global_index_needs_update = False
-                
-                logging.info("Successfully created Druk knowledge base index")
-                return True
+                with self._index_write_lock:
+                    if self.global_index is not None and not self.global_index_needs_update:
+                        return True
+                    if not self.global_documents:
+                        logging.warning("No documents available to create index")
+                        return False
+                    
+                    # Create index from global documents
+                    logging.info(f"Creating Druk index from {len(self.global_documents)} documents")
+                    self.global_index = VectorStoreIndex.from_documents(self.global_documents)
+                    self.global_index_needs_update = False
+                    
+                    logging.info("Successfully created Druk knowledge base index")
+                    return True
             
             return True
         except Exception as e:
             logging.error(f"Error updating global index: {str(e)}")
             return False
     
-    def init_chat_engine(self, session_id: str, system_prompt: Optional[str] = None) -> Tuple[Any, List[str]]:
-        """Initialize a chat engine for the session using the global knowledge base"""
+    def get_chat_engine(self) -> CondensePlusContextChatEngine:
+        """Return the shared chat engine, building it for the current index if needed"""
+        if not self.update_global_index():
+            raise ValueError("Druk's knowledge base is not available. Please contact support.")
+        
+        with self._engine_lock:
+            if self._chat_engine is None or self._chat_engine_index is not self.global_index:
+                # Sessions pass their own memory and system prompt on every call
+                self._chat_retriever = PartitionedRetriever(self.global_index, similarity_top_k=2)  # More context for government info
+                self._chat_engine = CondensePlusContextChatEngine.from_defaults(
+                    retriever=self._chat_retriever,
+                    verbose=True,
+                    system_prompt=self.system_prompt,
+                    query_embedding_cache=self.query_embedding_cache
+                )
+                self._chat_engine_index = self.global_index
+                logging.info("Built shared chat engine for the current index")
+            return self._chat_engine
+    
+    def init_chat_engine(self, session_id: str, citizen_context: Optional[Dict] = None) -> Tuple[ChatSession, List[str]]:
+        """Create the chat state for a session, served by the shared chat engine"""
         try:
-            # Check if the global index exists or needs updating
-            if not self.update_global_index():
-                raise ValueError("Druk's knowledge base is not available. Please contact support.")
+            # Make sure the shared engine can be built before handing out a session
+            self.get_chat_engine()
             
             doc_debug_info = [f"Using Druk knowledge base with {len(self.global_documents)} documents"]
             
-            # Use provided system prompt or default
-            chat_system_prompt = system_prompt or self.system_prompt
-                    
-            # Initialize chat memory (session-specific)
-            memory = ChatMemoryBuffer.from_defaults(token_limit=500)
-
-            # Create chat engine with Druk's personality
-            chat_engine = CondensePlusContextChatEngine.from_defaults(
-                retriever=self.global_index.as_retriever(similarity_top_k=2),  # More context for government info
-                memory=memory,
-                verbose=True,
-                system_prompt=chat_system_prompt
-            )
+            # Session-specific memory; older turns are folded into a running
+            # summary instead of being dropped
+            memory = RollingSummaryMemory.from_defaults(llm=self.llm)
             
-            return chat_engine, doc_debug_info
+            return ChatSession(session_id, memory, citizen_context, self), doc_debug_info
         except Exception as e:
             logging.error(f"Error initializing chat engine for session {session_id}: {str(e)}")
             raise e
     
+    async def abatch_chat(self, questions: List[Dict], concurrency: int = 4,
+                          classify: Optional[Callable[[str], str]] = None,
+                          enhance: Optional[Callable[[str, str], str]] = None,
+                          slot: Optional[Callable[[], Any]] = None) -> AsyncIterator[Dict]:
+        """
+        Answer many independent questions, yielding each result as it completes
+        
+        Questions are embedded in one batched call (reusing cached query
+        embeddings), retrieved together with one matrix product over the
+        knowledge base and synthesized at most `concurrency` at a time. There
+        is no memory or condensing; every question stands on its own.
+        
+        Args:
+            questions: Dicts with "message" and optionally "id", "query_type" and "citizen_context"
+            concurrency: Syntheses running at the same time
+            classify: Sets the query type of questions without one; runs after
+                the batch embedding, so a classifier using the shared cache makes no calls
+            enhance: Rewrites (message, query_type) into the text synthesized from
+            slot: Factory of an async context manager held around each synthesis
+                (e.g. an admission control slot)
+            
+        Yields:
+            One result per question, in completion order, with per-item timings in ms
+        """
+        batch_started = time.perf_counter()
+        engine = self.get_chat_engine()
+        retriever = self._chat_retriever
+        messages = [question["message"] for question in questions]
+        
+        with tracer.stage("query_embedding"):
+            embeddings = await self._aembed_queries(messages)
+        embedded = time.perf_counter()
+        
+        def classify_all() -> List[Optional[str]]:
+            query_types = []
+            for question in questions:
+                query_type = question.get("query_type")
+                if not query_type and classify is not None:
+                    query_type = classify(question["message"])
+                query_types.append(query_type)
+            return query_types
+        
+        # A cache miss makes the classifier embed, so keep it off the event loop
+        query_types = await run_in_threadpool(classify_all)
+        prompts = [enhance(question["message"], query_type) if enhance else question["message"]
+                   for question, query_type in zip(questions, query_types)]
+        
+        with tracer.stage("retrieval"):
+            scopes = [
+                RetrievalScope(query_type, (question.get("citizen_context") or {}).get("dzongkhag"))
+                for question, query_type in zip(questions, query_types)
+            ]
+            node_lists = retriever.retrieve_batch(embeddings, scopes)
+        retrieved = time.perf_counter()
+        shared_timings = {
+            "embedding_ms": round((embedded - batch_started) * 1000, 1),
+            "retrieval_ms": round((retrieved - embedded) * 1000, 1),
+        }
+        
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        
+        async def answer(position: int) -> Dict:
+            question = questions[position]
+            result = {
+                "index": position,
+                "id": question.get("id"),
+                "message": question["message"],
+                "query_type": query_types[position],
+                "response": None,
+                "sources": [node.node.metadata.get("source") for node in node_lists[position]],
+                "error": None,
+            }
+            queued = time.perf_counter()
+            started = queued
+            try:
+                async with semaphore:
+                    if slot is not None:
+                        async with slot():
+                            started = time.perf_counter()
+                            result["response"] = await self._aanswer(engine, prompts[position], question,
+                                                                     node_lists[position])
+                    else:
+                        started = time.perf_counter()
+                        result["response"] = await self._aanswer(engine, prompts[position], question,
+                                                                 node_lists[position])
+            except Exception as e:
+                logging.error(f"Batch question {position} failed: {str(e)}")
+                result["error"] = str(e)
+            finished = time.perf_counter()
+            result["timings"] = {
+                **shared_timings,
+                "queued_ms": round((started - queued) * 1000, 1),
+                "synthesis_ms": round((finished - started) * 1000, 1),
+                "total_ms": round((finished - batch_started) * 1000, 1),
+            }
+            return result
+        
+        tasks = [asyncio.ensure_future(answer(position)) for position in range(len(questions))]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # The consumer went away: don't keep calling the LLM for nobody
+            for task in tasks:
+                task.cancel()
+    
+    async def _aembed_queries(self, messages: List[str]) -> List[List[float]]:
+        """Embeddings of many queries, fetching the uncached ones in one batched call"""
+        embeddings = [self.query_embedding_cache.get(message) for message in messages]
+        missing = sorted({message for message, embedding in zip(messages, embeddings) if embedding is None})
+        if missing:
+            with embedding_breaker.guard():
+                fetched = await self.embed_model.aget_text_embedding_batch(missing)
+            by_message = dict(zip(missing, fetched))
+            for message, embedding in by_message.items():
+                self.query_embedding_cache.put(message, embedding)
+            embeddings = [by_message.get(message) if embedding is None else embedding
+                          for message, embedding in zip(messages, embeddings)]
+        return embeddings
+    
+    async def _aanswer(self, engine: CondensePlusContextChatEngine, prompt: str,
+                       question: Dict, nodes: List) -> str:
+        """Synthesize one batch answer with the prompt variant of its citizen context"""
+        variant = get_prompt_variant_key(question.get("citizen_context") or {})
+        return await engine.aanswer(prompt, nodes, system_prompt=get_prompt_for_variant(variant))
+    
+    def add_embedded_nodes(self, documents: List[Document], nodes: List[BaseNode]) -> int:
+        """
+        Add already embedded nodes without re-embedding the knowledge base
+        
+        Builds a new index from the current nodes (with their stored
+        embeddings) plus the new ones and swaps it in, so requests being
+        answered keep reading the old index and no embedding calls are made.
+        
+        Returns:
+            Number of nodes in the new index
+        """
+        with self._index_write_lock:
+            if not self.update_global_index() and self.global_documents:
+                raise ValueError("The current knowledge base index could not be built")
+            
+            current_nodes = []
+            if self.global_index is not None:
+                vector_store = self.global_index.vector_store
+                for node in self.global_index.docstore.docs.values():
+                    node_copy = node.model_copy()
+                    node_copy.embedding = vector_store.get(node.node_id)
+                    # Docstore round-trips leave relationship node types as plain strings
+                    for related in node_copy.relationships.values():
+                        for info in related if isinstance(related, list) else [related]:
+                            if isinstance(info.node_type, str):
+                                info.node_type = ObjectType(info.node_type)
+                    current_nodes.append(node_copy)
+            
+            new_index = VectorStoreIndex(nodes=current_nodes + list(nodes))
+            self.global_documents.extend(documents)
+            self.global_index = new_index
+            logging.info(f"Added {len(nodes)} nodes from {len(documents)} documents to the Druk index")
+            return len(current_nodes) + len(nodes)
+    
     async def add_documents(self, documents: List[Document]) -> List[str]:
         """Add documents to the global knowledge base"""
+        if not documents:
+            return []
+        return await run_in_threadpool(self._add_documents, documents)
+    
+    def _add_documents(self, documents: List[Document]) -> List[str]:
         debug_info = []
-        
-        if documents:
+        with self._index_write_lock:
             self.global_documents.extend(documents)
             self.global_index_needs_update = True
             debug_info.append(f"Added to Druk knowledge base (now {len(self.global_documents)} documents)")
@@ -150,27 +392,31 @@ class IndexManager:
     
     async def remove_document(self, file_path: str) -> int:
         """Remove a document from the global knowledge base and update the index"""
-        # Remove the document from the global knowledge base if it exists
-        docs_to_remove = []
-        for i, doc in enumerate(self.global_documents):
-            if hasattr(doc, 'metadata') and doc.metadata and doc.metadata.get('file_path') == file_path:
-                docs_to_remove.append(i)
-        
-        # If no documents to remove, return early
-        if not docs_to_remove:
-            return 0
+        return await run_in_threadpool(self._remove_document, file_path)
+    
+    def _remove_document(self, file_path: str) -> int:
+        with self._index_write_lock:
+            # Remove the document from the global knowledge base if it exists
+            docs_to_remove = []
+            for i, doc in enumerate(self.global_documents):
+                if hasattr(doc, 'metadata') and doc.metadata and doc.metadata.get('file_path') == file_path:
+                    docs_to_remove.append(i)
             
-        # Remove from highest index to lowest to avoid index shifting issues
-        for i in sorted(docs_to_remove, reverse=True):
-            del self.global_documents[i]
-        
-        # Flag the index for updating
-        self.global_index_needs_update = True
-        
-        # Update the index
-        self.update_global_index()
-        
-        return len(docs_to_remove)
+            # If no documents to remove, return early
+            if not docs_to_remove:
+                return 0
+                
+            # Remove from highest index to lowest to avoid index shifting issues
+            for i in sorted(docs_to_remove, reverse=True):
+                del self.global_documents[i]
+            
+            # Flag the index for updating
+            self.global_index_needs_update = True
+            
+            # Update the index
+            self.update_global_index()
+            
+            return len(docs_to_remove)
     
     async def rebuild_index(self) -> Dict[str, Any]:
         """Manually rebuild the index from all documents"""
@@ -181,9 +427,8 @@ class IndexManager:
                     "message": "No documents found to index"
                 }
             
-            # Force rebuild of index
-            self.global_index_needs_update = True
-            self.update_global_index()
+            # Force rebuild of index, after any ingestion or removal in progress
+            await run_in_threadpool(self._rebuild_index)
             
             return {
                 "status": "success",
@@ -194,6 +439,11 @@ class IndexManager:
             logging.error(f"Error rebuilding index: {str(e)}")
             raise e
     
+    def _rebuild_index(self):
+        with self._index_write_lock:
+            self.global_index_needs_update = True
+            self.update_global_index()
+    
     async def get_index_status(self) -> Dict[str, Any]:
         """Get the status of the index"""
         try:
@@ -0,0 +1,304 @@
+"""
+Ingestion Jobs Module for Ask Druk
+Background document ingestion with progress polling and cancellation
+
+An upload is streamed to TEMP_DIR in chunks while the request body arrives,
+then queued. A small worker pool reads the file one page, row block or text
+block at a time, splits each part into nodes and embeds them in batches as
+soon as a batch is full, so a 300-page act never has more than one page and
+one batch of unembedded nodes in flight. The nodes are then added to the
+index without re-embedding the rest of the knowledge base. Chat requests keep
+being served from the current index the whole time; the new index is swapped
+in when the job completes.
+"""
+
+import os
+import time
+import uuid
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from llama_index.core import Settings
+from llama_index.core.schema import MetadataMode
+
+from circuit_breaker import embedding_breaker
+from document_loader import DocumentLoader, TEMP_DIR
+from metrics import registry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+QUEUED = "queued"
+SPOOLING = "spooling"
+PARSING = "parsing"
+EMBEDDING = "embedding"
+INDEXING = "indexing"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+# Nodes embedded per request to the embedding API
+EMBED_BATCH_SIZE = 16
+
+ingestion_jobs_total = registry.counter(
+    "druk_ingestion_jobs_total",
+    "Finished ingestion jobs by final status",
+    ["status"]
+)
+
+class IngestionCancelled(Exception):
+    """Raised inside a job when its cancellation was requested"""
+
+class IngestionQueueFull(Exception):
+    """Raised when too many jobs are already queued or running"""
+
+class IngestionJob:
+    """One uploaded file on its way into the knowledge base"""
+
+    def __init__(self, filename: str, size_hint: Optional[int] = None):
+        self.job_id = uuid.uuid4().hex
+        self.filename = filename
+        self.status = SPOOLING
+        self.size_hint = size_hint
+        self.bytes_received = 0
+        self.documents = 0
+        self.file_read = 0.0
+        self.nodes_total = 0
+        self.nodes_embedded = 0
+        self.error: Optional[str] = None
+        self.debug_info: List[str] = []
+        self.created_at = datetime.datetime.now().isoformat()
+        self.finished_at: Optional[str] = None
+        self.file_path: Optional[str] = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise IngestionCancelled()
+
+    @property
+    def progress(self) -> float:
+        """Rough completion between 0 and 1"""
+        if self.status == COMPLETED:
+            return 1.0
+        if self.status in (SPOOLING, QUEUED):
+            return 0.0
+        if self.status == INDEXING:
+            return 0.95
+        # Reading and embedding are interleaved: the share of the file read,
+        # discounted by the nodes still waiting for embedding
+        embedded = self.nodes_embedded / self.nodes_total if self.nodes_total else 0.0
+        return round(0.05 + 0.9 * self.file_read * embedded, 3)
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "status": self.status,
+            "progress": self.progress,
+            "bytes_received": self.bytes_received,
+            "documents": self.documents,
+            "file_read": round(self.file_read, 3),
+            "nodes_total": self.nodes_total,
+            "nodes_embedded": self.nodes_embedded,
+            "error": self.error,
+            "debug_info": self.debug_info,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+class IngestionJobQueue:
+    """Bounded queue of ingestion jobs run by a small thread pool"""
+
+    def __init__(self, document_loader: DocumentLoader, index_manager, workers: int = 1,
+                 max_pending: int = 4, max_bytes: int = 100 * 1024 * 1024, keep_finished: int = 100):
+        """
+        Args:
+            document_loader: Parses spooled files into documents
+            index_manager: Receives the embedded nodes
+            workers: Jobs parsed and embedded at the same time
+            max_pending: Jobs allowed to be spooling, queued or running at once
+            max_bytes: Largest accepted upload
+            keep_finished: Finished jobs kept for status polling
+        """
+        self.document_loader = document_loader
+        self.index_manager = index_manager
+        self.max_pending = max_pending
+        self.max_bytes = max_bytes
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingestion")
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _pending(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status not in FINISHED_STATES)
+
+    def create_job(self, filename: str, size_hint: Optional[int] = None) -> IngestionJob:
+        """
+        Register a job for an upload about to be spooled
+
+        Raises:
+            ValueError: Unsupported file type or the declared size is too large
+            IngestionQueueFull: Too many jobs in flight
+        """
+        ext = os.path.splitext(filename)[1].lower()
+        if ext not in self.document_loader.supported_extensions:
+            raise ValueError(f"Unsupported file type: {ext or filename}. "
+                             f"Supported types: {', '.join(self.document_loader.supported_extensions)}")
+        if size_hint is not None and size_hint > self.max_bytes:
+            raise ValueError(f"File too large ({size_hint} bytes; limit {self.max_bytes})")
+
+        job = IngestionJob(os.path.basename(filename), size_hint)
+        with self._lock:
+            if self._pending() >= self.max_pending:
+                raise IngestionQueueFull(f"{self.max_pending} ingestion jobs already in progress")
+            self._jobs[job.job_id] = job
+            self._trim()
+        return job
+
+    async def spool(self, job: IngestionJob, chunks: AsyncIterator[bytes]):
+        """Write the upload to disk as it arrives, then queue the job"""
+        ext = os.path.splitext(job.filename)[1].lower()
+        job.file_path = os.path.join(TEMP_DIR, f"{job.job_id}{ext}")
+        try:
+            with open(job.file_path, "wb") as buffer:
+                async for chunk in chunks:
+                    job.check_cancelled()
+                    job.bytes_received += len(chunk)
+                    if job.bytes_received > self.max_bytes:
+                        raise ValueError(f"File too large (over {self.max_bytes} bytes)")
+                    await run_in_threadpool(buffer.write, chunk)
+        except IngestionCancelled:
+            self._finish(job, CANCELLED)
+            return
+        except Exception as e:
+            self._finish(job, FAILED, f"Upload failed: {str(e)}")
+            return
+
+        job.status = QUEUED
+        job.debug_info.append(f"Received {job.bytes_received} bytes")
+        self._executor.submit(self._run, job)
+
+    def _run(self, job: IngestionJob):
+        """Parse, split, embed and index one job (worker thread)"""
+        started = time.perf_counter()
+        with self._lock:
+            if job.status != QUEUED:
+                # Cancelled while waiting for a worker
+                return
+            job.status = PARSING
+        try:
+            documents, nodes, pending = [], [], []
+            for document, fraction in self.document_loader.stream_uploaded_file(job.file_path, job.filename):
+                job.check_cancelled()
+                documents.append(document)
+                job.documents += 1
+                job.file_read = fraction
+                part_nodes = Settings.node_parser.get_nodes_from_documents([document])
+                job.nodes_total += len(part_nodes)
+                pending.extend(part_nodes)
+                while len(pending) >= EMBED_BATCH_SIZE:
+                    nodes.extend(self._embed_batch(job, pending[:EMBED_BATCH_SIZE]))
+                    del pending[:EMBED_BATCH_SIZE]
+            if pending:
+                nodes.extend(self._embed_batch(job, pending))
+            if not nodes:
+                raise ValueError("No content could be extracted from the file")
+            job.debug_info.append(f"Read {len(documents)} part(s) of {job.filename} into {len(nodes)} chunks")
+            
+            job.check_cancelled()
+            job.status = INDEXING
+            total = self.index_manager.add_embedded_nodes(documents, nodes)
+            job.debug_info.append(f"Added {len(nodes)} chunks; the index now has {total}")
+            logging.info(f"Ingestion job {job.job_id} ({job.filename}) finished in "
+                         f"{time.perf_counter() - started:.1f}s")
+            self._finish(job, COMPLETED)
+        except IngestionCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            logging.error(f"Ingestion job {job.job_id} ({job.filename}) failed: {str(e)}")
+            self._finish(job, FAILED, str(e))
+
+    def _embed_batch(self, job: IngestionJob, batch: List) -> List:
+        """Embed one batch of nodes in place"""
+        job.check_cancelled()
+        job.status = EMBEDDING
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+        with embedding_breaker.guard():
+            embeddings = self.index_manager.embed_model.get_text_embedding_batch(texts)
+        for node, embedding in zip(batch, embeddings):
+            node.embedding = embedding
+        job.nodes_embedded += len(batch)
+        return batch
+    
+    def _finish(self, job: IngestionJob, status: str, error: Optional[str] = None):
+        job.status = status
+        job.error = error
+        job.finished_at = datetime.datetime.now().isoformat()
+        ingestion_jobs_total.inc(1, status)
+        if job.file_path and os.path.exists(job.file_path):
+            os.remove(job.file_path)
+
+    def cancel(self, job_id: str) -> Optional[IngestionJob]:
+        """Request cancellation; the job stops at its next checkpoint"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return job
+            job._cancel.set()
+            if job.status == QUEUED:
+                job.debug_info.append("Cancelled before it started")
+                self._finish(job, CANCELLED)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[Dict]:
+        with self._lock:
+            return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def _trim(self):
+        """Forget the oldest finished jobs beyond keep_finished"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def job_counts(self) -> Dict:
+        """Jobs per status, for /metrics"""
+        counts = {(status,): 0 for status in (SPOOLING, QUEUED, PARSING, EMBEDDING, INDEXING)}
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status not in FINISHED_STATES:
+                    counts[(job.status,)] = counts.get((job.status,), 0) + 1
+        return counts
+
+def job_queue_from_env(document_loader: DocumentLoader, index_manager) -> IngestionJobQueue:
+    """Queue configured by the INGESTION_* environment variables"""
+    queue = IngestionJobQueue(
+        document_loader,
+        index_manager,
+        workers=int(os.getenv("INGESTION_WORKERS", "1")),
+        max_pending=int(os.getenv("INGESTION_MAX_PENDING", "4")),
+        max_bytes=int(os.getenv("INGESTION_MAX_BYTES", str(100 * 1024 * 1024))),
+    )
+    registry.callback(
+        "druk_ingestion_jobs",
+        "Ingestion jobs in progress, by stage",
+        ["status"],
+        queue.job_counts
+    )
+    return queue
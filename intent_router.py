@@ -0,0 +1,382 @@
+"""
+Intent Router Module for Ask Druk
+Answers high-confidence structured queries from the knowledge base without the RAG pipeline
+
+Runs after detect_query_type. Greetings, emergency contacts, office details
+and service fees/documents/timelines are answered by deterministic handlers
+backed by the knowledge base JSON; everything else goes to the chat engine.
+A handler only answers when its cue words and the message's query type
+agree, so a complaint that mentions the police or a question about why an
+office is closed still reaches the LLM.
+"""
+
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from kb_utils import normalize_text
+from office_index import OfficeIndex
+from knowledge_tables import KnowledgeTables
+from metrics import route_seconds
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Longer messages are treated as open-ended and sent to the LLM
+MAX_ROUTABLE_WORDS = 12
+
+GREETINGS = {"hi", "hello", "hey", "kuzuzangpo", "kuzuzangpo la", "start", "good morning", "good afternoon", "good evening"}
+
+EMERGENCY_CUES = {"emergency", "ambulance", "police", "helpline", "hotline"}
+# "who do I contact to complain" is a request for help, not for a phone list
+CONTACT_CUES = {"contacts", "number", "numbers", "phone", "helpline", "hotline"}
+
+# Questions asking for reasons or advice are open-ended, whatever they mention
+OPEN_ENDED_CUES = {"why", "should", "complain", "complaint", "harassed", "unfair"}
+
+OFFICE_DETAIL_CUES = {
+    "hours": {"hours", "hour", "timing", "timings", "open", "opening", "close", "closing"},
+    "address": {"where", "address", "location", "located", "directions"},
+    "contact": {"contact", "phone", "number", "email", "call"},
+}
+
+SERVICE_DETAIL_CUES = {
+    "fees": {"fee", "fees", "cost", "costs", "price", "charge", "charges", "much"},
+    "documents": {"documents", "document", "papers", "requirements"},
+    "time": {"long", "time", "duration", "days", "processing"},
+}
+
+# Query types each handler may answer; other types go to the LLM
+HANDLER_QUERY_TYPES = {
+    "emergency": {"office_finder", "service_guide", "general_inquiry"},
+    "service_details": {"service_guide", "document_help", "office_finder", "general_inquiry"},
+    "office_details": {"office_finder", "service_guide", "general_inquiry"},
+}
+
+# Service ids whose office is named differently in the offices file
+SERVICE_ID_SUFFIXES = ("_application", "_registration")
+
+class RoutedAnswer:
+    """A deterministic answer in the same shape as a chat engine response"""
+
+    def __init__(self, route: str, response: str, query_type: str,
+                 suggested_actions: Optional[List[str]] = None,
+                 office_locations: Optional[List[Dict]] = None):
+        self.route = route
+        self.response = response
+        self.query_type = query_type
+        self.suggested_actions = suggested_actions or []
+        self.office_locations = office_locations or []
+
+class RouteMetrics:
+    """Per-route request counts and latency, including the LLM route"""
+
+    def __init__(self, window: int = 1000):
+        """Initialize metrics keeping the last `window` latency samples per route"""
+        self._window = window
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+        self._total_seconds: Dict[str, float] = {}
+        self._samples: Dict[str, deque] = {}
+
+    def record(self, route: str, seconds: float):
+        """Record one request served by a route"""
+        route_seconds.observe(seconds, route)
+        with self._lock:
+            self._counts[route] = self._counts.get(route, 0) + 1
+            self._total_seconds[route] = self._total_seconds.get(route, 0.0) + seconds
+            samples = self._samples.get(route)
+            if samples is None:
+                samples = self._samples[route] = deque(maxlen=self._window)
+            samples.append(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get counts, the share served without an LLM call and latency per route"""
+        with self._lock:
+            counts = dict(self._counts)
+            totals = dict(self._total_seconds)
+            samples = {route: sorted(values) for route, values in self._samples.items()}
+
+        total = sum(counts.values())
+        without_llm = total - counts.get(LLM_ROUTE, 0)
+        routes = {}
+        for route, count in counts.items():
+            values = samples.get(route, [])
+            routes[route] = {
+                "count": count,
+                "avg_ms": round(totals[route] / count * 1000, 3),
+                "p50_ms": round(_percentile(values, 0.50) * 1000, 3),
+                "p95_ms": round(_percentile(values, 0.95) * 1000, 3),
+                "max_ms": round(values[-1] * 1000, 3) if values else 0.0
+            }
+
+        return {
+            "total_requests": total,
+            "served_without_llm": without_llm,
+            "share_without_llm": round(without_llm / total, 4) if total else 0.0,
+            "routes": routes
+        }
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+# Route name used when a message falls through to the chat engine
+LLM_ROUTE = "llm"
+
+# Route name used when the chat engine is unavailable and degraded mode answers
+DEGRADED_ROUTE = "degraded"
+
+class IntentRouter:
+    """Sends high-confidence structured intents to deterministic handlers"""
+
+    def __init__(self, office_index: OfficeIndex, knowledge_tables: KnowledgeTables,
+                 emergency_contacts: List[Dict], welcome_message: str):
+        """Initialize the router with the knowledge base lookups it answers from"""
+        self.office_index = office_index
+        self.knowledge_tables = knowledge_tables
+        self.emergency_contacts = emergency_contacts
+        self.welcome_message = welcome_message
+        self.metrics = RouteMetrics()
+
+        # Handlers are tried in order; each returns None when not confident
+        self._handlers: List[Callable[[str, set, str], Optional[RoutedAnswer]]] = [
+            self._route_greeting,
+            self._route_emergency,
+            self._route_service_details,
+            self._route_office_details,
+        ]
+
+    def route(self, message: str, query_type: str) -> Optional[RoutedAnswer]:
+        """
+        Answer a message deterministically if its intent is unambiguous
+
+        Args:
+            message: The user's message
+            query_type: Label from detect_query_type
+
+        Returns:
+            A RoutedAnswer, or None if the message should go to the LLM
+        """
+        normalized = normalize_text(message)
+        words = normalized.split()
+        if not words or len(words) > MAX_ROUTABLE_WORDS:
+            return None
+
+        word_set = set(words)
+        if word_set & OPEN_ENDED_CUES:
+            return None
+        for handler in self._handlers:
+            try:
+                answer = handler(normalized, word_set, query_type)
+            except Exception as e:
+                logging.error(f"Error in intent handler {handler.__name__}: {str(e)}")
+                continue
+            if answer is not None:
+                return answer
+
+        return None
+
+    def lookup(self, message: str) -> Optional[RoutedAnswer]:
+        """
+        Everything the knowledge base JSON holds about the one service or office a message names
+
+        Used in degraded mode when the LLM is unavailable, so unlike route()
+        it accepts long messages and does not need a fees/hours/... cue.
+        """
+        normalized = normalize_text(message)
+        words = set(normalized.split())
+        lookups = (
+            (self._route_service_details, SERVICE_DETAIL_CUES),
+            (self._route_office_details, OFFICE_DETAIL_CUES),
+        )
+        for handler, cues in lookups:
+            try:
+                answer = handler(normalized, words | set().union(*cues.values()), "general_inquiry")
+            except Exception as e:
+                logging.error(f"Error in intent handler {handler.__name__}: {str(e)}")
+                continue
+            if answer is not None:
+                return answer
+        return None
+
+    def check_service_offices(self) -> List[str]:
+        """Service ids in the knowledge tables that resolve to no office (logged as warnings)"""
+        missing = []
+        for service_id in self.knowledge_tables.list_services():
+            guide = self.knowledge_tables.get_service_data(service_id) or {}
+            if not self._service_offices(service_id, guide):
+                missing.append(service_id)
+        if missing:
+            logging.warning(f"Service guides without a matching office: {', '.join(missing)}")
+        return missing
+
+    def _service_offices(self, service_id: str, guide: Dict) -> List[Dict]:
+        """Offices providing a service: those the guide names, else those indexed under its id"""
+        offices = {}
+        for name in guide.get("offices", []):
+            # "Immigration Office, Thimphu", "Road Safety and Transport Authority (RSTA) offices"
+            matched = self.office_index.find_in_text(name)
+            if not matched:
+                office = self.office_index.match_name(name)
+                matched = [office] if office else []
+            for office in matched:
+                offices.setdefault(office.get("name"), office)
+        if offices:
+            return list(offices.values())
+
+        candidates = [service_id] + [service_id[:-len(suffix)] for suffix in SERVICE_ID_SUFFIXES
+                                     if service_id.endswith(suffix)]
+        for candidate in candidates:
+            found = self.office_index.find(candidate)
+            if found:
+                return found
+        return []
+
+    def _route_greeting(self, normalized: str, words: set, query_type: str) -> Optional[RoutedAnswer]:
+        """Bare greetings get the welcome message"""
+        if normalized not in GREETINGS:
+            return None
+        return RoutedAnswer(
+            route="greeting",
+            response=self.welcome_message,
+            query_type="general_inquiry",
+            suggested_actions=[
+                "How do I apply for a passport?",
+                "What are my employment rights?",
+                "Where is the immigration office?"
+            ]
+        )
+
+    def _route_emergency(self, normalized: str, words: set, query_type: str) -> Optional[RoutedAnswer]:
+        """Requests for emergency numbers get the /emergency-contacts list"""
+        if query_type not in HANDLER_QUERY_TYPES["emergency"]:
+            return None
+        if not words & EMERGENCY_CUES:
+            return None
+        if normalized != "emergency" and not words & CONTACT_CUES:
+            return None
+
+        lines = ["### Emergency Contacts in Bhutan:"]
+        for contact in self.emergency_contacts:
+            lines.append(f"• **{contact['service']}**: {contact['number']} ({contact['available']})")
+        lines.append("\nIn a life-threatening situation, call immediately.")
+
+        return RoutedAnswer(
+            route="emergency_contacts",
+            response="\n".join(lines),
+            query_type="office_finder",
+            suggested_actions=[f"Call {c['service']}: {c['number']}" for c in self.emergency_contacts[:3]]
+        )
+
+    def _route_office_details(self, normalized: str, words: set, query_type: str) -> Optional[RoutedAnswer]:
+        """Hours, address or contact of a named office"""
+        if query_type not in HANDLER_QUERY_TYPES["office_details"]:
+            return None
+        details = [name for name, cues in OFFICE_DETAIL_CUES.items() if words & cues]
+        if not details:
+            return None
+
+        offices = self.office_index.find_in_text(normalized)
+        if len(offices) != 1:
+            return None
+
+        office = offices[0]
+        lines = [f"**Office:** {office['name']}"]
+        if office.get("address"):
+            lines.append(f"📍 {office['address']}")
+        if office.get("contact"):
+            lines.append(f"📞 {office['contact']}")
+        if office.get("email"):
+            lines.append(f"✉️ {office['email']}")
+        if office.get("hours"):
+            lines.append(f"🕒 {office['hours']}")
+        if office.get("services"):
+            services = ", ".join(service.replace("_", " ") for service in office["services"])
+            lines.append(f"\n**Services:** {services}")
+
+        return RoutedAnswer(
+            route="office_details",
+            response="\n".join(lines),
+            query_type="office_finder",
+            suggested_actions=[f"Call {office['name']}: {office['contact']}"] if office.get("contact") else [],
+            office_locations=[_office_location(office)]
+        )
+
+    def _route_service_details(self, normalized: str, words: set, query_type: str) -> Optional[RoutedAnswer]:
+        """Fees, required documents or processing time of a named service"""
+        if query_type not in HANDLER_QUERY_TYPES["service_details"]:
+            return None
+        details = [name for name, cues in SERVICE_DETAIL_CUES.items() if words & cues]
+        if not details:
+            return None
+
+        services = self.knowledge_tables.find_services_in_text(normalized)
+        if len(services) != 1:
+            return None
+
+        guide = self.knowledge_tables.get_service_data(services[0])
+        if not guide:
+            return None
+
+        service_name = guide["title"][:-len(" Guide")] if guide["title"].endswith(" Guide") else guide["title"]
+        sections = []
+
+        if "fees" in details and guide.get("fees"):
+            sections.append(_format_fees(service_name, guide["fees"]))
+
+        if "documents" in details:
+            documents = []
+            for step in guide.get("steps", []):
+                for document in step.get("documents", []):
+                    if document not in documents:
+                        documents.append(document)
+            if documents:
+                sections.append(f"### Documents you need for {service_name}:\n" +
+                                "\n".join(f"• {document}" for document in documents))
+
+        if "time" in details and guide.get("total_time"):
+            sections.append(f"### Processing time:\n{service_name} takes {guide['total_time']}.")
+
+        if not sections:
+            return None
+
+        if guide.get("offices"):
+            sections.append(f"**Available at:** {', '.join(guide['offices'])}")
+
+        offices = self._service_offices(services[0], guide)
+        return RoutedAnswer(
+            route="service_details",
+            response="\n\n".join(sections),
+            query_type="service_guide",
+            suggested_actions=[f"Show the step-by-step guide for {service_name}"],
+            office_locations=[_office_location(office) for office in offices]
+        )
+
+def _office_location(office: Dict) -> Dict:
+    """Office record in the ChatResponse.office_locations shape"""
+    return {
+        "name": office.get("name"),
+        "address": office.get("address"),
+        "contact": office.get("contact"),
+        "hours": office.get("hours")
+    }
+
+def _format_fees(service_name: str, fees: Dict) -> str:
+    """Render a fees dict such as {"regular": 1000, "currency": "Nu.", "note": ...}"""
+    currency = fees.get("currency", "Nu.")
+    lines = [f"### {service_name} fees:"]
+    for name, amount in fees.items():
+        if name in ("currency", "note"):
+            continue
+        label = name.replace("_", " ").capitalize()
+        lines.append(f"• {label}: {currency} {amount:,}" if isinstance(amount, (int, float))
+                     else f"• {label}: {amount}")
+    if fees.get("note"):
+        lines.append(f"\n{fees['note']}")
+    return "\n".join(lines)
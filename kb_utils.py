@@ -0,0 +1,104 @@
+"""
+Knowledge Base Utilities for Ask Druk
+Shared helpers for the in-memory structured lookups built from knowledge_base/
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+KNOWLEDGE_BASE_DIR = "knowledge_base"
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+def normalize_text(text: str) -> str:
+    """Lowercase and collapse punctuation/whitespace to single spaces"""
+    return _NON_ALNUM.sub(" ", text.lower()).strip()
+
+def normalize_key(text: str) -> str:
+    """Normalize free text to an identifier such as 'driving_license'"""
+    return normalize_text(text).replace(" ", "_")
+
+def iter_knowledge_files(directory: str, pattern: str = "*.json") -> List[Path]:
+    """
+    List knowledge base files, skipping superseded '*_old' copies
+
+    Args:
+        directory: Directory to search recursively
+        pattern: Glob pattern for files
+
+    Returns:
+        Sorted list of file paths
+    """
+    return [
+        path for path in sorted(Path(directory).rglob(pattern))
+        if not path.stem.endswith("_old")
+    ]
+
+def load_json_file(path: Path) -> Optional[Any]:
+    """Load a JSON file, logging and returning None on failure"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"Error loading knowledge file {path}: {str(e)}")
+        return None
+
+class FileChangeWatcher:
+    """
+    Detects changes to a set of files by modification time and size
+
+    Checks are throttled to one stat pass per check_interval seconds so it is
+    cheap enough to call on every request.
+    """
+
+    def __init__(self, paths_fn, check_interval: float = 5.0):
+        """
+        Args:
+            paths_fn: Callable returning the current list of watched paths
+            check_interval: Minimum seconds between filesystem checks
+        """
+        self._paths_fn = paths_fn
+        self.check_interval = check_interval
+        self._signature = self._compute_signature()
+        self._last_check = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _compute_signature(self) -> Tuple:
+        """Snapshot of (path, mtime, size) for all watched files"""
+        signature = []
+        for path in self._paths_fn():
+            try:
+                stat = os.stat(path)
+                signature.append((str(path), stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                continue
+        return tuple(signature)
+
+    def changed(self) -> bool:
+        """Return True once for every detected change since the last call"""
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return False
+
+        # Only one thread performs the stat pass
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._last_check = now
+            signature = self._compute_signature()
+            if signature != self._signature:
+                self._signature = signature
+                return True
+            return False
+        finally:
+            self._lock.release()
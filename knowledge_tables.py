@@ -0,0 +1,318 @@
+"""
+Knowledge Tables Module for Ask Druk
+Precompiled lookup tables for service guides and rights information
+
+Service and rights JSON files are compiled once at load time into keyed
+tables whose responses are already serialized, so /quick-guide and
+/rights-check never re-read files or touch the LLM.
+"""
+
+import json
+import zlib
+import hashlib
+import logging
+import difflib
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from context_packer import query_terms
+from kb_utils import (
+    FileChangeWatcher,
+    KNOWLEDGE_BASE_DIR,
+    iter_knowledge_files,
+    load_json_file,
+    normalize_key,
+    normalize_text,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Everyday words citizens use for each rights scenario
+SCENARIO_KEYWORDS = {
+    "unfair_dismissal": ["fired", "dismissed", "terminated", "sacked", "termination", "laid off"],
+    "salary_disputes": ["salary", "wages", "unpaid", "pay", "overtime"],
+    "workplace_safety": ["unsafe", "safety", "injury", "dangerous", "accident"],
+    "defective_products": ["defective", "faulty", "broken", "damaged", "refund"],
+    "overcharging": ["overcharged", "overcharge", "price", "expensive", "extra charge"],
+    "poor_service": ["service", "bad service", "quality"],
+}
+
+# Share of a free-text scenario's content words a rights scenario must match
+MIN_SCENARIO_OVERLAP = 1 / 3
+
+GUIDE_NOT_FOUND = {"error": "Guide not found"}
+RIGHTS_NOT_FOUND = {"error": "Rights information not found"}
+
+class CompiledEntry:
+    """A lookup result with its JSON serialization and ETag precomputed"""
+
+    __slots__ = ("data", "body", "etag", "_variants")
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+        self.body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.etag = hashlib.sha1(self.body).hexdigest()[:16]
+        self._variants: Dict[str, "CompiledEntry"] = {}
+
+    def variant(self, name: str, transform: Callable[[Dict], Dict]) -> "CompiledEntry":
+        """Memoized transformed copy of this entry (e.g. a Dzongkha rendering)"""
+        entry = self._variants.get(name)
+        if entry is None:
+            entry = CompiledEntry(transform(self.data))
+            self._variants[name] = entry
+        return entry
+
+def compile_service_guide(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a knowledge base service file into the /quick-guide shape"""
+    guide = {
+        "title": f"{data.get('service_name', 'Service')} Guide",
+        "category": data.get("category"),
+        "steps": [
+            {
+                "step": step.get("step_number", i),
+                "title": step.get("title", ""),
+                "description": step.get("description", ""),
+                "documents": step.get("documents_required", []),
+                "time_estimate": step.get("time_estimate", "")
+            }
+            for i, step in enumerate(data.get("steps", []), 1)
+        ],
+        "total_time": data.get("total_time"),
+        "fees": data.get("fees", {}),
+        "offices": data.get("offices", []),
+        "tips": data.get("tips", [])
+    }
+
+    for optional_field in ("online_available", "online_portal", "contact_info"):
+        if optional_field in data:
+            guide[optional_field] = data[optional_field]
+
+    return guide
+
+def service_aliases(data: Dict[str, Any]) -> List[str]:
+    """Keys a service guide can be requested by ("passport", "passport_application", ...)"""
+    aliases = [normalize_key(data.get("id", "")), normalize_key(data.get("service_name", ""))]
+    for suffix in ("_application", "_registration"):
+        for alias in list(aliases):
+            if alias.endswith(suffix):
+                aliases.append(alias[:-len(suffix)])
+    return [alias for alias in dict.fromkeys(aliases) if alias]
+
+def rights_category_aliases(data: Dict[str, Any]) -> List[str]:
+    """Keys a rights category can be requested by ("employment", "employment_rights", ...)"""
+    aliases = [normalize_key(data.get("id", "")), normalize_key(data.get("category", ""))]
+    for alias in list(aliases):
+        if alias.endswith("_rights"):
+            aliases.append(alias[:-len("_rights")])
+    return [alias for alias in dict.fromkeys(aliases) if alias]
+
+class _TablesSnapshot:
+    """Immutable compiled tables for one version of the knowledge base"""
+
+    def __init__(self, knowledge_base_dir: str):
+        self.guides: Dict[str, CompiledEntry] = {}
+        self.service_alias: Dict[str, str] = {}
+        self.rights: Dict[Tuple[str, str], CompiledEntry] = {}
+        self.category_alias: Dict[str, str] = {}
+        self.scenario_alias: Dict[Tuple[str, str], str] = {}
+        self.scenario_terms: Dict[str, Dict[str, set]] = {}
+
+        for path in iter_knowledge_files(f"{knowledge_base_dir}/services"):
+            data = load_json_file(path)
+            if not isinstance(data, dict) or "service_name" not in data:
+                continue
+            service_id = normalize_key(data.get("id") or path.stem)
+            self.guides[service_id] = CompiledEntry(compile_service_guide(data))
+            for alias in service_aliases(data):
+                self.service_alias.setdefault(alias, service_id)
+
+        for path in iter_knowledge_files(f"{knowledge_base_dir}/rights"):
+            data = load_json_file(path)
+            if not isinstance(data, dict) or "scenarios" not in data:
+                continue
+            category_id = normalize_key(data.get("id") or path.stem)
+            for alias in rights_category_aliases(data):
+                self.category_alias.setdefault(alias, category_id)
+
+            terms = self.scenario_terms.setdefault(category_id, {})
+            for scenario_id, scenario in data["scenarios"].items():
+                self.rights[(category_id, scenario_id)] = CompiledEntry(scenario)
+                scenario_text = scenario.get("scenario", "")
+                for alias in (scenario_id, normalize_key(scenario_text)):
+                    self.scenario_alias.setdefault((category_id, alias), scenario_id)
+
+                # Vocabulary used for token-overlap matching of free-text scenarios
+                words = set(normalize_text(scenario_id.replace("_", " ")).split())
+                words.update(normalize_text(scenario_text).split())
+                for keyword in SCENARIO_KEYWORDS.get(scenario_id, []):
+                    words.update(normalize_text(keyword).split())
+                terms[scenario_id] = words
+
+        self.service_keys = list(self.service_alias)
+        self.category_keys = list(self.category_alias)
+
+class KnowledgeTables:
+    """Keyed lookup of service guides and rights scenarios"""
+
+    def __init__(self, knowledge_base_dir: str = KNOWLEDGE_BASE_DIR, check_interval: float = 5.0):
+        """Initialize and compile the tables from the knowledge base"""
+        self.knowledge_base_dir = knowledge_base_dir
+        self._snapshot = _TablesSnapshot(knowledge_base_dir)
+        self._resolved: Dict[tuple, Any] = {}
+        self._lock = threading.Lock()
+        self._watcher = FileChangeWatcher(self._watched_files, check_interval)
+        logging.info(self._describe())
+
+    def _watched_files(self) -> list:
+        """Service and rights files the tables are compiled from"""
+        return (iter_knowledge_files(f"{self.knowledge_base_dir}/services") +
+                iter_knowledge_files(f"{self.knowledge_base_dir}/rights"))
+
+    def _describe(self) -> str:
+        snapshot = self._snapshot
+        return f"Knowledge tables compiled: {len(snapshot.guides)} service guides, {len(snapshot.rights)} rights scenarios"
+
+    def load(self):
+        """Recompile the tables from the knowledge base"""
+        snapshot = _TablesSnapshot(self.knowledge_base_dir)
+        with self._lock:
+            self._snapshot = snapshot
+            self._resolved = {}
+        logging.info(self._describe())
+
+    def _current(self) -> _TablesSnapshot:
+        """Return the current snapshot, recompiling first if files changed"""
+        if self._watcher.changed():
+            logging.info("Knowledge base service/rights files changed, recompiling tables")
+            self.load()
+        return self._snapshot
+
+    def _memoize(self, key: tuple, value: Any) -> Any:
+        # Bounded so arbitrary user input can't grow memory without limit
+        if len(self._resolved) >= 2048:
+            self._resolved.clear()
+        self._resolved[key] = value
+        return value
+
+    def resolve_service(self, service_type: str) -> Optional[str]:
+        """Map a requested service type to a service id"""
+        snapshot = self._current()
+        key = normalize_key(service_type)
+        service_id = snapshot.service_alias.get(key)
+        if service_id is not None:
+            return service_id
+
+        cache_key = ("service", key)
+        if cache_key in self._resolved:
+            return self._resolved[cache_key]
+
+        matches = difflib.get_close_matches(key, snapshot.service_keys, n=1, cutoff=0.75)
+        return self._memoize(cache_key, snapshot.service_alias[matches[0]] if matches else None)
+
+    def resolve_rights(self, category: str, scenario: str) -> Optional[Tuple[str, str]]:
+        """Map a requested (category, scenario) pair to table keys"""
+        snapshot = self._current()
+        category_key = normalize_key(category)
+        scenario_key = normalize_key(scenario)
+
+        category_id = snapshot.category_alias.get(category_key)
+        if category_id is not None:
+            scenario_id = snapshot.scenario_alias.get((category_id, scenario_key))
+            if scenario_id is not None:
+                return category_id, scenario_id
+
+        cache_key = ("rights", category_key, scenario_key)
+        if cache_key in self._resolved:
+            return self._resolved[cache_key]
+
+        if category_id is None:
+            matches = difflib.get_close_matches(category_key, snapshot.category_keys, n=1, cutoff=0.75)
+            if not matches:
+                # An unknown category (e.g. "tenant") has no scenarios; never answer from another one
+                return self._memoize(cache_key, None)
+            category_id = snapshot.category_alias[matches[0]]
+
+        # Score the category's scenarios by the share of the request's content
+        # words they contain; a weak match is not an answer
+        query_words = query_terms(normalize_text(scenario))
+        best, best_score = None, 0.0
+        for scenario_id, words in snapshot.scenario_terms.get(category_id, {}).items():
+            overlap = len(query_words & words)
+            if not overlap:
+                continue
+            score = overlap / len(query_words)
+            if score >= MIN_SCENARIO_OVERLAP and score > best_score:
+                best, best_score = (category_id, scenario_id), score
+
+        return self._memoize(cache_key, best)
+
+    def get_service_guide(self, service_type: str) -> CompiledEntry:
+        """Compiled guide for a service, or a compiled not-found entry"""
+        service_id = self.resolve_service(service_type)
+        if service_id is None:
+            return _GUIDE_NOT_FOUND
+        return self._snapshot.guides.get(service_id, _GUIDE_NOT_FOUND)
+
+    def get_rights(self, category: str, scenario: str) -> CompiledEntry:
+        """Compiled rights information for a scenario, or a compiled not-found entry"""
+        keys = self.resolve_rights(category, scenario)
+        if keys is None:
+            return _RIGHTS_NOT_FOUND
+        return self._snapshot.rights.get(keys, _RIGHTS_NOT_FOUND)
+
+    def find_services_in_text(self, text: str) -> List[str]:
+        """Service ids whose name or alias appears in free text, in alias order"""
+        snapshot = self._current()
+        padded = f" {normalize_text(text)} "
+        found = []
+        for alias, service_id in snapshot.service_alias.items():
+            if f" {alias.replace('_', ' ')} " in padded and service_id not in found:
+                found.append(service_id)
+        return found
+
+    def get_service_data(self, service_id: str) -> Optional[Dict[str, Any]]:
+        """Compiled guide data for a resolved service id"""
+        entry = self._current().guides.get(service_id)
+        return entry.data if entry else None
+
+    def list_services(self) -> List[str]:
+        """Ids of all compiled service guides"""
+        return list(self._current().guides)
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get table status for monitoring"""
+        snapshot = self._snapshot
+        return {
+            "service_guides": len(snapshot.guides),
+            "rights_scenarios": len(snapshot.rights),
+            "service_aliases": len(snapshot.service_alias),
+            "category_aliases": len(snapshot.category_alias)
+        }
+
+_GUIDE_NOT_FOUND = CompiledEntry(GUIDE_NOT_FOUND)
+_RIGHTS_NOT_FOUND = CompiledEntry(RIGHTS_NOT_FOUND)
+
+def render_json_envelope(fields: List[Tuple[str, Any]], entry_field: str, entry: CompiledEntry) -> Tuple[bytes, str]:
+    """
+    Build a JSON response body around a precompiled entry without re-serializing it
+
+    Args:
+        fields: Leading (name, value) pairs echoed from the request
+        entry_field: Name of the field holding the compiled entry
+        entry: The precompiled entry
+
+    Returns:
+        Response body and its ETag
+    """
+    parts = [b"{"]
+    for name, value in fields:
+        parts.append(json.dumps(name).encode("utf-8") + b":" +
+                     json.dumps(value, ensure_ascii=False).encode("utf-8") + b",")
+    parts.append(json.dumps(entry_field).encode("utf-8") + b":" + entry.body + b',"status":"success"}')
+    body = b"".join(parts)
+
+    # The echoed request fields are part of the representation
+    echo_crc = zlib.crc32(b"".join(parts[1:-1])) & 0xffffffff
+    return body, f'"{entry.etag}-{echo_crc:08x}"'
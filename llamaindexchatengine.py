@@ -1,5 +1,9 @@
 import logging
-from typing import Any, List, Optional, Tuple, Union
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 from llama_index.core.base.llms.types import (
     ChatMessage,
@@ -25,18 +29,21 @@ from llama_index.core.base.llms.generic_utils import messages_to_history_str
 from llama_index.core.llms.llm import LLM
 from llama_index.core.memory import BaseMemory, ChatMemoryBuffer
 from llama_index.core.postprocessor.types import BaseNodePostprocessor
-from llama_index.core.prompts import PromptTemplate
+from llama_index.core.prompts import ChatPromptTemplate, PromptTemplate
 from llama_index.core.response_synthesizers import CompactAndRefine
 from llama_index.core.schema import NodeWithScore
 from llama_index.core.settings import Settings
 from llama_index.core.utilities.token_counting import TokenCounter
-from llama_index.core.chat_engine.utils import (
-    get_prefix_messages_with_context,
-    get_response_synthesizer,
-)
+from llama_index.core.chat_engine.utils import get_prefix_messages_with_context
+from circuit_breaker import embedding_breaker, llm_breaker
+from context_packer import ContextPacker
+from embedding_cache import QueryEmbeddingCache
+from metrics import record_tokens, stage_seconds
+from tracing import tracer
 
 logger = logging.getLogger(__name__)
 CONTEXT_WINDOW= 20000
+HISTORY_TOKEN_CACHE_SIZE = 4096
 DEFAULT_CONTEXT_PROMPT_TEMPLATE = """
   The following is a friendly conversation between a user and an AI assistant.
   The assistant is talkative and provides lots of specific details from its context.
@@ -78,6 +85,58 @@ DEFAULT_CONDENSE_PROMPT_TEMPLATE = """
   Standalone question:"""
 
 
+QUERY_MESSAGE = ChatMessage(content="{query_str}", role=MessageRole.USER)
+
+
+class SynthesisPrefix:
+    """System messages shared by every turn with the same system prompt, with token counts."""
+
+    def __init__(
+        self,
+        context_template: str,
+        refine_template: str,
+        system_prompt: str,
+        system_role: MessageRole,
+    ):
+        self.qa_system = get_prefix_messages_with_context(
+            PromptTemplate(context_template), system_prompt, [], [], system_role
+        )[0]
+        self.refine_system = get_prefix_messages_with_context(
+            PromptTemplate(refine_template), system_prompt, [], [], system_role
+        )[0]
+
+        token_counter = TokenCounter()
+        self.qa_system_tokens = token_counter.estimate_tokens_in_messages([self.qa_system])
+        self.refine_system_tokens = token_counter.estimate_tokens_in_messages(
+            [self.refine_system]
+        )
+
+
+@lru_cache(maxsize=128)
+def get_synthesis_prefix(
+    context_template: str,
+    refine_template: str,
+    system_prompt: str,
+    system_role: MessageRole,
+) -> SynthesisPrefix:
+    """Get the cached synthesis prefix for a system prompt."""
+    return SynthesisPrefix(context_template, refine_template, system_prompt, system_role)
+
+
+class PackedCompactAndRefine(CompactAndRefine):
+    """CompactAndRefine for context already packed to fit the biggest prompt.
+
+    The packer sized the chunks against the same budget, so the first repack
+    (a full re-tokenization of prompt and context) is skipped. The QA step
+    still repacks its single chunk as a guard.
+    """
+
+    def _make_compact_text_chunks(
+        self, query_str: str, text_chunks: Sequence[str]
+    ) -> List[str]:
+        return ["\n\n".join(text_chunks)] if text_chunks else []
+
+
 class CondensePlusContextChatEngine(BaseChatEngine):
     """
     Condensed Conversation & Context Chat Engine.
@@ -85,6 +144,10 @@ class CondensePlusContextChatEngine(BaseChatEngine):
     First condense a conversation and latest user message to a standalone question
     Then build a context for the standalone question from a retriever,
     Then pass the context along with prompt and user message to LLM to generate a response.
+
+    One engine can serve many sessions: pass each session's memory and system
+    prompt to chat/achat/stream_chat/astream_chat. The engine's own memory and
+    system prompt are used when they are omitted.
     """
 
     def __init__(
@@ -100,6 +163,7 @@ class CondensePlusContextChatEngine(BaseChatEngine):
         node_postprocessors: Optional[List[BaseNodePostprocessor]] = None,
         callback_manager: Optional[CallbackManager] = None,
         verbose: bool = False,
+        query_embedding_cache: Optional[QueryEmbeddingCache] = None,
     ):
         self._retriever = retriever
         self._llm = llm
@@ -131,6 +195,12 @@ class CondensePlusContextChatEngine(BaseChatEngine):
 
         self._token_counter = TokenCounter()
         self._verbose = verbose
+        self._query_embedding_cache = query_embedding_cache
+        self._context_packer = ContextPacker(llm)
+        self._system_role = llm.metadata.system_role
+        self._model_name = llm.metadata.model_name
+        self._history_tokens: "OrderedDict[int, Tuple[ChatMessage, int]]" = OrderedDict()
+        self._history_lock = threading.Lock()
 
     @classmethod
     def from_defaults(
@@ -146,6 +216,7 @@ class CondensePlusContextChatEngine(BaseChatEngine):
         skip_condense: bool = False,
         node_postprocessors: Optional[List[BaseNodePostprocessor]] = None,
         verbose: bool = False,
+        query_embedding_cache: Optional[QueryEmbeddingCache] = None,
         **kwargs: Any,
     ) -> "CondensePlusContextChatEngine":
         """Initialize a CondensePlusContextChatEngine from default parameters."""
@@ -168,6 +239,7 @@ class CondensePlusContextChatEngine(BaseChatEngine):
             node_postprocessors=node_postprocessors,
             system_prompt=system_prompt,
             verbose=verbose,
+            query_embedding_cache=query_embedding_cache,
         )
 
     def _condense_question(
@@ -184,7 +256,10 @@ class CondensePlusContextChatEngine(BaseChatEngine):
             chat_history=chat_history_str, question=latest_message
         )
 
-        return str(self._llm.complete(llm_input))
+        with llm_breaker.guard(), tracer.stage("condense"):
+            response = self._llm.complete(llm_input)
+        self._record_completion_tokens("condense", llm_input, response)
+        return str(response)
 
     async def _acondense_question(
         self, chat_history: List[ChatMessage], latest_message: str
@@ -200,67 +275,207 @@ class CondensePlusContextChatEngine(BaseChatEngine):
             chat_history=chat_history_str, question=latest_message
         )
 
-        return str(await self._llm.acomplete(llm_input))
+        with llm_breaker.guard(), tracer.stage("condense"):
+            response = await self._llm.acomplete(llm_input)
+        self._record_completion_tokens("condense", llm_input, response)
+        return str(response)
+
+    def _record_completion_tokens(self, stage: str, prompt: str, response: Any) -> None:
+        """Count tokens of an LLM call, preferring the usage reported by the API."""
+        usage = getattr(response, "additional_kwargs", None) or {}
+        record_tokens(
+            stage,
+            self._model_name,
+            prompt_tokens=usage.get("prompt_tokens") or self._context_packer.count(prompt),
+            completion_tokens=usage.get("completion_tokens")
+            or self._context_packer.count(str(response)),
+        )
+
+    def _get_query_bundle(self, message: str) -> QueryBundle:
+        """Build the retrieval query, reusing an already computed embedding if cached."""
+        embedding = None
+        if self._query_embedding_cache is not None:
+            embedding = self._query_embedding_cache.get(message)
+        query_bundle = QueryBundle(query_str=message, embedding=embedding)
+
+        # Embed here rather than inside the retriever so it is timed on its own
+        embed_model = getattr(self._retriever, "_embed_model", None)
+        if query_bundle.embedding is None and embed_model is not None:
+            with embedding_breaker.guard(), tracer.stage("query_embedding"):
+                query_bundle.embedding = embed_model.get_agg_embedding_from_queries(
+                    query_bundle.embedding_strs
+                )
+            self._record_embedding_tokens(embed_model, message)
+            if self._query_embedding_cache is not None:
+                self._query_embedding_cache.put(message, query_bundle.embedding)
+        return query_bundle
+
+    async def _aget_query_bundle(self, message: str) -> QueryBundle:
+        """Async version of _get_query_bundle."""
+        embedding = None
+        if self._query_embedding_cache is not None:
+            embedding = self._query_embedding_cache.get(message)
+        query_bundle = QueryBundle(query_str=message, embedding=embedding)
+
+        embed_model = getattr(self._retriever, "_embed_model", None)
+        if query_bundle.embedding is None and embed_model is not None:
+            with embedding_breaker.guard(), tracer.stage("query_embedding"):
+                query_bundle.embedding = await embed_model.aget_agg_embedding_from_queries(
+                    query_bundle.embedding_strs
+                )
+            self._record_embedding_tokens(embed_model, message)
+            if self._query_embedding_cache is not None:
+                self._query_embedding_cache.put(message, query_bundle.embedding)
+        return query_bundle
+
+    def _record_embedding_tokens(self, embed_model: Any, message: str) -> None:
+        record_tokens(
+            "query_embedding",
+            getattr(embed_model, "model_name", None),
+            prompt_tokens=self._context_packer.count(message),
+        )
 
     def _get_nodes(self, message: str) -> List[NodeWithScore]:
         """Generate context information from a message."""
-        nodes = self._retriever.retrieve(message)
-        for postprocessor in self._node_postprocessors:
-            nodes = postprocessor.postprocess_nodes(
-                nodes, query_bundle=QueryBundle(message)
-            )
+        query_bundle = self._get_query_bundle(message)
+        with tracer.stage("retrieval") as span:
+            nodes = self._retriever.retrieve(query_bundle)
+            for postprocessor in self._node_postprocessors:
+                nodes = postprocessor.postprocess_nodes(
+                    nodes, query_bundle=QueryBundle(message)
+                )
+            span.set_attribute("nodes", len(nodes))
 
         return nodes
 
     async def _aget_nodes(self, message: str) -> List[NodeWithScore]:
         """Generate context information from a message."""
-        nodes = await self._retriever.aretrieve(message)
-        for postprocessor in self._node_postprocessors:
-            nodes = postprocessor.postprocess_nodes(
-                nodes, query_bundle=QueryBundle(message)
-            )
+        query_bundle = await self._aget_query_bundle(message)
+        with tracer.stage("retrieval") as span:
+            nodes = await self._retriever.aretrieve(query_bundle)
+            for postprocessor in self._node_postprocessors:
+                nodes = postprocessor.postprocess_nodes(
+                    nodes, query_bundle=QueryBundle(message)
+                )
+            span.set_attribute("nodes", len(nodes))
 
         return nodes
 
+    def _get_synthesis_templates(
+        self, chat_history: List[ChatMessage], system_prompt: Optional[str] = None
+    ) -> Tuple[ChatPromptTemplate, ChatPromptTemplate]:
+        """Build the QA and refine chat templates for the current history.
+
+        The system messages are cached per system prompt; only the history
+        tail is assembled per turn.
+        """
+        prefix = self._get_synthesis_prefix(system_prompt)
+        qa_template = ChatPromptTemplate(
+            message_templates=[prefix.qa_system, *chat_history, QUERY_MESSAGE],
+            function_mappings=self._context_prompt_template.function_mappings,
+        )
+        refine_template = ChatPromptTemplate(
+            message_templates=[prefix.refine_system, *chat_history, QUERY_MESSAGE],
+            function_mappings=self._context_refine_prompt_template.function_mappings,
+        )
+        return qa_template, refine_template
+
+    def _get_synthesis_prefix(self, system_prompt: Optional[str] = None) -> SynthesisPrefix:
+        if system_prompt is None:
+            system_prompt = self._system_prompt
+        return get_synthesis_prefix(
+            self._context_prompt_template.template,
+            self._context_refine_prompt_template.template,
+            system_prompt or "",
+            self._system_role,
+        )
+
+    def _count_history_tokens(self, chat_history: List[ChatMessage]) -> int:
+        """Prompt tokens of the history, counting each message object once."""
+        total = 0
+        for message in chat_history:
+            with self._history_lock:
+                cached = self._history_tokens.get(id(message))
+            if cached is not None and cached[0] is message:
+                total += cached[1]
+                continue
+            tokens = self._context_packer.count_messages([message])
+            with self._history_lock:
+                # Keep a reference so the id is not reused while cached
+                self._history_tokens[id(message)] = (message, tokens)
+                while len(self._history_tokens) > HISTORY_TOKEN_CACHE_SIZE:
+                    self._history_tokens.popitem(last=False)
+            total += tokens
+        return total
+
     def _get_response_synthesizer(
-        self, chat_history: List[ChatMessage], streaming: bool = False
+        self,
+        templates: Tuple[ChatPromptTemplate, ChatPromptTemplate],
+        streaming: bool = False,
     ) -> CompactAndRefine:
-        system_prompt = self._system_prompt or ""
-        qa_messages = get_prefix_messages_with_context(
-            self._context_prompt_template,
-            system_prompt,
-            [],
-            chat_history,
-            self._llm.metadata.system_role,
-        )
-        refine_messages = get_prefix_messages_with_context(
-            self._context_refine_prompt_template,
-            system_prompt,
-            [],
-            chat_history,
-            self._llm.metadata.system_role,
-        )
-
-        return get_response_synthesizer(
-            self._llm,
-            self.callback_manager,
-            qa_messages,
-            refine_messages,
-            streaming,
-            qa_function_mappings=self._context_prompt_template.function_mappings,
-            refine_function_mappings=self._context_refine_prompt_template.function_mappings,
+        # Share the packer's prompt helper so repacking uses the same budget
+        qa_template, refine_template = templates
+        return PackedCompactAndRefine(
+            llm=self._llm,
+            callback_manager=self.callback_manager,
+            prompt_helper=self._context_packer.prompt_helper,
+            text_qa_template=qa_template,
+            refine_template=refine_template,
+            streaming=streaming,
+        )
+
+    def _pack_context(
+        self,
+        message: str,
+        condensed_question: str,
+        chat_history: List[ChatMessage],
+        context_nodes: List[NodeWithScore],
+        system_prompt: Optional[str] = None,
+    ) -> List[NodeWithScore]:
+        """Fit the context nodes into one synthesis prompt and log its token sections."""
+        prefix = self._get_synthesis_prefix(system_prompt)
+        section_tokens: Dict[str, int] = {
+            "system": max(prefix.qa_system_tokens, prefix.refine_system_tokens),
+            "history": self._count_history_tokens(chat_history),
+            "query": self._context_packer.count_messages(
+                [ChatMessage(content=message, role=MessageRole.USER)]
+            ),
+        }
+        with tracer.span("pack_context") as span:
+            packed = self._context_packer.pack(
+                context_nodes,
+                self._context_packer.available_tokens(sum(section_tokens.values())),
+                query_str=message,
+                retrieval_query=condensed_question,
+                section_tokens=section_tokens,
+            )
+            span.set_attributes({
+                "budget": packed.budget,
+                "prompt_tokens": packed.section_tokens,
+                "kept": packed.kept,
+                "trimmed": packed.trimmed,
+                "dropped": packed.dropped,
+            })
+        record_tokens(
+            "synthesis",
+            self._model_name,
+            prompt_tokens=sum(section_tokens.values()) + packed.context_tokens,
         )
+        return packed.nodes
 
     def _run_c3(
         self,
         message: str,
         chat_history: Optional[List[ChatMessage]] = None,
         streaming: bool = False,
+        memory: Optional[BaseMemory] = None,
+        system_prompt: Optional[str] = None,
     ) -> Tuple[CompactAndRefine, ToolOutput, List[NodeWithScore]]:
+        memory = memory or self._memory
         if chat_history is not None:
-            self._memory.set(chat_history)
+            memory.set(chat_history)
 
-        chat_history = self._memory.get(input=message)
+        chat_history = memory.get(input=message)
 
         # Condense conversation history and latest message to a standalone question
         condensed_question = self._condense_question(chat_history, message)  # type: ignore
@@ -277,9 +492,13 @@ class CondensePlusContextChatEngine(BaseChatEngine):
             raw_output=context_nodes,
         )
 
-        # build the response synthesizer
+        # build the response synthesizer and pack the context into its budget
+        templates = self._get_synthesis_templates(chat_history, system_prompt)
         response_synthesizer = self._get_response_synthesizer(
-            chat_history, streaming=streaming
+            templates, streaming=streaming
+        )
+        context_nodes = self._pack_context(
+            message, condensed_question, chat_history, context_nodes, system_prompt
         )
 
         return response_synthesizer, context_source, context_nodes
@@ -289,11 +508,14 @@ class CondensePlusContextChatEngine(BaseChatEngine):
         message: str,
         chat_history: Optional[List[ChatMessage]] = None,
         streaming: bool = False,
+        memory: Optional[BaseMemory] = None,
+        system_prompt: Optional[str] = None,
     ) -> Tuple[CompactAndRefine, ToolOutput, List[NodeWithScore]]:
+        memory = memory or self._memory
         if chat_history is not None:
-            self._memory.set(chat_history)
+            memory.set(chat_history)
 
-        chat_history = self._memory.get(input=message)
+        chat_history = memory.get(input=message)
 
         # Condense conversation history and latest message to a standalone question
         condensed_question = await self._acondense_question(chat_history, message)  # type: ignore
@@ -310,27 +532,70 @@ class CondensePlusContextChatEngine(BaseChatEngine):
             raw_output=context_nodes,
         )
 
-        # build the response synthesizer
+        # build the response synthesizer and pack the context into its budget
+        templates = self._get_synthesis_templates(chat_history, system_prompt)
         response_synthesizer = self._get_response_synthesizer(
-            chat_history, streaming=streaming
+            templates, streaming=streaming
+        )
+        context_nodes = self._pack_context(
+            message, condensed_question, chat_history, context_nodes, system_prompt
         )
 
         return response_synthesizer, context_source, context_nodes
 
+    async def aanswer(
+        self,
+        message: str,
+        context_nodes: List[NodeWithScore],
+        system_prompt: Optional[str] = None,
+    ) -> str:
+        """Answer a standalone question from already retrieved nodes.
+
+        Used for batches of independent questions: there is no memory, no
+        condensing and no retrieval, only context packing and synthesis.
+        """
+        templates = self._get_synthesis_templates([], system_prompt)
+        response_synthesizer = self._get_response_synthesizer(templates)
+        context_nodes = self._pack_context(
+            message, message, [], context_nodes, system_prompt
+        )
+
+        with llm_breaker.guard(), tracer.stage("synthesis"):
+            response = await response_synthesizer.asynthesize(message, context_nodes)
+        record_tokens(
+            "synthesis",
+            self._model_name,
+            completion_tokens=self._context_packer.count(str(response)),
+        )
+        return str(response)
+
     @trace_method("chat")
     def chat(
-        self, message: str, chat_history: Optional[List[ChatMessage]] = None
+        self,
+        message: str,
+        chat_history: Optional[List[ChatMessage]] = None,
+        memory: Optional[BaseMemory] = None,
+        system_prompt: Optional[str] = None,
     ) -> AgentChatResponse:
-        synthesizer, context_source, context_nodes = self._run_c3(message, chat_history)
+        memory = memory or self._memory
+        synthesizer, context_source, context_nodes = self._run_c3(
+            message, chat_history, memory=memory, system_prompt=system_prompt
+        )
 
-        response = synthesizer.synthesize(message, context_nodes)
+        with llm_breaker.guard(), tracer.stage("synthesis"):
+            response = synthesizer.synthesize(message, context_nodes)
+        record_tokens(
+            "synthesis",
+            self._model_name,
+            completion_tokens=self._context_packer.count(str(response)),
+        )
 
         user_message = ChatMessage(content=message, role=MessageRole.USER)
         assistant_message = ChatMessage(
             content=str(response), role=MessageRole.ASSISTANT
         )
-        self._memory.put(user_message)
-        self._memory.put(assistant_message)
+        memory.put(user_message)
+        memory.put(assistant_message)
 
         return AgentChatResponse(
             response=str(response),
@@ -340,13 +605,21 @@ class CondensePlusContextChatEngine(BaseChatEngine):
 
     @trace_method("chat")
     def stream_chat(
-        self, message: str, chat_history: Optional[List[ChatMessage]] = None
+        self,
+        message: str,
+        chat_history: Optional[List[ChatMessage]] = None,
+        memory: Optional[BaseMemory] = None,
+        system_prompt: Optional[str] = None,
     ) -> StreamingAgentChatResponse:
+        memory = memory or self._memory
         synthesizer, context_source, context_nodes = self._run_c3(
-            message, chat_history, streaming=True
+            message, chat_history, streaming=True, memory=memory, system_prompt=system_prompt
         )
 
-        response = synthesizer.synthesize(message, context_nodes)
+        synthesis_started = time.perf_counter()
+        # Only the request is guarded; the breaker cannot see errors mid-stream
+        with llm_breaker.guard():
+            response = synthesizer.synthesize(message, context_nodes)
         assert isinstance(response, StreamingResponse)
 
         def wrapped_gen(response: StreamingResponse) -> ChatResponseGen:
@@ -360,12 +633,19 @@ class CondensePlusContextChatEngine(BaseChatEngine):
                     delta=token,
                 )
 
+            stage_seconds.observe(time.perf_counter() - synthesis_started, "synthesis")
+            record_tokens(
+                "synthesis",
+                self._model_name,
+                completion_tokens=self._context_packer.count(full_response),
+            )
+
             user_message = ChatMessage(content=message, role=MessageRole.USER)
             assistant_message = ChatMessage(
                 content=full_response, role=MessageRole.ASSISTANT
             )
-            self._memory.put(user_message)
-            self._memory.put(assistant_message)
+            memory.put(user_message)
+            memory.put(assistant_message)
 
         return StreamingAgentChatResponse(
             chat_stream=wrapped_gen(response),
@@ -376,20 +656,31 @@ class CondensePlusContextChatEngine(BaseChatEngine):
 
     @trace_method("chat")
     async def achat(
-        self, message: str, chat_history: Optional[List[ChatMessage]] = None
+        self,
+        message: str,
+        chat_history: Optional[List[ChatMessage]] = None,
+        memory: Optional[BaseMemory] = None,
+        system_prompt: Optional[str] = None,
     ) -> AgentChatResponse:
+        memory = memory or self._memory
         synthesizer, context_source, context_nodes = await self._arun_c3(
-            message, chat_history
+            message, chat_history, memory=memory, system_prompt=system_prompt
         )
 
-        response = await synthesizer.asynthesize(message, context_nodes)
+        with llm_breaker.guard(), tracer.stage("synthesis"):
+            response = await synthesizer.asynthesize(message, context_nodes)
+        record_tokens(
+            "synthesis",
+            self._model_name,
+            completion_tokens=self._context_packer.count(str(response)),
+        )
 
         user_message = ChatMessage(content=message, role=MessageRole.USER)
         assistant_message = ChatMessage(
             content=str(response), role=MessageRole.ASSISTANT
         )
-        await self._memory.aput(user_message)
-        await self._memory.aput(assistant_message)
+        await memory.aput(user_message)
+        await memory.aput(assistant_message)
 
         return AgentChatResponse(
             response=str(response),
@@ -399,13 +690,20 @@ class CondensePlusContextChatEngine(BaseChatEngine):
 
     @trace_method("chat")
     async def astream_chat(
-        self, message: str, chat_history: Optional[List[ChatMessage]] = None
+        self,
+        message: str,
+        chat_history: Optional[List[ChatMessage]] = None,
+        memory: Optional[BaseMemory] = None,
+        system_prompt: Optional[str] = None,
     ) -> StreamingAgentChatResponse:
+        memory = memory or self._memory
         synthesizer, context_source, context_nodes = await self._arun_c3(
-            message, chat_history, streaming=True
+            message, chat_history, streaming=True, memory=memory, system_prompt=system_prompt
         )
 
-        response = await synthesizer.asynthesize(message, context_nodes)
+        synthesis_started = time.perf_counter()
+        with llm_breaker.guard():
+            response = await synthesizer.asynthesize(message, context_nodes)
         assert isinstance(response, AsyncStreamingResponse)
 
         async def wrapped_gen(response: AsyncStreamingResponse) -> ChatResponseAsyncGen:
@@ -419,12 +717,19 @@ class CondensePlusContextChatEngine(BaseChatEngine):
                     delta=token,
                 )
 
+            stage_seconds.observe(time.perf_counter() - synthesis_started, "synthesis")
+            record_tokens(
+                "synthesis",
+                self._model_name,
+                completion_tokens=self._context_packer.count(full_response),
+            )
+
             user_message = ChatMessage(content=message, role=MessageRole.USER)
             assistant_message = ChatMessage(
                 content=full_response, role=MessageRole.ASSISTANT
             )
-            await self._memory.aput(user_message)
-            await self._memory.aput(assistant_message)
+            await memory.aput(user_message)
+            await memory.aput(assistant_message)
 
         return StreamingAgentChatResponse(
             achat_stream=wrapped_gen(response),
@@ -440,4 +745,9 @@ class CondensePlusContextChatEngine(BaseChatEngine):
     @property
     def chat_history(self) -> List[ChatMessage]:
         """Get chat history."""
-        return self._memory.get_all()
\ No newline at end of file
+        return self._memory.get_all()
+
+    @property
+    def memory(self) -> BaseMemory:
+        """Get the chat memory."""
+        return self._memory
\ No newline at end of file
@@ -0,0 +1,254 @@
+"""
+Metrics Module for Ask Druk
+Counters and histograms exposed in the Prometheus text format
+
+Every thread writes to its own shard of each metric, so recording a value
+is a dict lookup and a few additions with no lock on the request path.
+Shards are only summed when /metrics is scraped.
+"""
+
+import time
+import bisect
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# LLM round-trips take seconds, lookups take microseconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _ShardedMetric:
+    """Base for metrics whose values live in per-thread shards"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[Dict[Tuple, object]] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> Dict[Tuple, object]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshot(self) -> List[List[Tuple[Tuple, object]]]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        # Copying a dict's items is atomic under the GIL
+        return [list(shard.items()) for shard in shards]
+
+    def render(self) -> Iterable[str]:
+        raise NotImplementedError
+
+class Counter(_ShardedMetric):
+    """Monotonically increasing value per label set"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, *labelvalues: str):
+        """Add amount for the given label values (in labelnames order)"""
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def values(self) -> Dict[Tuple, float]:
+        """Totals per label set, summed over shards"""
+        totals: Dict[Tuple, float] = {}
+        for items in self._snapshot():
+            for labels, value in items:
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> Iterable[str]:
+        for labels, value in sorted(self.values().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+class _Timer:
+    """Context manager observing the elapsed time into a histogram"""
+
+    __slots__ = ("_histogram", "_labelvalues", "_started")
+
+    def __init__(self, histogram: "Histogram", labelvalues: Tuple):
+        self._histogram = histogram
+        self._labelvalues = labelvalues
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._histogram.observe(time.perf_counter() - self._started, *self._labelvalues)
+        return False
+
+class Histogram(_ShardedMetric):
+    """Distribution of observed values in fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labelvalues: str):
+        """Record one value for the given label values"""
+        shard = self._shard()
+        entry = shard.get(labelvalues)
+        if entry is None:
+            # Per-bucket counts, then sum and count
+            entry = shard[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def time(self, *labelvalues: str) -> _Timer:
+        """Time a block: `with histogram.time("retrieval"): ...`"""
+        return _Timer(self, labelvalues)
+
+    def values(self) -> Dict[Tuple, list]:
+        """Merged per-bucket counts, sum and count per label set"""
+        merged: Dict[Tuple, list] = {}
+        for items in self._snapshot():
+            for labels, entry in items:
+                target = merged.get(labels)
+                if target is None:
+                    merged[labels] = list(entry)
+                else:
+                    for i, value in enumerate(entry):
+                        target[i] += value
+        return merged
+
+    def render(self) -> Iterable[str]:
+        for labels, entry in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), entry):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"' if bound != float("inf") else 'le="+Inf"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(entry[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {entry[-1]}"
+
+class CallbackMetric:
+    """Gauge or counter whose values are read from the application at scrape time"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[Tuple, float]], kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+        self._callback = callback
+
+    def render(self) -> Iterable[str]:
+        try:
+            values = self._callback()
+        except Exception as e:
+            logging.warning(f"Metric {self.name} unavailable: {str(e)}")
+            return
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+class MetricsRegistry:
+    """Collection of metrics rendered together on /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_register(self, name: str, factory: Callable[[], object]):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Get or create a counter"""
+        return self._get_or_register(name, lambda: Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Get or create a histogram"""
+        return self._get_or_register(name, lambda: Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[Tuple, float]], kind: str = "gauge") -> CallbackMetric:
+        """
+        Register a metric computed at scrape time (kind is "gauge" or "counter")
+
+        Registering the same name again replaces the callback, so re-importing
+        the application module does not fail.
+        """
+        metric = CallbackMetric(name, documentation, labelnames, callback, kind)
+        with self._lock:
+            self._metrics[name] = metric
+        return metric
+
+    def unregister(self, name: str):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# Process-wide registry and the instruments shared by all modules
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    "druk_stage_duration_seconds",
+    "Time spent in each request stage",
+    ["stage"]
+)
+
+tokens_total = registry.counter(
+    "druk_tokens_total",
+    "Tokens sent to (prompt) and received from (completion) models per stage",
+    ["stage", "model", "direction"]
+)
+
+route_seconds = registry.histogram(
+    "druk_chat_route_duration_seconds",
+    "End-to-end /chat handling time by route (deterministic handler or llm)",
+    ["route"]
+)
+
+def record_tokens(stage: str, model: Optional[str], prompt_tokens: int = 0, completion_tokens: int = 0):
+    """Count prompt and completion tokens of one model call"""
+    model = model or "unknown"
+    if prompt_tokens:
+        tokens_total.inc(prompt_tokens, stage, model, "prompt")
+    if completion_tokens:
+        tokens_total.inc(completion_tokens, stage, model, "completion")
@@ -0,0 +1,184 @@
+"""
+Model Provider Module for Ask Druk
+Selects the LLM, embedding model and translator from configuration
+
+MODEL_PROVIDER=azure (default) uses the Azure OpenAI deployments; the
+deployment names can be overridden with AZURE_CHAT_DEPLOYMENT,
+AZURE_EMBEDDING_DEPLOYMENT and AZURE_TRANSLATION_DEPLOYMENT.
+MODEL_PROVIDER=offline uses the deterministic local models from
+offline_models, so the whole stack starts and answers with no network.
+"""
+
+import os
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.llms.llm import LLM
+
+from azure_helpers import translate_to_dzongkha, TRANSLATION_MODEL
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+DEFAULT_CHAT_DEPLOYMENT = "gpt-4"
+DEFAULT_EMBEDDING_DEPLOYMENT = "text-embedding-3-large"
+EMBEDDING_API_VERSION = "2023-05-15"
+
+# Fail a stalled Azure call well before gunicorn/nginx give up on the request
+DEFAULT_TIMEOUT_SECONDS = 30.0
+DEFAULT_MAX_RETRIES = 1
+
+class ModelProvider(ABC):
+    """Creates the models used by the index, chat engine and /translate"""
+
+    name = "base"
+
+    @abstractmethod
+    def create_llm(self) -> LLM:
+        """Chat model used for condensing and synthesis"""
+
+    @abstractmethod
+    def create_embed_model(self) -> BaseEmbedding:
+        """Embedding model used for indexing and queries"""
+
+    @abstractmethod
+    def translate(self, text: str) -> str:
+        """Translate English text to Dzongkha"""
+
+    @property
+    @abstractmethod
+    def translation_model(self) -> str:
+        """Name recorded with catalog translations"""
+
+class AzureOpenAIProvider(ModelProvider):
+    """Azure OpenAI chat, embedding and translation deployments"""
+
+    name = "azure"
+
+    def __init__(self, api_key: str, azure_endpoint: str, api_version: str,
+                 azure_endpoint_embedding: Optional[str] = None,
+                 chat_deployment: str = DEFAULT_CHAT_DEPLOYMENT,
+                 embedding_deployment: str = DEFAULT_EMBEDDING_DEPLOYMENT,
+                 translation_deployment: str = TRANSLATION_MODEL,
+                 timeout: float = DEFAULT_TIMEOUT_SECONDS,
+                 max_retries: int = DEFAULT_MAX_RETRIES):
+        self.api_key = api_key
+        self.azure_endpoint = azure_endpoint
+        self.api_version = api_version
+        self.azure_endpoint_embedding = azure_endpoint_embedding or azure_endpoint
+        self.chat_deployment = chat_deployment
+        self.embedding_deployment = embedding_deployment
+        self.translation_deployment = translation_deployment
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._translation_client = None
+        self._client_lock = threading.Lock()
+
+    def create_llm(self) -> LLM:
+        from llama_index.llms.azure_openai import AzureOpenAI
+
+        return AzureOpenAI(
+            model=self.chat_deployment,
+            deployment_name=self.chat_deployment,
+            api_key=self.api_key,
+            azure_endpoint=self.azure_endpoint,
+            api_version=self.api_version,
+            timeout=self.timeout,
+            max_retries=self.max_retries,
+        )
+
+    def create_embed_model(self) -> BaseEmbedding:
+        from llama_index.embeddings.azure_openai import AzureOpenAIEmbedding
+
+        return AzureOpenAIEmbedding(
+            model=self.embedding_deployment,
+            deployment_name=self.embedding_deployment,
+            api_key=self.api_key,
+            azure_endpoint=self.azure_endpoint_embedding,
+            api_version=EMBEDDING_API_VERSION,
+            timeout=self.timeout,
+            max_retries=self.max_retries,
+        )
+
+    def _client(self):
+        # One client (and connection pool) for all translations
+        with self._client_lock:
+            if self._translation_client is None:
+                from openai import AzureOpenAI
+
+                self._translation_client = AzureOpenAI(
+                    api_key=self.api_key,
+                    api_version=self.api_version,
+                    azure_endpoint=self.azure_endpoint,
+                    timeout=self.timeout,
+                    max_retries=self.max_retries,
+                )
+            return self._translation_client
+
+    def translate(self, text: str) -> str:
+        return translate_to_dzongkha(self._client(), text, model=self.translation_deployment)
+
+    @property
+    def translation_model(self) -> str:
+        return self.translation_deployment
+
+class OfflineProvider(ModelProvider):
+    """Deterministic local models: hashed n-gram embeddings and an extractive answerer"""
+
+    name = "offline"
+
+    def __init__(self, embed_dim: int = 1024):
+        self.embed_dim = embed_dim
+
+    def create_llm(self) -> LLM:
+        from offline_models import ExtractiveLLM
+
+        return ExtractiveLLM()
+
+    def create_embed_model(self) -> BaseEmbedding:
+        from offline_models import HashingEmbedding
+
+        return HashingEmbedding(embed_dim=self.embed_dim)
+
+    def translate(self, text: str) -> str:
+        # No offline translator; only the pre-translated catalog has Dzongkha
+        return text
+
+    @property
+    def translation_model(self) -> str:
+        return "offline-passthrough"
+
+def get_model_provider(name: Optional[str] = None, **azure_settings) -> ModelProvider:
+    """
+    Provider selected by name or the MODEL_PROVIDER environment variable
+
+    Args:
+        name: "azure" or "offline"; defaults to MODEL_PROVIDER, then "azure"
+        azure_settings: api_key, azure_endpoint, api_version, azure_endpoint_embedding
+            (read from the AZURE_* environment variables when not given)
+    """
+    name = (name or os.getenv("MODEL_PROVIDER") or "azure").lower()
+
+    if name == "offline":
+        logging.info("Using the offline model provider (no network calls)")
+        return OfflineProvider(embed_dim=int(os.getenv("OFFLINE_EMBED_DIM", "1024")))
+
+    if name != "azure":
+        raise ValueError(f"Unknown MODEL_PROVIDER {name!r} (expected 'azure' or 'offline')")
+
+    return AzureOpenAIProvider(
+        api_key=azure_settings.get("api_key") or os.getenv("AZURE_API_KEY"),
+        azure_endpoint=azure_settings.get("azure_endpoint") or os.getenv("AZURE_ENDPOINT"),
+        api_version=azure_settings.get("api_version") or os.getenv("AZURE_API_VERSION"),
+        azure_endpoint_embedding=(azure_settings.get("azure_endpoint_embedding")
+                                  or os.getenv("AZURE_ENDPOINT_EMBEDDING")),
+        chat_deployment=os.getenv("AZURE_CHAT_DEPLOYMENT", DEFAULT_CHAT_DEPLOYMENT),
+        embedding_deployment=os.getenv("AZURE_EMBEDDING_DEPLOYMENT", DEFAULT_EMBEDDING_DEPLOYMENT),
+        translation_deployment=os.getenv("AZURE_TRANSLATION_DEPLOYMENT", TRANSLATION_MODEL),
+        timeout=float(os.getenv("AZURE_TIMEOUT_SECONDS", str(DEFAULT_TIMEOUT_SECONDS))),
+        max_retries=int(os.getenv("AZURE_MAX_RETRIES", str(DEFAULT_MAX_RETRIES))),
+    )
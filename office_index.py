@@ -0,0 +1,200 @@
+"""
+Office Index Module for Ask Druk
+In-memory structured lookup of government offices from knowledge_base/offices
+"""
+
+import re
+import logging
+import difflib
+import threading
+from typing import Dict, List, Optional, Any
+
+from kb_utils import FileChangeWatcher, load_json_file, normalize_key, normalize_text
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+DEFAULT_OFFICES_PATH = "knowledge_base/offices/government_offices.json"
+
+# Cap on memoized fuzzy lookups so arbitrary user input can't grow memory
+FUZZY_CACHE_SIZE = 1024
+
+class _OfficeSnapshot:
+    """Immutable set of lookup tables built from one version of the offices file"""
+
+    def __init__(self, data: Dict[str, Any]):
+        self.offices: List[Dict] = list(data.get("offices", []))
+        self.emergency_contacts: List[Dict] = list(data.get("emergency_contacts", []))
+        self.utility_contacts: List[Dict] = list(data.get("utility_contacts", []))
+
+        self.by_service: Dict[str, List[Dict]] = {}
+        self.by_dzongkhag: Dict[str, List[Dict]] = {}
+        self.by_service_dzongkhag: Dict[tuple, List[Dict]] = {}
+        self.by_alias: Dict[str, Dict] = {}
+
+        for office in self.offices:
+            dzongkhag = normalize_key(office.get("dzongkhag", ""))
+            self.by_dzongkhag.setdefault(dzongkhag, []).append(office)
+
+            for service in office.get("services", []):
+                service_key = normalize_key(service)
+                self.by_service.setdefault(service_key, []).append(office)
+                self.by_service_dzongkhag.setdefault((service_key, dzongkhag), []).append(office)
+
+            for alias in office_aliases(office.get("name", "")):
+                self.by_alias.setdefault(alias, office)
+
+        self.service_keys = list(self.by_service)
+        self.alias_keys = list(self.by_alias)
+
+        # Longest aliases first so "immigration office" wins over "immigration"
+        aliases = sorted(self.by_alias, key=len, reverse=True)
+        self.alias_pattern = re.compile(
+            r"\b(" + "|".join(re.escape(alias) for alias in aliases) + r")\b"
+        ) if aliases else None
+
+def office_aliases(name: str) -> List[str]:
+    """Generate normalized names an office is commonly referred to by"""
+    aliases = []
+    normalized = normalize_text(name)
+    if normalized:
+        aliases.append(normalized)
+
+    # "Road Safety and Transport Authority (RSTA)" -> full name and acronym
+    match = re.match(r"^(.*?)\s*\(([^)]+)\)\s*$", name)
+    if match:
+        aliases.append(normalize_text(match.group(1)))
+        aliases.append(normalize_text(match.group(2)))
+
+    # "Immigration Office" -> "immigration", "Office of Consumer Protection" -> "consumer protection"
+    if normalized.endswith(" office"):
+        aliases.append(normalized[:-len(" office")])
+    if normalized.startswith("office of "):
+        aliases.append(normalized[len("office of "):])
+
+    return [alias for alias in dict.fromkeys(aliases) if alias]
+
+class OfficeIndex:
+    """Indexed lookup of government offices by service, dzongkhag and name"""
+
+    def __init__(self, offices_path: str = DEFAULT_OFFICES_PATH, check_interval: float = 5.0):
+        """Initialize the office index and build it from the offices file"""
+        self.offices_path = offices_path
+        self._snapshot = _OfficeSnapshot({})
+        self._fuzzy_cache: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+        self._watcher = FileChangeWatcher(lambda: [self.offices_path], check_interval)
+        self.load()
+
+    def load(self) -> bool:
+        """(Re)build the index from the offices file"""
+        data = load_json_file(self.offices_path)
+        if not isinstance(data, dict):
+            logging.warning(f"Office index not built: {self.offices_path} is unavailable")
+            return False
+
+        snapshot = _OfficeSnapshot(data)
+        with self._lock:
+            # Swap in the new tables atomically; readers keep the old snapshot
+            self._snapshot = snapshot
+            self._fuzzy_cache = {}
+
+        logging.info(f"Office index built with {len(snapshot.offices)} offices and {len(snapshot.by_service)} services")
+        return True
+
+    def _current(self) -> _OfficeSnapshot:
+        """Return the current snapshot, rebuilding first if the file changed"""
+        if self._watcher.changed():
+            logging.info(f"{self.offices_path} changed, rebuilding office index")
+            self.load()
+        return self._snapshot
+
+    def _fuzzy(self, kind: str, value: str, candidates: List[str], cutoff: float) -> Optional[str]:
+        """Memoized closest-match lookup for misspelled names"""
+        cache_key = f"{kind}:{value}"
+        if cache_key in self._fuzzy_cache:
+            return self._fuzzy_cache[cache_key]
+
+        matches = difflib.get_close_matches(value, candidates, n=1, cutoff=cutoff)
+        result = matches[0] if matches else None
+
+        if len(self._fuzzy_cache) >= FUZZY_CACHE_SIZE:
+            self._fuzzy_cache.clear()
+        self._fuzzy_cache[cache_key] = result
+        return result
+
+    def resolve_service(self, service_type: str) -> Optional[str]:
+        """Map free-text service names ("Driving License", "passports") to a service key"""
+        snapshot = self._current()
+        key = normalize_key(service_type)
+        if key in snapshot.by_service:
+            return key
+        return self._fuzzy("service", key, snapshot.service_keys, cutoff=0.75)
+
+    def find(self, service_type: str, dzongkhag: Optional[str] = None) -> List[Dict]:
+        """
+        Find offices providing a service, optionally within a dzongkhag
+
+        Args:
+            service_type: Service key or name, e.g. "passport"
+            dzongkhag: Optional dzongkhag name, e.g. "Thimphu"
+
+        Returns:
+            Matching office records
+        """
+        snapshot = self._current()
+        service_key = self.resolve_service(service_type)
+        if service_key is None:
+            return []
+
+        if dzongkhag:
+            return list(snapshot.by_service_dzongkhag.get((service_key, normalize_key(dzongkhag)), []))
+        return list(snapshot.by_service.get(service_key, []))
+
+    def find_by_dzongkhag(self, dzongkhag: str) -> List[Dict]:
+        """All offices located in a dzongkhag"""
+        return list(self._current().by_dzongkhag.get(normalize_key(dzongkhag), []))
+
+    def match_name(self, name: str) -> Optional[Dict]:
+        """Find an office by exact, alias or approximate name"""
+        snapshot = self._current()
+        normalized = normalize_text(name)
+        office = snapshot.by_alias.get(normalized)
+        if office is not None:
+            return office
+
+        alias = self._fuzzy("name", normalized, snapshot.alias_keys, cutoff=0.8)
+        return snapshot.by_alias.get(alias) if alias else None
+
+    def find_in_text(self, text: str) -> List[Dict]:
+        """Return offices mentioned by name or alias in free text, in order of first mention"""
+        snapshot = self._current()
+        if snapshot.alias_pattern is None:
+            return []
+
+        found = {}
+        for match in snapshot.alias_pattern.finditer(normalize_text(text)):
+            office = snapshot.by_alias[match.group(1)]
+            found.setdefault(office.get("name"), office)
+        return list(found.values())
+
+    @property
+    def emergency_contacts(self) -> List[Dict]:
+        """Emergency contacts listed alongside the offices"""
+        return self._current().emergency_contacts
+
+    @property
+    def utility_contacts(self) -> List[Dict]:
+        """Utility contacts listed alongside the offices"""
+        return self._current().utility_contacts
+
+    def get_status(self) -> Dict[str, Any]:
+        """Get index status for monitoring"""
+        snapshot = self._snapshot
+        return {
+            "offices": len(snapshot.offices),
+            "services": len(snapshot.by_service),
+            "dzongkhags": len(snapshot.by_dzongkhag),
+            "aliases": len(snapshot.by_alias)
+        }
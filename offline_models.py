@@ -0,0 +1,191 @@
+"""
+Offline Models Module for Ask Druk
+Deterministic local models that need no network or API keys
+
+HashingEmbedding maps word unigrams, bigrams and character n-grams into a
+fixed number of dimensions with a stable hash (feature hashing), so texts
+that share words and word stems end up close together. ExtractiveLLM
+answers with the context lines that best match the question instead of
+generating text. Both are far weaker than the Azure models but reproducible
+on any laptop, which makes them suitable for benchmarks, CI and offline
+development.
+"""
+
+import re
+import zlib
+import logging
+from typing import Any, List, Tuple
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.types import CompletionResponse, CompletionResponseGen, LLMMetadata
+from llama_index.core.bridge.pydantic import ConfigDict, Field
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+
+from context_packer import query_terms
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+DEFAULT_EMBED_DIM = 1024
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "for", "in", "on", "at", "is", "are",
+    "do", "does", "i", "my", "me", "we", "you", "your", "how", "what", "where", "when",
+    "which", "who", "can", "please", "with", "about", "be", "it", "this", "that", "if",
+}
+
+def _features(text: str, char_ngrams: tuple) -> List[str]:
+    words = [word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS]
+    features = list(words)
+    features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+    for word in words:
+        padded = f"<{word}>"
+        for n in char_ngrams:
+            features.extend(f"#{padded[i:i + n]}" for i in range(len(padded) - n + 1))
+    return features
+
+class HashingEmbedding(BaseEmbedding):
+    """Feature-hashed bag of words and character n-grams, L2-normalized"""
+
+    embed_dim: int = Field(default=DEFAULT_EMBED_DIM, gt=0)
+    char_ngrams: tuple = Field(default=(3, 4))
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashingEmbedding"
+
+    def __init__(self, embed_dim: int = DEFAULT_EMBED_DIM, **kwargs):
+        kwargs.setdefault("model_name", f"hashing-{embed_dim}")
+        super().__init__(embed_dim=embed_dim, **kwargs)
+
+    def embed(self, text: str) -> List[float]:
+        """Embedding of one text"""
+        vector = np.zeros(self.embed_dim, dtype=np.float32)
+        counts = {}
+        for feature in _features(text, self.char_ngrams):
+            counts[feature] = counts.get(feature, 0) + 1
+        for feature, count in counts.items():
+            digest = zlib.crc32(feature.encode("utf-8"))
+            # The top bit picks the sign so collisions tend to cancel out
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            # Character n-grams are many and weak; words count more
+            weight = 0.5 if feature.startswith("#") else 1.0
+            vector[digest % self.embed_dim] += sign * weight * (1.0 + np.log(count))
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self.embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self.embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self.embed(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed(text) for text in texts]
+
+# Markers of the prompts the app sends (see llamaindexchatengine and summary_memory)
+CONTEXT_START = "Here are the relevant documents for the context:"
+CONTEXT_END = "Instruction:"
+CONDENSE_MARKER = "Follow Up Input:"
+SUMMARY_MARKER = "Updated summary:"
+
+# Node metadata ("file_path: ...") and long serialized JSON are not answers
+MAX_LINE_CHARS = 400
+_METADATA_LINE = re.compile(r"^[a-z_]+: ")
+
+NO_ANSWER = "That is not covered by the documents I have."
+ANSWER_HEADER = "Here is what the knowledge base says:"
+
+class ExtractiveLLM(CustomLLM):
+    """Answers with the context lines sharing the most words with the question"""
+
+    model_config = ConfigDict(protected_namespaces=())
+    context_window: int = Field(default=8192, gt=0)
+    num_output: int = Field(default=256, gt=0)
+    max_lines: int = Field(default=4, gt=0)
+    model_name: str = Field(default="offline-extractive")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ExtractiveLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            context_window=self.context_window,
+            num_output=self.num_output,
+            is_chat_model=True,
+            model_name=self.model_name,
+        )
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return CompletionResponse(text=self.respond(prompt))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        text = self.respond(prompt)
+
+        def gen() -> CompletionResponseGen:
+            yield CompletionResponse(text=text, delta=text)
+
+        return gen()
+
+    def respond(self, prompt: str) -> str:
+        """Deterministic reply to one of the app's prompts"""
+        if CONDENSE_MARKER in prompt:
+            # The follow-up question is already a usable retrieval query
+            return prompt.split(CONDENSE_MARKER, 1)[1].split("\n", 1)[0].strip()
+        if SUMMARY_MARKER in prompt:
+            return self._summarize(prompt)
+        query, context = self._split_chat_prompt(prompt)
+        return self._extract(query, context)
+
+    def _split_chat_prompt(self, prompt: str) -> Tuple[str, str]:
+        """Question and context of a chat rendered as "role: content" lines"""
+        user_at = prompt.rfind("user: ")
+        if user_at < 0:
+            lines = prompt.strip().splitlines()
+            return (lines[-1] if lines else ""), prompt
+        query = prompt[user_at + len("user: "):].split("\nassistant:", 1)[0]
+        context = prompt[:user_at]
+        if CONTEXT_START in context:
+            context = context.split(CONTEXT_START, 1)[1].split(CONTEXT_END, 1)[0]
+        return query, context
+
+    def _extract(self, query: str, context: str) -> str:
+        terms = query_terms(query)
+        scored = []
+        seen = set()
+        for position, line in enumerate(context.splitlines()):
+            line = line.strip().lstrip("•-* ").strip()
+            if not 12 <= len(line) <= MAX_LINE_CHARS or _METADATA_LINE.match(line) or line in seen:
+                continue
+            seen.add(line)
+            overlap = len(terms & query_terms(line))
+            if overlap:
+                scored.append((-overlap, position, line))
+        if not scored:
+            return NO_ANSWER
+        best = sorted(sorted(scored)[:self.max_lines], key=lambda item: item[1])
+        return ANSWER_HEADER + "\n" + "\n".join(f"• {line}" for _, _, line in best)
+
+    def _summarize(self, prompt: str) -> str:
+        """Previous summary plus the citizen's questions, within the word limit"""
+        summary = prompt.split("Current summary:", 1)[-1].split("New turns:", 1)[0].strip()
+        turns = prompt.split("New turns:", 1)[-1].split(SUMMARY_MARKER, 1)[0]
+        questions = [line[len("user: "):].strip() for line in turns.splitlines() if line.startswith("user: ")]
+        parts = [] if summary in ("", "(none yet)") else [summary]
+        if questions:
+            parts.append("The citizen asked: " + "; ".join(questions))
+        words = " ".join(parts).split()
+        return " ".join(words[:150])
@@ -0,0 +1,270 @@
+"""
+Partitioned Retriever Module for Ask Druk
+Vector search restricted to the knowledge base categories a query needs
+
+The index's nodes are grouped by their category metadata (government_service,
+citizen_rights, legal_information, office_information, ...) into separate
+embedding matrices. A query is routed by its query type to the categories
+that can answer it. Where a partition has chunks for the citizen's own
+dzongkhag (e.g. their local offices), chunks tagged with other dzongkhags are
+skipped; services only offered elsewhere, like the Immigration Office in
+Thimphu, are still found. Each search scores a fraction of the vectors
+and fewer off-topic chunks reach the LLM. Queries without a routable type,
+or whose partitions hold too few chunks, search every partition.
+"""
+
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from llama_index.core import VectorStoreIndex
+from llama_index.core.callbacks import CallbackManager
+from llama_index.core.indices.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from metrics import registry
+from tracing import current_span
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Categories (from DocumentLoader._determine_category) searched for each query type
+QUERY_TYPE_CATEGORIES = {
+    "rights_inquiry": ("citizen_rights", "legal_information"),
+    "law_explanation": ("legal_information", "citizen_rights"),
+    "service_guide": ("government_service", "office_information"),
+    "document_help": ("government_service",),
+    "office_finder": ("office_information", "government_service"),
+}
+
+# Uploads and uncategorized files can be about anything, so every routed search includes them
+ALWAYS_SEARCHED = ("uploaded_document", "general_information")
+
+DEFAULT_CATEGORY = "general_information"
+
+retrieval_searches = registry.counter(
+    "druk_retrieval_searches_total",
+    "Vector searches by scope (routed to partitions, widened after too few hits, all, or batch)",
+    ["scope"]
+)
+retrieval_vectors_scanned = registry.counter(
+    "druk_retrieval_vectors_scanned_total",
+    "Chunk embeddings scored by vector searches",
+    []
+)
+
+class RetrievalScope:
+    """Which part of the knowledge base a query should search"""
+
+    __slots__ = ("query_type", "dzongkhag")
+
+    def __init__(self, query_type: Optional[str] = None, dzongkhag: Optional[str] = None):
+        self.query_type = query_type
+        self.dzongkhag = dzongkhag.strip().lower() if dzongkhag else None
+
+    @property
+    def categories(self) -> Optional[Tuple[str, ...]]:
+        """Categories to search, or None for all of them"""
+        categories = QUERY_TYPE_CATEGORIES.get(self.query_type)
+        return categories + ALWAYS_SEARCHED if categories else None
+
+# Set per request around the chat engine call, like the current trace span
+_current_scope: contextvars.ContextVar = contextvars.ContextVar("druk_retrieval_scope", default=None)
+
+@contextmanager
+def retrieval_scope(query_type: Optional[str], dzongkhag: Optional[str] = None) -> Iterator[RetrievalScope]:
+    """Route retrievals in this block by query type and the citizen's dzongkhag"""
+    scope = RetrievalScope(query_type, dzongkhag)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+class _Partition:
+    """One category's nodes: a contiguous slice of the retriever's embedding matrix"""
+
+    __slots__ = ("start", "stop", "node_ids", "matrix", "dzongkhags", "tagged")
+
+    def __init__(self, start: int, stop: int, node_ids: List[str], matrix: np.ndarray, dzongkhags: np.ndarray):
+        self.start = start
+        self.stop = stop
+        self.node_ids = node_ids[start:stop]
+        self.matrix = matrix[start:stop]
+        self.dzongkhags = dzongkhags[start:stop]
+        self.tagged = set(self.dzongkhags) - {""}
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def allowed(self, dzongkhag: Optional[str]) -> Optional[np.ndarray]:
+        """Mask of chunks a citizen of dzongkhag may get, or None for all of them"""
+        if dzongkhag is None or dzongkhag not in self.tagged:
+            return None
+        # Untagged chunks apply nationwide
+        return (self.dzongkhags == "") | (self.dzongkhags == dzongkhag)
+
+    def top_k(self, query: np.ndarray, k: int, dzongkhag: Optional[str]) -> List[Tuple[float, str]]:
+        """Best k (cosine similarity, node id) pairs, skipping other dzongkhags' chunks if it has local ones"""
+        scores = self.matrix @ query
+        allowed = self.allowed(dzongkhag)
+        if allowed is not None:
+            scores = np.where(allowed, scores, -np.inf)
+        return [(float(scores[i]), self.node_ids[i]) for i in _top_indices(scores, k)]
+
+def _top_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest finite scores, unordered"""
+    k = min(k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return best[np.isfinite(scores[best])]
+
+def _unit_rows(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class PartitionedRetriever(BaseRetriever):
+    """Top-k cosine retrieval over per-category partitions of a vector index"""
+
+    def __init__(self, index: VectorStoreIndex, similarity_top_k: int = 2,
+                 callback_manager: Optional[CallbackManager] = None):
+        """
+        Args:
+            index: Index whose docstore and stored embeddings are partitioned
+            similarity_top_k: Chunks returned per query
+        """
+        super().__init__(callback_manager=callback_manager or index._callback_manager)
+        self._index = index
+        # The chat engine embeds queries itself with the retriever's model
+        self._embed_model = index._embed_model
+        self._similarity_top_k = similarity_top_k
+        self._docstore = index.docstore
+        self._build_partitions(index)
+        logging.info("Partitioned retriever over " + ", ".join(
+            f"{category} ({len(partition)})" for category, partition in sorted(self._partitions.items())
+        ))
+
+    def _build_partitions(self, index: VectorStoreIndex):
+        """One matrix of all embeddings, ordered by category so each partition is a slice"""
+        rows = []
+        vector_store = index.vector_store
+        for node_id, node in index.docstore.docs.items():
+            embedding = vector_store.get(node_id)
+            if embedding is None:
+                continue
+            category = node.metadata.get("category") or DEFAULT_CATEGORY
+            dzongkhag = str(node.metadata.get("dzongkhag") or "").strip().lower()
+            rows.append((category, node_id, dzongkhag, embedding))
+        rows.sort(key=lambda row: row[0])
+
+        self._node_ids = [row[1] for row in rows]
+        self._matrix = _unit_rows([row[3] for row in rows]) if rows else np.zeros((0, 0), dtype=np.float32)
+        self._dzongkhags = np.asarray([row[2] for row in rows], dtype=object)
+        self._total = len(rows)
+        self._partitions: Dict[str, _Partition] = {}
+        start = 0
+        for stop in range(1, len(rows) + 1):
+            if stop == len(rows) or rows[stop][0] != rows[start][0]:
+                self._partitions[rows[start][0]] = _Partition(
+                    start, stop, self._node_ids, self._matrix, self._dzongkhags
+                )
+                start = stop
+
+    def partition_sizes(self) -> Dict[str, int]:
+        return {category: len(partition) for category, partition in self._partitions.items()}
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if query_bundle.embedding is None:
+            query_bundle.embedding = self._embed_model.get_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        query = _unit_rows(query_bundle.embedding)
+
+        scope = _current_scope.get() or RetrievalScope()
+        categories = scope.categories
+        routed = [self._partitions[c] for c in categories or () if c in self._partitions]
+
+        if categories is not None and sum(len(p) for p in routed) >= self._similarity_top_k:
+            hits, scanned = self._search(routed, query, scope.dzongkhag)
+            label = "routed"
+            if len(hits) < self._similarity_top_k:
+                # The dzongkhag filter left too few chunks in the routed partitions
+                hits, more = self._search(list(self._partitions.values()), query, scope.dzongkhag)
+                scanned += more
+                label = "widened"
+        else:
+            hits, scanned = self._search(list(self._partitions.values()), query, scope.dzongkhag)
+            label = "all"
+
+        retrieval_searches.inc(1, label)
+        retrieval_vectors_scanned.inc(scanned)
+        current_span().set_attributes({
+            "retrieval_scope": label,
+            "query_type": scope.query_type or "",
+            "vectors_scanned": scanned,
+            "vectors_total": self._total,
+        })
+
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return self._to_nodes(hits[:self._similarity_top_k])
+
+    def retrieve_batch(self, embeddings: List[List[float]],
+                       scopes: List[Optional[RetrievalScope]]) -> List[List[NodeWithScore]]:
+        """
+        Top-k nodes for many query embeddings at once
+        
+        Scores every query against every chunk in one matrix product, then
+        applies each query's scope as a mask; the routing and widening rules
+        are the same as for a single retrieval.
+        """
+        if not embeddings:
+            return []
+        if not self._total:
+            return [[] for _ in embeddings]
+        scores = _unit_rows(embeddings) @ self._matrix.T
+        masks: Dict[Tuple, np.ndarray] = {}
+        results = []
+        for row, scope in zip(scores, scopes):
+            scope = scope or RetrievalScope()
+            key = (scope.query_type, scope.dzongkhag)
+            if key not in masks:
+                masks[key] = self._scope_mask(scope)
+            row = np.where(masks[key], row, -np.inf)
+            best = _top_indices(row, self._similarity_top_k)
+            hits = sorted(((float(row[i]), self._node_ids[i]) for i in best), reverse=True)
+            results.append(self._to_nodes(hits))
+        retrieval_searches.inc(len(results), "batch")
+        retrieval_vectors_scanned.inc(len(results) * self._total)
+        return results
+
+    def _scope_mask(self, scope: RetrievalScope) -> np.ndarray:
+        """Chunks a retrieval in scope may return, as a mask over the whole matrix"""
+        def mask_of(partitions: List[_Partition]) -> np.ndarray:
+            mask = np.zeros(self._total, dtype=bool)
+            for partition in partitions:
+                allowed = partition.allowed(scope.dzongkhag)
+                mask[partition.start:partition.stop] = True if allowed is None else allowed
+            return mask
+
+        categories = scope.categories
+        routed = [self._partitions[c] for c in categories or () if c in self._partitions]
+        if categories is not None and sum(len(p) for p in routed) >= self._similarity_top_k:
+            mask = mask_of(routed)
+            if mask.sum() >= self._similarity_top_k:
+                return mask
+        return mask_of(list(self._partitions.values()))
+
+    def _to_nodes(self, hits: List[Tuple[float, str]]) -> List[NodeWithScore]:
+        nodes = self._docstore.get_nodes([node_id for _, node_id in hits])
+        return [NodeWithScore(node=node, score=score) for (score, _), node in zip(hits, nodes)]
+
+    def _search(self, partitions: List[_Partition], query: np.ndarray,
+                dzongkhag: Optional[str]) -> Tuple[List[Tuple[float, str]], int]:
+        hits = []
+        for partition in partitions:
+            hits.extend(partition.top_k(query, self._similarity_top_k, dzongkhag))
+        return hits, sum(len(partition) for partition in partitions)
@@ -0,0 +1,262 @@
+"""
+Query Classifier Module for Ask Druk
+Embedding-based query type classification with keyword fallback
+
+Each query type has a handful of example questions. Their embeddings are
+averaged into one centroid per label and cached on disk, so classifying a
+query only needs its embedding - the same vector the retriever uses.
+"""
+
+import os
+import json
+import hashlib
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from llama_index.core.utilities.token_counting import TokenCounter
+
+from circuit_breaker import embedding_breaker
+from embedding_cache import QueryEmbeddingCache
+from metrics import record_tokens
+from tracing import tracer
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+DEFAULT_CENTROID_CACHE_PATH = os.getenv(
+    "QUERY_CLASSIFIER_CACHE_PATH", ".cache/query_classifier_centroids.json"
+)
+
+# Best label must beat the runner-up by this cosine margin, otherwise the
+# keyword rules decide
+MIN_MARGIN = 0.015
+
+# Few-shot examples per query type
+LABEL_EXAMPLES = {
+    "rights_inquiry": [
+        "My employer fired me without notice, what can I do?",
+        "What are my rights as an employee?",
+        "I was not paid my salary for two months",
+        "Is it legal for my boss to make me work in unsafe conditions?",
+        "The shop sold me a defective phone and refuses a refund",
+        "Am I entitled to severance pay?",
+        "Can I be dismissed for being pregnant?",
+        "A store overcharged me, how do I complain?",
+    ],
+    "service_guide": [
+        "How do I apply for a passport?",
+        "What are the steps to get a driving license?",
+        "How can I register a new business?",
+        "How to renew my citizenship ID card?",
+        "Process for getting a birth certificate",
+        "Can I apply for a passport online?",
+        "How do I get a work permit?",
+        "Steps for land registration",
+    ],
+    "office_finder": [
+        "Where is the immigration office?",
+        "What are the office hours of RSTA?",
+        "Phone number of the Department of Trade",
+        "Which office handles labour complaints?",
+        "Address of the civil registration office in Thimphu",
+        "Where do I go to submit my passport application?",
+        "Is there a consumer protection office near me?",
+        "Contact details for the Ministry of Labour",
+    ],
+    "law_explanation": [
+        "Explain the Labour Act 2007 in simple terms",
+        "What does the law say about working hours?",
+        "What is the minimum wage regulation?",
+        "Which section of the Labour Act covers termination?",
+        "What are the rules on overtime pay?",
+        "Summarize the consumer protection law",
+        "Is there a law about annual leave?",
+        "What regulations apply to foreign workers?",
+    ],
+    "document_help": [
+        "What documents do I need for a passport?",
+        "Which papers are required for business registration?",
+        "Do I need a medical certificate for a driving license?",
+        "List of documents for a birth certificate",
+        "What do I need to bring to the immigration office?",
+        "Are photocopies of my ID required?",
+        "What is a security clearance certificate and do I need one?",
+        "Required documents for a work permit",
+    ],
+    "general_inquiry": [
+        "Hello, who are you?",
+        "What can you help me with?",
+        "Tell me about Bhutan",
+        "Thank you for your help",
+        "What services does the government provide?",
+        "Good morning Druk",
+        "Can you speak Dzongkha?",
+        "What is Ask Druk?",
+    ],
+}
+
+def keyword_query_type(message: str) -> str:
+    """Detect the type of query based on keywords"""
+    message_lower = message.lower()
+
+    if any(word in message_lower for word in ["right", "rights", "fired", "unfair", "discriminat"]):
+        return "rights_inquiry"
+    elif any(word in message_lower for word in ["apply", "application", "register", "license", "permit"]):
+        return "service_guide"
+    elif any(word in message_lower for word in ["office", "where", "location", "contact"]):
+        return "office_finder"
+    elif any(word in message_lower for word in ["law", "legal", "regulation", "rule"]):
+        return "law_explanation"
+    elif any(word in message_lower for word in ["document", "documents", "need", "required"]):
+        return "document_help"
+    else:
+        return "general_inquiry"
+
+def examples_fingerprint(model_name: str, examples: Dict[str, List[str]]) -> str:
+    """Identify a set of centroids by embedding model and example questions"""
+    payload = json.dumps({"model": model_name, "examples": examples}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class QueryClassifier:
+    """Classifies queries by cosine similarity to per-label centroids"""
+
+    def __init__(self,
+                 embed_model_fn: Callable[[], object],
+                 embedding_cache: Optional[QueryEmbeddingCache] = None,
+                 examples: Optional[Dict[str, List[str]]] = None,
+                 cache_path: str = DEFAULT_CENTROID_CACHE_PATH,
+                 min_margin: float = MIN_MARGIN):
+        """
+        Args:
+            embed_model_fn: Returns the embedding model in use (e.g. lambda: Settings.embed_model)
+            embedding_cache: Cache shared with the retriever
+            examples: Few-shot examples per label
+            cache_path: Where centroids are cached on disk
+            min_margin: Required cosine margin over the runner-up label
+        """
+        self._embed_model_fn = embed_model_fn
+        self.embedding_cache = embedding_cache or QueryEmbeddingCache()
+        self.examples = examples or LABEL_EXAMPLES
+        self.cache_path = cache_path
+        self.min_margin = min_margin
+
+        self.labels: List[str] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._token_counter = TokenCounter()
+
+    @property
+    def ready(self) -> bool:
+        """Whether embedding classification is available"""
+        return self._centroids is not None
+
+    def initialize(self) -> bool:
+        """Load centroids from disk, or embed the examples and cache them"""
+        try:
+            embed_model = self._embed_model_fn()
+            model_name = getattr(embed_model, "model_name", type(embed_model).__name__)
+            fingerprint = examples_fingerprint(model_name, self.examples)
+
+            centroids = self._load_centroids(fingerprint)
+            if centroids is None:
+                logging.info("Computing query classifier centroids")
+                centroids = self._compute_centroids(embed_model)
+                self._save_centroids(fingerprint, model_name, centroids)
+
+            self.labels = list(centroids)
+            self._centroids = np.stack([np.asarray(centroids[label], dtype=np.float32) for label in self.labels])
+            logging.info(f"Query classifier ready with {len(self.labels)} labels")
+            return True
+        except Exception as e:
+            logging.warning(f"Query classifier unavailable, using keyword rules: {str(e)}")
+            self._centroids = None
+            return False
+
+    def _load_centroids(self, fingerprint: str) -> Optional[Dict[str, List[float]]]:
+        """Read cached centroids if they match the current model and examples"""
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if cached.get("fingerprint") != fingerprint:
+            logging.info("Query classifier centroid cache is outdated")
+            return None
+        return cached.get("centroids")
+
+    def _save_centroids(self, fingerprint: str, model_name: str, centroids: Dict[str, List[float]]):
+        """Write centroids to the on-disk cache"""
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"fingerprint": fingerprint, "model": model_name, "centroids": centroids}, f)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            logging.warning(f"Could not cache query classifier centroids: {str(e)}")
+
+    def _compute_centroids(self, embed_model) -> Dict[str, List[float]]:
+        """Embed all examples in one batch and average them per label"""
+        texts, owners = [], []
+        for label, label_examples in self.examples.items():
+            texts.extend(label_examples)
+            owners.extend([label] * len(label_examples))
+
+        embeddings = embed_model.get_text_embedding_batch(texts)
+
+        grouped: Dict[str, List[np.ndarray]] = {}
+        for label, embedding in zip(owners, embeddings):
+            grouped.setdefault(label, []).append(_unit(np.asarray(embedding, dtype=np.float32)))
+
+        return {label: _unit(np.mean(vectors, axis=0)).tolist() for label, vectors in grouped.items()}
+
+    def score(self, embedding: List[float]) -> List[Tuple[str, float]]:
+        """Cosine similarity of a query embedding to every label, best first"""
+        similarities = self._centroids @ _unit(np.asarray(embedding, dtype=np.float32))
+        order = np.argsort(-similarities)
+        return [(self.labels[i], float(similarities[i])) for i in order]
+
+    def classify_embedding(self, embedding: List[float]) -> Optional[str]:
+        """Label for a query embedding, or None when the margin is too small"""
+        ranked = self.score(embedding)
+        if len(ranked) > 1 and ranked[0][1] - ranked[1][1] < self.min_margin:
+            return None
+        return ranked[0][0]
+
+    def _embed_query(self, message: str) -> List[float]:
+        """Embed a query, recording latency and tokens"""
+        embed_model = self._embed_model_fn()
+        with embedding_breaker.guard(), tracer.stage("query_embedding"):
+            embedding = embed_model.get_query_embedding(message)
+        record_tokens(
+            "query_embedding",
+            getattr(embed_model, "model_name", None),
+            prompt_tokens=self._token_counter.get_string_tokens(message)
+        )
+        return embedding
+
+    def classify(self, message: str) -> str:
+        """
+        Classify a query, falling back to keyword rules
+
+        The query embedding is stored in the shared cache so the retriever
+        reuses it instead of making a second embedding call.
+        """
+        if not self.ready:
+            return keyword_query_type(message)
+
+        try:
+            embedding = self.embedding_cache.get_or_compute(message, self._embed_query)
+            label = self.classify_embedding(embedding)
+        except Exception as e:
+            logging.warning(f"Embedding classification failed, using keyword rules: {str(e)}")
+            return keyword_query_type(message)
+
+        return label or keyword_query_type(message)
@@ -0,0 +1,239 @@
+"""
+Rate Limiter Module for Ask Druk
+Token buckets per session, phone number and client IP, shared by all workers
+
+Each rule (e.g. "chat_session") allows a burst and refills at a sustained
+rate per minute. Buckets live in a small memory-mapped file so every gunicorn
+worker on the host sees the same counts; a record lock on the file keeps
+updates atomic across processes. The table is a fixed-size set-associative
+hash: a key maps to one set of slots, and a new key replaces the bucket in
+its set that has gone longest without traffic (a bucket idle long enough to
+refill completely carries no state, so evicting it loses nothing).
+
+Checking a request is a hash, a lock and a few struct reads, so rejected
+requests never reach the classifier, the engine or the LLM.
+"""
+
+import os
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from metrics import registry
+
+try:
+    import fcntl
+except ImportError:  # Windows: buckets are shared between threads only
+    fcntl = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+DEFAULT_STORE_PATH = "/tmp/ask_druk_rate_limits.bin"
+
+# Key hash (0 = empty), tokens left, last update (unix time)
+_SLOT = struct.Struct("<Qdd")
+_HEADER = struct.Struct("<8sII")
+_MAGIC = b"DRUKRL01"
+
+# Burst:per-minute for each rule, overridable with RATE_LIMITS
+DEFAULT_LIMITS = {
+    "chat_session": "10:20",
+    "chat_ip": "30:60",
+    "translate_ip": "20:60",
+    "whatsapp_number": "5:10",
+}
+
+rate_limited = registry.counter(
+    "druk_rate_limited_total",
+    "Requests rejected by the rate limiter, by rule",
+    ["rule"]
+)
+
+class RateLimit:
+    """Token bucket parameters: burst size and sustained refill rate"""
+
+    __slots__ = ("burst", "per_minute")
+
+    def __init__(self, burst: float, per_minute: float):
+        self.burst = float(burst)
+        self.per_minute = float(per_minute)
+
+    @classmethod
+    def parse(cls, spec: str) -> "RateLimit":
+        """Build from "burst:per_minute", e.g. "10:20" """
+        burst, _, per_minute = spec.partition(":")
+        return cls(float(burst), float(per_minute or burst))
+
+    @property
+    def per_second(self) -> float:
+        return self.per_minute / 60.0
+
+class BucketTable:
+    """Fixed-size table of token buckets in a file shared between processes"""
+
+    def __init__(self, path: Optional[str] = None, sets: int = 4096, ways: int = 8):
+        """
+        Args:
+            path: Backing file; None keeps the table in anonymous memory (one process)
+            sets: Number of hash sets
+            ways: Buckets per set; a set holds this many keys before evicting
+        """
+        self.sets = sets
+        self.ways = ways
+        self.path = path
+        self._size = _HEADER.size + sets * ways * _SLOT.size
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+        if path is None:
+            self._map = mmap.mmap(-1, self._size)
+            _HEADER.pack_into(self._map, 0, _MAGIC, sets, ways)
+            return
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._file_lock():
+            header = os.pread(self._fd, _HEADER.size, 0)
+            if len(header) < _HEADER.size or _HEADER.unpack(header) != (_MAGIC, sets, ways):
+                # New file or a different layout: start from an empty table
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self._size)
+                os.pwrite(self._fd, _HEADER.pack(_MAGIC, sets, ways), 0)
+            self._map = mmap.mmap(self._fd, self._size)
+
+    def _file_lock(self):
+        return _FileLock(self._fd)
+
+    @staticmethod
+    def key_hash(rule: str, key: str) -> int:
+        digest = hashlib.blake2b(f"{rule}\x00{key}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little") or 1
+
+    def take(self, rule: str, key: str, limit: RateLimit, now: Optional[float] = None) -> Tuple[bool, float]:
+        """
+        Take one token from a bucket
+
+        Returns:
+            (allowed, retry_after): retry_after is the seconds until a token is available
+        """
+        now = time.time() if now is None else now
+        key_hash = self.key_hash(rule, key)
+        set_offset = _HEADER.size + (key_hash % self.sets) * self.ways * _SLOT.size
+
+        with self._thread_lock, self._file_lock():
+            slot_offset, tokens, updated = self._find(set_offset, key_hash, now, limit)
+            # Refill for the time since the last request; clocks may step backwards
+            tokens = min(limit.burst, tokens + max(0.0, now - updated) * limit.per_second)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            _SLOT.pack_into(self._map, slot_offset, key_hash, tokens, now)
+
+        if allowed:
+            return True, 0.0
+        return False, (1.0 - tokens) / limit.per_second if limit.per_second > 0 else 60.0
+
+    def _find(self, set_offset: int, key_hash: int, now: float, limit: RateLimit) -> Tuple[int, float, float]:
+        """Slot holding the key, or the least recently used slot of its set (reset to a full bucket)"""
+        oldest_offset, oldest_updated = set_offset, float("inf")
+        for way in range(self.ways):
+            offset = set_offset + way * _SLOT.size
+            slot_hash, tokens, updated = _SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset, tokens, updated
+            if slot_hash == 0:
+                updated = float("-inf")
+            if updated < oldest_updated:
+                oldest_offset, oldest_updated = offset, updated
+        return oldest_offset, limit.burst, now
+
+    def occupancy(self) -> int:
+        """Number of buckets in use"""
+        used = 0
+        with self._thread_lock, self._file_lock():
+            for offset in range(_HEADER.size, self._size, _SLOT.size):
+                if _SLOT.unpack_from(self._map, offset)[0]:
+                    used += 1
+        return used
+
+class _FileLock:
+    """Exclusive POSIX record lock on the table file (held per process)"""
+
+    def __init__(self, fd: Optional[int]):
+        self.fd = fd
+
+    def __enter__(self):
+        if self.fd is not None and fcntl is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.fd is not None and fcntl is not None:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+class RateLimitExceeded(Exception):
+    """A request over its rule's limit"""
+
+    def __init__(self, rule: str, retry_after: float):
+        super().__init__(f"Rate limit '{rule}' exceeded; retry in {retry_after:.1f}s")
+        self.rule = rule
+        self.retry_after = retry_after
+
+class RateLimiter:
+    """Named token-bucket rules over a shared bucket table"""
+
+    def __init__(self, limits: Dict[str, RateLimit], table: Optional[BucketTable] = None,
+                 enabled: bool = True):
+        self.limits = limits
+        self.table = table or BucketTable()
+        self.enabled = enabled
+
+    def check(self, rule: str, key: Optional[str]):
+        """
+        Consume one token for key under rule
+
+        Raises:
+            RateLimitExceeded: The bucket is empty
+        """
+        limit = self.limits.get(rule)
+        if not self.enabled or limit is None or not key:
+            return
+        allowed, retry_after = self.table.take(rule, key, limit)
+        if not allowed:
+            rate_limited.inc(1, rule)
+            raise RateLimitExceeded(rule, retry_after)
+
+    def get_status(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "limits": {rule: {"burst": limit.burst, "per_minute": limit.per_minute}
+                       for rule, limit in self.limits.items()},
+            "buckets_in_use": self.table.occupancy(),
+            "capacity": self.table.sets * self.table.ways,
+        }
+
+def parse_limits(spec: str) -> Dict[str, RateLimit]:
+    """Parse "chat_session=10:20,chat_ip=30:60" into rules"""
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        rule, _, value = part.partition("=")
+        limits[rule.strip()] = RateLimit.parse(value.strip())
+    return limits
+
+def rate_limiter_from_env() -> RateLimiter:
+    """Limiter configured by RATE_LIMITS, RATE_LIMIT_STORE_PATH and RATE_LIMIT_ENABLED"""
+    limits = {rule: RateLimit.parse(spec) for rule, spec in DEFAULT_LIMITS.items()}
+    limits.update(parse_limits(os.getenv("RATE_LIMITS", "")))
+    path = os.getenv("RATE_LIMIT_STORE_PATH", DEFAULT_STORE_PATH)
+    try:
+        table = BucketTable(path or None)
+    except OSError as e:
+        logging.warning(f"Rate limit store {path} unavailable ({str(e)}); limiting per worker")
+        table = BucketTable()
+    return RateLimiter(limits, table, enabled=os.getenv("RATE_LIMIT_ENABLED", "true").lower() != "false")
@@ -0,0 +1,21 @@
+# static_content.py - Fixed English content shown by Ask Druk
+#
+# Kept apart from application.py so the Dzongkha catalog build/check step
+# can read it without starting the app.
+
+EMERGENCY_CONTACTS = [
+    {"service": "Police", "number": "113", "available": "24/7"},
+    {"service": "Fire Department", "number": "110", "available": "24/7"},
+    {"service": "Medical Emergency", "number": "112", "available": "24/7"},
+    {"service": "National Emergency", "number": "111", "available": "24/7"},
+    {"service": "Tourist Helpline", "number": "+975-2-323251", "available": "Office hours"}
+]
+
+AVAILABLE_SERVICES = [
+    {"name": "Passport Application", "icon": "🛂", "category": "Travel Documents"},
+    {"name": "Driving License", "icon": "🚗", "category": "Transportation"},
+    {"name": "Business Registration", "icon": "💼", "category": "Business"},
+    {"name": "Birth Certificate", "icon": "📄", "category": "Civil Documents"},
+    {"name": "Employment Rights", "icon": "⚖️", "category": "Legal Rights"},
+    {"name": "Land Registration", "icon": "🏠", "category": "Property"}
+]
@@ -0,0 +1,237 @@
+"""
+Summary Memory Module for Ask Druk
+Chat memory that folds older turns into a running summary
+
+Recent turns are kept verbatim within a token budget. Turns that fall out of
+that window are folded into a compact summary by an LLM call that runs after
+the response has been sent, so prompt size stays bounded without silently
+forgetting the start of long WhatsApp conversations. Token counts are
+computed once per message and cached.
+"""
+
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms.llm import LLM
+from llama_index.core.memory.types import BaseMemory
+from llama_index.core.settings import Settings
+from llama_index.core.utilities.token_counting import TokenCounter
+
+from circuit_breaker import llm_breaker
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+DEFAULT_RECENT_TOKEN_LIMIT = 1000
+DEFAULT_SUMMARY_TOKEN_LIMIT = 300
+
+SUMMARY_PREFIX = "Summary of the earlier conversation with this citizen:\n"
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a Bhutanese citizen and Druk, a government services assistant.
+
+Keep the facts needed to continue the conversation: who the citizen is (dzongkhag, occupation, situation), the services, offices, laws and documents discussed, decisions and amounts mentioned, and questions still open. Drop greetings and repetition. Write at most {max_words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+class RollingSummaryMemory(BaseMemory):
+    """Recent turns verbatim plus a running summary of everything older"""
+
+    token_limit: int = Field(default=DEFAULT_RECENT_TOKEN_LIMIT, gt=0)
+    summary_token_limit: int = Field(default=DEFAULT_SUMMARY_TOKEN_LIMIT, gt=0)
+
+    _llm: Optional[LLM] = PrivateAttr(default=None)
+    _token_counter: TokenCounter = PrivateAttr()
+    _lock: Any = PrivateAttr()
+    _messages: List[ChatMessage] = PrivateAttr(default_factory=list)
+    _token_counts: List[int] = PrivateAttr(default_factory=list)
+    _summary: str = PrivateAttr(default="")
+    _summary_chat_message: Optional[ChatMessage] = PrivateAttr(default=None)
+    _generation: int = PrivateAttr(default=0)
+    _summaries_run: int = PrivateAttr(default=0)
+    _summarizing: bool = PrivateAttr(default=False)
+
+    def __init__(self, llm: Optional[LLM] = None, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._llm = llm
+        self._token_counter = TokenCounter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        """Get class name."""
+        return "RollingSummaryMemory"
+
+    @classmethod
+    def from_defaults(
+        cls,
+        chat_history: Optional[List[ChatMessage]] = None,
+        llm: Optional[LLM] = None,
+        token_limit: int = DEFAULT_RECENT_TOKEN_LIMIT,
+        summary_token_limit: int = DEFAULT_SUMMARY_TOKEN_LIMIT,
+        **kwargs: Any,
+    ) -> "RollingSummaryMemory":
+        """Create a summary memory, summarizing with llm (defaults to Settings.llm)"""
+        memory = cls(
+            llm=llm or Settings.llm,
+            token_limit=token_limit,
+            summary_token_limit=summary_token_limit,
+        )
+        if chat_history:
+            memory.set(chat_history)
+        return memory
+
+    @property
+    def summary(self) -> str:
+        """The current running summary"""
+        return self._summary
+
+    def _count(self, message: ChatMessage) -> int:
+        return self._token_counter.estimate_tokens_in_messages([message])
+
+    def _window_start(self, token_limit: Optional[int] = None) -> int:
+        """Index of the oldest message that fits the recent-turn budget"""
+        token_limit = token_limit or self.token_limit
+        total, start = 0, len(self._messages)
+        for index in range(len(self._messages) - 1, -1, -1):
+            total += self._token_counts[index]
+            if total > token_limit:
+                break
+            start = index
+        # Never start the window with an assistant reply to a dropped question
+        while start < len(self._messages) and self._messages[start].role != MessageRole.USER:
+            start += 1
+        return start
+
+    def _summary_message(self) -> List[ChatMessage]:
+        # The same message object is returned until the summary changes, so
+        # callers can cache its token count
+        if self._summary_chat_message is None:
+            return []
+        return [self._summary_chat_message]
+
+    def get(self, input: Optional[str] = None, **kwargs: Any) -> List[ChatMessage]:
+        """Running summary followed by the most recent turns within the token budget"""
+        with self._lock:
+            return self._summary_message() + self._messages[self._window_start():]
+
+    def get_all(self) -> List[ChatMessage]:
+        """Running summary followed by every turn not yet folded into it"""
+        with self._lock:
+            return self._summary_message() + list(self._messages)
+
+    def put(self, message: ChatMessage) -> None:
+        """Add a message, caching its token count"""
+        tokens = self._count(message)
+        with self._lock:
+            self._messages.append(message)
+            self._token_counts.append(tokens)
+
+    def set(self, messages: List[ChatMessage]) -> None:
+        """Replace the chat history and drop the summary"""
+        counts = [self._count(message) for message in messages]
+        with self._lock:
+            self._messages = list(messages)
+            self._token_counts = counts
+            self._summary = ""
+            self._summary_chat_message = None
+            self._generation += 1
+
+    def reset(self) -> None:
+        """Clear the chat history and summary"""
+        self.set([])
+
+    def needs_summary(self) -> bool:
+        """Whether turns have fallen out of the window without being summarized"""
+        with self._lock:
+            return self._llm is not None and not self._summarizing and self._window_start() > 0
+
+    def _pending(self) -> Optional[Tuple[int, List[ChatMessage], str]]:
+        """Snapshot of the evicted turns to fold, or None"""
+        with self._lock:
+            if self._llm is None or self._summarizing or self._window_start() == 0:
+                return None
+            self._summarizing = True
+            # Fold down to half the budget so a summary is not needed every turn
+            start = self._window_start(self.token_limit // 2)
+            return self._generation, self._messages[:start], self._summary
+
+    def _summary_prompt(self, summary: str, evicted: List[ChatMessage]) -> str:
+        turns = "\n".join(f"{message.role.value}: {message.content}" for message in evicted)
+        return SUMMARY_PROMPT.format(
+            max_words=int(self.summary_token_limit * 0.75),
+            summary=summary or "(none yet)",
+            turns=turns,
+        )
+
+    def _apply(self, generation: int, folded: int, summary: Optional[str]):
+        """Replace the folded turns with the new summary unless the history was reset"""
+        with self._lock:
+            self._summarizing = False
+            if generation != self._generation or summary is None:
+                return
+            del self._messages[:folded]
+            del self._token_counts[:folded]
+            self._summary = summary.strip()
+            self._summary_chat_message = ChatMessage(
+                role=MessageRole.SYSTEM, content=SUMMARY_PREFIX + self._summary
+            )
+            self._summaries_run += 1
+
+    def summarize(self) -> bool:
+        """Fold evicted turns into the running summary; returns whether anything was folded"""
+        pending = self._pending()
+        if pending is None:
+            return False
+        generation, evicted, summary = pending
+        try:
+            with llm_breaker.guard():
+                result = self._llm.complete(
+                    self._summary_prompt(summary, evicted), max_tokens=self.summary_token_limit
+                )
+        except Exception as e:
+            logging.warning(f"Conversation summary failed, will retry next turn: {str(e)}")
+            self._apply(generation, 0, None)
+            return False
+        self._apply(generation, len(evicted), str(result))
+        return True
+
+    async def asummarize(self) -> bool:
+        """Async version of summarize, run as a background task after responding"""
+        pending = self._pending()
+        if pending is None:
+            return False
+        generation, evicted, summary = pending
+        try:
+            with llm_breaker.guard():
+                result = await self._llm.acomplete(
+                    self._summary_prompt(summary, evicted), max_tokens=self.summary_token_limit
+                )
+        except Exception as e:
+            logging.warning(f"Conversation summary failed, will retry next turn: {str(e)}")
+            self._apply(generation, 0, None)
+            return False
+        self._apply(generation, len(evicted), str(result))
+        return True
+
+    def get_status(self) -> Dict[str, Any]:
+        """Memory size for monitoring"""
+        with self._lock:
+            start = self._window_start()
+            return {
+                "messages": len(self._messages),
+                "window_messages": len(self._messages) - start,
+                "window_tokens": sum(self._token_counts[start:]),
+                "pending_messages": start,
+                "summary_tokens": self._token_counter.get_string_tokens(self._summary),
+                "summaries_run": self._summaries_run,
+            }
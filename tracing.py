@@ -0,0 +1,547 @@
+"""
+Tracing Module for Ask Druk
+Records one span tree per request and exports sampled trees
+
+The root span is opened per HTTP request; the chat engine opens a span per
+stage (condense, query embedding, retrieval, synthesis) and the llama-index
+callback manager adds the LLM, embedding and retrieval events underneath
+them with token counts and retrieved node ids. Trees go to a rotating JSONL
+file or an OTLP/HTTP collector.
+
+Traces are kept at the configured sample rate; with a slow threshold set,
+every trace is buffered in memory and slow or failed ones are always kept,
+so p99 outliers can be inspected after the fact.
+"""
+
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import contextvars
+import urllib.request
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, Optional
+
+from llama_index.core.callbacks import CBEventType, EventPayload
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+
+from metrics import registry, stage_seconds
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+DEFAULT_TRACE_FILE = "logs/traces.jsonl"
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+# Events without useful timing of their own
+IGNORED_EVENTS = [
+    CBEventType.CHUNKING,
+    CBEventType.NODE_PARSING,
+    CBEventType.TEMPLATING,
+]
+
+# Callback events awaiting their end before stale ones are pruned
+MAX_OPEN_EVENTS = 1000
+
+traces_total = registry.counter(
+    "druk_traces_total",
+    "Finished traces by sampling decision",
+    ["decision"]
+)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("druk_current_span", default=None)
+
+class Trace:
+    """Spans of one request, exported together when the root span ends"""
+
+    __slots__ = ("trace_id", "spans", "sampled", "finished")
+
+    def __init__(self, sampled: bool):
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List["Span"] = []
+        self.sampled = sampled
+        self.finished = False
+
+class Span:
+    """One timed operation in a trace"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns",
+                 "_started", "duration", "attributes", "error")
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        self.end_ns = 0
+        self.duration = 0.0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        trace.spans.append(self)
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        self.attributes.update(attributes)
+
+    def record_exception(self, e: BaseException):
+        self.error = f"{type(e).__name__}: {str(e)}"
+
+    def to_dict(self, root_start_ns: int) -> Dict[str, Any]:
+        span = {
+            "name": self.name,
+            "span_id": self.span_id,
+            "offset_ms": round((self.start_ns - root_start_ns) / 1e6, 3),
+            "duration_ms": round(self.duration * 1e3, 3),
+        }
+        if self.attributes:
+            span["attributes"] = self.attributes
+        if self.error:
+            span["error"] = self.error
+        return span
+
+class _NoopSpan:
+    """Stands in for a span when the request is not being traced"""
+
+    trace_id = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]):
+        pass
+
+    def record_exception(self, e: BaseException):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+def current_span():
+    """The innermost open span of this request (a no-op span if untraced)"""
+    return _current_span.get() or NOOP_SPAN
+
+class _SpanScope:
+    """Context manager making a span current for the duration of a block"""
+
+    __slots__ = ("_tracer", "_name", "_attributes", "_root", "_span", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any], root: bool = False):
+        self._tracer = tracer
+        self._name = name
+        self._attributes = attributes
+        self._root = root
+
+    def __enter__(self):
+        self._span = self._tracer.start_span(self._name, self._attributes, root=self._root)
+        if self._span is None:
+            self._token = None
+            return NOOP_SPAN
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is not None:
+            if exc is not None:
+                self._span.record_exception(exc)
+            _current_span.reset(self._token)
+            self._tracer.end_span(self._span)
+        return False
+
+class _StageScope:
+    """Times a request stage into the stage histogram and a span"""
+
+    __slots__ = ("_name", "_scope", "_started")
+
+    def __init__(self, name: str, scope: _SpanScope):
+        self._name = name
+        self._scope = scope
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self._scope.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._scope.__exit__(exc_type, exc, tb)
+        stage_seconds.observe(time.perf_counter() - self._started, self._name)
+        return False
+
+class JsonlSpanExporter:
+    """
+    Writes one span tree per line to a size-rotated JSONL file per process
+
+    Each worker writes its own file (logs/traces.<pid>.jsonl for
+    logs/traces.jsonl), opened on its first export: workers forked from one
+    handler (gunicorn --preload) would each rotate the same file and lose
+    each other's traces.
+    """
+
+    def __init__(self, path: str = DEFAULT_TRACE_FILE, max_bytes: int = DEFAULT_MAX_BYTES,
+                 backup_count: int = DEFAULT_BACKUP_COUNT):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._open_lock = threading.Lock()
+        self._logger: Optional[logging.Logger] = None
+        self._pid: Optional[int] = None
+
+    def process_path(self, pid: Optional[int] = None) -> str:
+        """File written by a process (the current one by default)"""
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{pid or os.getpid()}{ext}"
+
+    def _process_logger(self) -> logging.Logger:
+        """This process's file logger, opened on first use"""
+        if self._pid != os.getpid():
+            with self._open_lock:
+                if self._pid != os.getpid():
+                    path = self.process_path()
+                    handler = RotatingFileHandler(path, maxBytes=self.max_bytes,
+                                                  backupCount=self.backup_count, encoding="utf-8")
+                    handler.setFormatter(logging.Formatter("%(message)s"))
+                    logger = logging.getLogger(f"druk.traces.{path}")
+                    logger.handlers = [handler]
+                    logger.setLevel(logging.INFO)
+                    logger.propagate = False
+                    self._logger = logger
+                    self._pid = os.getpid()
+        return self._logger
+
+    def export(self, trace: Trace, decision: str):
+        self._process_logger().info(json.dumps(span_tree(trace, decision), default=str))
+
+    def shutdown(self):
+        if self._pid != os.getpid():
+            return
+        for handler in self._logger.handlers:
+            handler.close()
+
+class OTLPHttpExporter:
+    """
+    Sends traces to an OTLP/HTTP collector (JSON encoding) from a background thread
+
+    The thread and its queue are created on the first export in each process:
+    threads don't survive a fork, so one started at import under gunicorn
+    --preload would exist only in the master.
+    """
+
+    def __init__(self, endpoint: str, service_name: str = "ask-druk", timeout: float = 5.0,
+                 max_queue: int = 1000, batch_size: int = 64, flush_interval: float = 2.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._start_lock = threading.Lock()
+        self._queue: Optional["queue.Queue[Optional[Trace]]"] = None
+        self._worker: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def _started_queue(self) -> "queue.Queue[Optional[Trace]]":
+        """This process's queue, starting its sender thread on first use"""
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(maxsize=self.max_queue)
+                    self._worker = threading.Thread(target=self._run, args=(self._queue,),
+                                                    name="otlp-exporter", daemon=True)
+                    self._worker.start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def export(self, trace: Trace, decision: str):
+        try:
+            self._started_queue().put_nowait(trace)
+        except queue.Full:
+            # Never block a request on the collector
+            self.dropped += 1
+
+    def _run(self, traces: "queue.Queue[Optional[Trace]]"):
+        while True:
+            batch = []
+            try:
+                trace = traces.get(timeout=self.flush_interval)
+                if trace is None:
+                    return
+                batch.append(trace)
+                while len(batch) < self.batch_size:
+                    trace = traces.get_nowait()
+                    if trace is None:
+                        self._send(batch)
+                        return
+                    batch.append(trace)
+            except queue.Empty:
+                pass
+            if batch:
+                self._send(batch)
+
+    def _send(self, traces: List[Trace]):
+        body = json.dumps(otlp_payload(traces, self.service_name), default=str).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except Exception as e:
+            logging.warning(f"Could not export {len(traces)} traces to {self.url}: {str(e)}")
+
+    def shutdown(self):
+        if self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._worker.join(timeout=self.timeout)
+
+def span_tree(trace: Trace, decision: str = "") -> Dict[str, Any]:
+    """Nested representation of a trace for the JSONL file"""
+    root = trace.spans[0]
+    nodes = {span.span_id: span.to_dict(root.start_ns) for span in trace.spans}
+    for span in trace.spans[1:]:
+        parent = nodes.get(span.parent_id)
+        if parent is not None:
+            parent.setdefault("children", []).append(nodes[span.span_id])
+    tree = {
+        "trace_id": trace.trace_id,
+        "timestamp": root.start_ns / 1e9,
+        "kept_by": decision,
+    }
+    tree.update(nodes[root.span_id])
+    return tree
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(item) for item in value]}}
+    return {"stringValue": str(value)}
+
+def otlp_payload(traces: List[Trace], service_name: str) -> Dict[str, Any]:
+    """OTLP ExportTraceServiceRequest (JSON encoding) for finished traces"""
+    spans = []
+    for trace in traces:
+        for span in trace.spans:
+            otlp_span = {
+                "traceId": trace.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = span.parent_id
+            spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "ask-druk"}, "spans": spans}],
+        }]
+    }
+
+class Tracer:
+    """Creates spans for the current request and exports sampled traces"""
+
+    def __init__(self, exporter=None, sample_rate: float = 1.0, slow_threshold: Optional[float] = None):
+        """
+        Args:
+            exporter: JsonlSpanExporter or OTLPHttpExporter; None disables tracing
+            sample_rate: Fraction of traces kept regardless of latency
+            slow_threshold: Seconds; slower (and failed) traces are always kept
+        """
+        self.configure(exporter, sample_rate, slow_threshold)
+
+    def configure(self, exporter=None, sample_rate: float = 1.0, slow_threshold: Optional[float] = None):
+        """Replace the exporter and sampling settings"""
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def trace(self, name: str, **attributes: Any) -> _SpanScope:
+        """Root span of a new trace (or a child span if a trace is already open)"""
+        return _SpanScope(self, name, attributes, root=True)
+
+    def span(self, name: str, **attributes: Any) -> _SpanScope:
+        """`with tracer.span("name") as span:` - a child of the current span; no-op outside a trace"""
+        return _SpanScope(self, name, attributes)
+
+    def stage(self, name: str, **attributes: Any) -> _StageScope:
+        """A span that is also observed in the druk_stage_duration_seconds histogram"""
+        return _StageScope(name, _SpanScope(self, name, attributes))
+
+    def start_span(self, name: str, attributes: Optional[Dict[str, Any]] = None,
+                   root: bool = False) -> Optional[Span]:
+        """Start a span under the current one without making it current"""
+        parent = _current_span.get()
+        if parent is not None:
+            if parent.trace.finished:
+                return None
+            return Span(parent.trace, name, parent.span_id, attributes or {})
+        if not root or self.exporter is None:
+            return None
+
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.slow_threshold is None:
+            traces_total.inc(1, "dropped")
+            return None
+        return Span(Trace(sampled), name, None, attributes or {})
+
+    def end_span(self, span: Span):
+        span.end_ns = time.time_ns()
+        span.duration = time.perf_counter() - span._started
+        if span.parent_id is None:
+            self._finish(span)
+
+    def _finish(self, root: Span):
+        trace = root.trace
+        trace.finished = True
+        if any(span.error for span in trace.spans):
+            decision = "error"
+        elif self.slow_threshold is not None and root.duration >= self.slow_threshold:
+            decision = "slow"
+        elif trace.sampled:
+            decision = "sampled"
+        else:
+            traces_total.inc(1, "dropped")
+            return
+
+        traces_total.inc(1, decision)
+        exporter = self.exporter
+        if exporter is None:
+            return
+        try:
+            exporter.export(trace, decision)
+        except Exception as e:
+            logging.warning(f"Could not export trace {trace.trace_id}: {str(e)}")
+
+def _node_attributes(nodes: List[Any]) -> Dict[str, Any]:
+    return {
+        "node_ids": [node.node.node_id for node in nodes],
+        "node_scores": [round(node.score, 4) if node.score is not None else None for node in nodes],
+        "node_sources": [node.node.metadata.get("source", "") for node in nodes],
+    }
+
+def _usage_attributes(response: Any) -> Dict[str, Any]:
+    """Prompt/completion tokens reported by the API, if any"""
+    usage = dict(getattr(response, "additional_kwargs", None) or {})
+    raw = getattr(response, "raw", None)
+    raw_usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if raw_usage is not None and "prompt_tokens" not in usage:
+        usage["prompt_tokens"] = getattr(raw_usage, "prompt_tokens", None)
+        usage["completion_tokens"] = getattr(raw_usage, "completion_tokens", None)
+    return {key: usage[key] for key in ("prompt_tokens", "completion_tokens") if usage.get(key) is not None}
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """Turns llama-index callback events into child spans of the current span"""
+
+    def __init__(self, tracer: Tracer):
+        super().__init__(event_starts_to_ignore=IGNORED_EVENTS, event_ends_to_ignore=IGNORED_EVENTS)
+        self._tracer = tracer
+        # Events start and end on the threadpool threads running chat calls
+        self._lock = threading.Lock()
+        self._open: Dict[str, Span] = {}
+
+    def on_event_start(self, event_type: CBEventType, payload: Optional[Dict[str, Any]] = None,
+                       event_id: str = "", parent_id: str = "", **kwargs: Any) -> str:
+        if _current_span.get() is None:
+            return event_id
+        span = self._tracer.start_span(event_type.value)
+        if span is not None:
+            payload = payload or {}
+            if EventPayload.QUERY_STR in payload:
+                span.set_attribute("query", str(payload[EventPayload.QUERY_STR])[:200])
+            with self._lock:
+                if len(self._open) > MAX_OPEN_EVENTS:
+                    # Events whose end was never reported (e.g. an abandoned stream)
+                    self._open = {key: open_span for key, open_span in self._open.items()
+                                  if not open_span.trace.finished}
+                self._open[event_id] = span
+        return event_id
+
+    def on_event_end(self, event_type: CBEventType, payload: Optional[Dict[str, Any]] = None,
+                     event_id: str = "", **kwargs: Any) -> None:
+        with self._lock:
+            span = self._open.pop(event_id, None)
+        if span is None:
+            return
+        payload = payload or {}
+        try:
+            if EventPayload.NODES in payload and event_type == CBEventType.RETRIEVE:
+                span.set_attributes(_node_attributes(payload[EventPayload.NODES]))
+            if EventPayload.EXCEPTION in payload:
+                span.record_exception(payload[EventPayload.EXCEPTION])
+            response = payload.get(EventPayload.RESPONSE) or payload.get(EventPayload.COMPLETION)
+            if event_type == CBEventType.LLM and response is not None:
+                span.set_attributes(_usage_attributes(response))
+            if event_type == CBEventType.EMBEDDING and EventPayload.CHUNKS in payload:
+                span.set_attribute("chunks", len(payload[EventPayload.CHUNKS]))
+        except Exception as e:
+            logging.debug(f"Could not read {event_type.value} event payload: {str(e)}")
+        # Streamed responses can end after the request has finished
+        if not span.trace.finished:
+            self._tracer.end_span(span)
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(self, trace_id: Optional[str] = None,
+                  trace_map: Optional[Dict[str, List[str]]] = None) -> None:
+        pass
+
+# Process-wide tracer, disabled until configure_tracing() sets an exporter
+tracer = Tracer()
+trace_handler = TraceCallbackHandler(tracer)
+
+def configure_tracing() -> Tracer:
+    """
+    Configure the process-wide tracer from environment variables
+
+    TRACE_EXPORTER: "none" (default), "jsonl" or "otlp"
+    TRACE_FILE, TRACE_MAX_BYTES, TRACE_BACKUP_COUNT: JSONL file (one per process,
+        with the pid before the extension) and rotation
+    OTLP_ENDPOINT: collector base URL, e.g. http://localhost:4318
+    TRACE_SAMPLE_RATE: fraction of traces kept (default 0.1)
+    TRACE_SLOW_MS: always keep traces slower than this (default 5000, 0 disables)
+    """
+    kind = os.getenv("TRACE_EXPORTER", "none").lower()
+    sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+    slow_ms = float(os.getenv("TRACE_SLOW_MS", "5000"))
+    slow_threshold = slow_ms / 1000 if slow_ms > 0 else None
+
+    exporter = None
+    if kind == "jsonl":
+        exporter = JsonlSpanExporter(
+            os.getenv("TRACE_FILE", DEFAULT_TRACE_FILE),
+            max_bytes=int(os.getenv("TRACE_MAX_BYTES", str(DEFAULT_MAX_BYTES))),
+            backup_count=int(os.getenv("TRACE_BACKUP_COUNT", str(DEFAULT_BACKUP_COUNT))),
+        )
+    elif kind == "otlp":
+        exporter = OTLPHttpExporter(os.getenv("OTLP_ENDPOINT", "http://localhost:4318"))
+    elif kind != "none":
+        logging.warning(f"Unknown TRACE_EXPORTER {kind}, tracing disabled")
+
+    tracer.configure(exporter, sample_rate, slow_threshold)
+    if exporter is not None:
+        logging.info(f"Tracing to {kind} (sample rate {sample_rate}, slow threshold {slow_ms} ms)")
+    return tracer
@@ -0,0 +1,199 @@
+"""
+Twilio Transport Module for Ask Druk
+Async client for Twilio's Messages REST API over pooled HTTP connections
+
+The Twilio helper library's Client is synchronous: called from an async
+endpoint, every message blocks the event loop for a full HTTPS round-trip,
+and each Client sets up its own connections. This client posts to the same
+Messages endpoint with httpx from one shared pool of keep-alive connections,
+so a send costs the loop nothing while it waits and most sends skip the TCP
+and TLS handshakes. Connect and read timeouts bound a stalled Twilio, and a
+concurrency limit keeps bursts (e.g. a broadcast) from opening more
+connections than the pool holds; callers over the limit wait their turn.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+
+import httpx
+
+from metrics import registry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+DEFAULT_API_BASE_URL = "https://api.twilio.com"
+
+twilio_requests = registry.counter(
+    "druk_twilio_requests_total",
+    "Twilio REST requests by outcome (2xx, 4xx, 429, 5xx, timeout, error)",
+    ["outcome"]
+)
+twilio_request_seconds = registry.histogram(
+    "druk_twilio_request_seconds",
+    "Twilio REST request time, including waiting for a connection slot",
+    []
+)
+
+class TwilioAPIError(Exception):
+    """A send Twilio refused or that never got an answer"""
+
+    def __init__(self, message: str, status: Optional[int] = None, code: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        """Throttling, server errors and transport failures may succeed later"""
+        return self.status is None or self.status == 429 or self.status >= 500
+
+class AsyncTwilioClient:
+    """Sends WhatsApp messages through Twilio's REST API without blocking the event loop"""
+
+    def __init__(self, account_sid: str, auth_token: str, base_url: Optional[str] = None,
+                 timeout: float = 10.0, connect_timeout: float = 3.0, max_concurrency: int = 20,
+                 keepalive_seconds: float = 60.0):
+        """
+        Args:
+            account_sid: Twilio account SID
+            auth_token: Twilio auth token
+            base_url: Override of https://api.twilio.com, e.g. a local stand-in
+            timeout: Seconds allowed for reading or writing each request
+            connect_timeout: Seconds allowed for opening a connection
+            max_concurrency: Requests in flight at once, and connections kept open
+            keepalive_seconds: How long an idle connection is kept for reuse
+        """
+        self.account_sid = account_sid
+        self._auth = (account_sid, auth_token)
+        self.base_url = (base_url or DEFAULT_API_BASE_URL).rstrip("/")
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_concurrency = max_concurrency
+        self.keepalive_seconds = keepalive_seconds
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        self._waiting = 0
+
+    def _http(self) -> httpx.AsyncClient:
+        # Created on first use so the pool and limit belong to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                auth=self._auth,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency,
+                                    keepalive_expiry=self.keepalive_seconds),
+            )
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def send_message(self, to: str, body: str, from_: str,
+                           status_callback: Optional[str] = None) -> Dict:
+        """
+        Create a message
+
+        Returns:
+            Twilio's message resource (sid, status, ...)
+
+        Raises:
+            TwilioAPIError: Twilio rejected the message or could not be reached
+        """
+        form = {"To": to, "From": from_, "Body": body}
+        if status_callback:
+            form["StatusCallback"] = status_callback
+        response = await self._post(f"/2010-04-01/Accounts/{self.account_sid}/Messages.json", form)
+        if response.status_code >= 400:
+            raise _api_error(response)
+        return response.json()
+
+    async def _post(self, path: str, form: Dict[str, str]) -> httpx.Response:
+        """POST a form once a concurrency slot is free"""
+        client = self._http()
+        started = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+        try:
+            response = await client.post(path, data=form)
+        except httpx.TimeoutException as e:
+            twilio_requests.inc(1, "timeout")
+            raise TwilioAPIError(f"Twilio request timed out: {type(e).__name__}")
+        except httpx.HTTPError as e:
+            twilio_requests.inc(1, "error")
+            raise TwilioAPIError(f"Twilio request failed: {type(e).__name__}: {str(e)}")
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+            twilio_request_seconds.observe(time.perf_counter() - started)
+        twilio_requests.inc(1, _outcome(response.status_code))
+        return response
+
+    def pool_status(self) -> Dict:
+        """Requests using and waiting for a concurrency slot, for /metrics"""
+        return {("in_flight",): self._in_flight, ("waiting",): self._waiting}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+def _outcome(status: int) -> str:
+    if status == 429:
+        return "429"
+    return f"{status // 100}xx"
+
+def _api_error(response: httpx.Response) -> TwilioAPIError:
+    """TwilioAPIError from an error response"""
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = {}
+    # Twilio puts code/message at the top level; some proxies nest them under "error"
+    details = payload.get("error") if isinstance(payload.get("error"), dict) else payload
+    code = details.get("code")
+    try:
+        code = int(code) if code is not None else None
+    except (TypeError, ValueError):
+        code = None
+    retry_after = response.headers.get("retry-after")
+    try:
+        retry_after = float(retry_after) if retry_after else None
+    except ValueError:
+        retry_after = None
+    message = details.get("message") or response.reason_phrase
+    return TwilioAPIError(f"Twilio returned {response.status_code}: {message}",
+                          status=response.status_code, code=code, retry_after=retry_after)
+
+def twilio_client_from_env() -> Optional[AsyncTwilioClient]:
+    """Client configured by the TWILIO_* environment variables, or None without credentials"""
+    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+    if not account_sid or not auth_token:
+        return None
+    client = AsyncTwilioClient(
+        account_sid,
+        auth_token,
+        base_url=os.getenv("TWILIO_API_BASE_URL") or None,
+        timeout=float(os.getenv("TWILIO_TIMEOUT_SECONDS", "10")),
+        connect_timeout=float(os.getenv("TWILIO_CONNECT_TIMEOUT_SECONDS", "3")),
+        max_concurrency=int(os.getenv("TWILIO_MAX_CONCURRENCY", "20")),
+        keepalive_seconds=float(os.getenv("TWILIO_KEEPALIVE_SECONDS", "60")),
+    )
+    registry.callback(
+        "druk_twilio_requests",
+        "Twilio REST requests in flight and waiting for a concurrency slot",
+        ["state"],
+        client.pool_status
+    )
+    return client
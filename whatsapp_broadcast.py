@@ -0,0 +1,596 @@
+"""
+WhatsApp Broadcast Module for Ask Druk
+Bulk advisories to WhatsApp subscribers from a persistent outbox
+
+A broadcast (e.g. an office closure notice) is written to a SQLite outbox
+with one delivery row per recipient before anything is sent, so a restart or
+crash resumes where it stopped. Each app worker runs a scheduler that claims
+due deliveries in small batches and a pool of async senders that post them to
+Twilio over pooled keep-alive connections. Sends are paced per sender number
+through the rate limiter's shared bucket table, so all workers together stay
+under the sender's messages-per-second limit; a 429 pauses the pool for its
+Retry-After.
+
+Throttling, server errors and timeouts are retried with jittered exponential
+backoff; other Twilio errors (an invalid or unregistered number) fail the
+delivery at once. A claimed delivery holds a lease: if its worker dies
+mid-send it becomes due again when the lease expires (a recipient may then
+get the message twice rather than not at all). Twilio's status callbacks on
+/webhook/whatsapp/status move each delivery on to sent, delivered, read,
+failed or undelivered; one that arrives before its send has been recorded
+is held and applied when it is.
+"""
+
+import os
+import re
+import time
+import uuid
+import random
+import sqlite3
+import asyncio
+import logging
+import datetime
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from metrics import registry
+from rate_limiter import BucketTable, RateLimit
+from twilio_transport import AsyncTwilioClient, TwilioAPIError
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+DEFAULT_DB_PATH = "/tmp/ask_druk_broadcasts.db"
+
+# Delivery states: ours until Twilio accepts the message, then Twilio's
+PENDING = "pending"
+SENDING = "sending"
+ACCEPTED = "accepted"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+# Later states win; a late "sent" callback must not undo "delivered"
+STATUS_RANK = {
+    PENDING: 0, SENDING: 1, ACCEPTED: 2, "queued": 2,
+    "sent": 3, "delivered": 4, "read": 5,
+}
+TWILIO_FAILURES = ("failed", "undelivered")
+OPEN_STATES = (PENDING, SENDING)
+
+# Seconds a claimed delivery is reserved for its worker before it is due again
+LEASE_SECONDS = 120.0
+
+# Seconds a status callback for an unknown SID is kept, in case its send is
+# still being recorded as accepted (callbacks for other messages expire)
+EARLY_STATUS_SECONDS = 3600.0
+
+# Status of a delivery going back to the outbox: pending, or cancelled if its broadcast was
+_REOPENED = ("CASE WHEN (SELECT cancelled_at FROM broadcasts WHERE id = deliveries.broadcast_id) "
+             "IS NULL THEN ? ELSE ? END")
+
+WHATSAPP_NUMBER = re.compile(r"^\+[1-9]\d{6,14}$")
+
+broadcast_sends = registry.counter(
+    "druk_broadcast_sends_total",
+    "Broadcast send attempts by result (accepted, retried, failed)",
+    ["result"]
+)
+broadcast_status_callbacks = registry.counter(
+    "druk_broadcast_status_callbacks_total",
+    "Twilio status callbacks for broadcast messages, by status",
+    ["status"]
+)
+
+def normalize_whatsapp_number(number: str) -> Optional[str]:
+    """"whatsapp:+975..." form of a phone number, or None if it isn't E.164"""
+    number = str(number).strip()
+    if number.startswith("whatsapp:"):
+        number = number[len("whatsapp:"):]
+    number = re.sub(r"[\s\-().]", "", number)
+    if number.startswith("00"):
+        number = "+" + number[2:]
+    elif not number.startswith("+"):
+        number = "+" + number
+    return f"whatsapp:{number}" if WHATSAPP_NUMBER.match(number) else None
+
+class BroadcastOutbox:
+    """Broadcasts and their per-recipient deliveries in a SQLite file shared by all workers"""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        # Opened on first use in each process; a connection must not cross a
+        # fork (gunicorn --preload imports the app before forking workers)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """This process's connection (caller holds the lock)"""
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = self._connect()
+            self._pid = os.getpid()
+        return self._conn
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the outbox file and create its tables"""
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                body TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                cancelled_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS deliveries (
+                id INTEGER PRIMARY KEY,
+                broadcast_id TEXT NOT NULL REFERENCES broadcasts(id),
+                recipient TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                due_at REAL NOT NULL,
+                message_sid TEXT,
+                error_code INTEGER,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                UNIQUE (broadcast_id, recipient)
+            );
+            CREATE INDEX IF NOT EXISTS deliveries_due ON deliveries (status, due_at);
+            CREATE INDEX IF NOT EXISTS deliveries_sid ON deliveries (message_sid);
+            CREATE TABLE IF NOT EXISTS early_statuses (
+                message_sid TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                error_code INTEGER,
+                received_at REAL NOT NULL
+            );
+        """)
+        return db
+
+    def create_broadcast(self, name: Optional[str], body: str, recipients: List[str]) -> str:
+        """Store a broadcast and one pending delivery per distinct recipient"""
+        broadcast_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT INTO broadcasts (id, name, body, created_at) VALUES (?, ?, ?, ?)",
+                    (broadcast_id, name, body, datetime.datetime.now().isoformat())
+                )
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO deliveries (broadcast_id, recipient, status, due_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    ((broadcast_id, recipient, PENDING, now, now) for recipient in recipients)
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return broadcast_id
+
+    def claim(self, limit: int, now: Optional[float] = None) -> List[Tuple[int, str, str, int]]:
+        """
+        Lease up to limit due deliveries to this worker
+
+        Returns:
+            (delivery id, recipient, body, attempt number) for each claimed delivery
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT d.id, d.recipient, b.body, d.attempts FROM deliveries d "
+                    "JOIN broadcasts b ON b.id = d.broadcast_id "
+                    "WHERE d.status IN (?, ?) AND d.due_at <= ? AND b.cancelled_at IS NULL "
+                    "ORDER BY d.due_at, d.id LIMIT ?",
+                    (PENDING, SENDING, now, limit)
+                ).fetchall()
+                self._db.executemany(
+                    "UPDATE deliveries SET status = ?, attempts = attempts + 1, due_at = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    ((SENDING, now + LEASE_SECONDS, now, row["id"]) for row in rows)
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return [(row["id"], row["recipient"], row["body"], row["attempts"] + 1) for row in rows]
+
+    def release(self, delivery_ids: List[int]):
+        """Return claimed but unsent deliveries to the outbox"""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                f"UPDATE deliveries SET status = {_REOPENED}, attempts = attempts - 1, due_at = ?, "
+                "updated_at = ? WHERE id = ? AND status = ?",
+                ((PENDING, CANCELLED, now, now, delivery_id, SENDING) for delivery_id in delivery_ids)
+            )
+
+    def mark_accepted(self, delivery_id: int, message_sid: str):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                updated = self._db.execute(
+                    "UPDATE deliveries SET status = ?, message_sid = ?, error_code = NULL, error = NULL, "
+                    "updated_at = ? WHERE id = ? AND status = ?",
+                    (ACCEPTED, message_sid, time.time(), delivery_id, SENDING)
+                ).rowcount
+                # Twilio can call back before the send's response has been recorded
+                early = self._db.execute(
+                    "SELECT status, error_code FROM early_statuses WHERE message_sid = ?", (message_sid,)
+                ).fetchone()
+                if early is not None:
+                    self._db.execute("DELETE FROM early_statuses WHERE message_sid = ?", (message_sid,))
+                    broadcast_status_callbacks.inc(1, early["status"])
+                    if updated and _advances(ACCEPTED, early["status"]):
+                        self._db.execute(
+                            "UPDATE deliveries SET status = ?, error_code = ?, updated_at = ? WHERE id = ?",
+                            (early["status"], early["error_code"], time.time(), delivery_id)
+                        )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def mark_retry(self, delivery_id: int, due_at: float, error: TwilioAPIError):
+        with self._lock:
+            self._db.execute(
+                f"UPDATE deliveries SET status = {_REOPENED}, due_at = ?, error_code = ?, error = ?, "
+                "updated_at = ? WHERE id = ? AND status = ?",
+                (PENDING, CANCELLED, due_at, error.code, str(error), time.time(), delivery_id, SENDING)
+            )
+
+    def mark_failed(self, delivery_id: int, error: TwilioAPIError):
+        with self._lock:
+            self._db.execute(
+                "UPDATE deliveries SET status = ?, error_code = ?, error = ?, updated_at = ? "
+                "WHERE id = ? AND status = ?",
+                (FAILED, error.code, str(error), time.time(), delivery_id, SENDING)
+            )
+
+    def mark_cancelled(self, delivery_id: int):
+        with self._lock:
+            self._db.execute(
+                "UPDATE deliveries SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), delivery_id, SENDING)
+            )
+
+    def record_status(self, message_sid: str, status: str, error_code: Optional[int] = None) -> bool:
+        """
+        Apply a Twilio status callback to the delivery it belongs to
+
+        A callback for a SID no delivery has yet is kept for
+        EARLY_STATUS_SECONDS and applied by mark_accepted, since Twilio may
+        call back before the send's response has been recorded.
+
+        Returns:
+            Whether the SID belongs to a broadcast delivery
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status FROM deliveries WHERE message_sid = ?", (message_sid,)
+            ).fetchone()
+            if row is None:
+                self._keep_early_status(message_sid, status, error_code, now)
+                return False
+            broadcast_status_callbacks.inc(1, status)
+            if _advances(row["status"], status):
+                self._db.execute(
+                    "UPDATE deliveries SET status = ?, error_code = COALESCE(?, error_code), updated_at = ? "
+                    "WHERE id = ?",
+                    (status, error_code, now, row["id"])
+                )
+            return True
+
+    def _keep_early_status(self, message_sid: str, status: str, error_code: Optional[int], now: float):
+        """Store a callback for a SID not yet recorded, keeping the furthest status (caller holds the lock)"""
+        self._db.execute("DELETE FROM early_statuses WHERE received_at < ?", (now - EARLY_STATUS_SECONDS,))
+        kept = self._db.execute(
+            "SELECT status FROM early_statuses WHERE message_sid = ?", (message_sid,)
+        ).fetchone()
+        if kept is None or _advances(kept["status"], status):
+            self._db.execute(
+                "INSERT OR REPLACE INTO early_statuses (message_sid, status, error_code, received_at) "
+                "VALUES (?, ?, ?, ?)",
+                (message_sid, status, error_code, now)
+            )
+
+    def cancel(self, broadcast_id: str) -> bool:
+        """Stop sending a broadcast; messages already with Twilio are not recalled"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                updated = self._db.execute(
+                    "UPDATE broadcasts SET cancelled_at = ? WHERE id = ? AND cancelled_at IS NULL",
+                    (datetime.datetime.now().isoformat(), broadcast_id)
+                ).rowcount
+                # Claimed deliveries are cancelled by their sender, or here once their lease has lapsed
+                now = time.time()
+                self._db.execute(
+                    "UPDATE deliveries SET status = ?, updated_at = ? WHERE broadcast_id = ? "
+                    "AND (status = ? OR (status = ? AND due_at <= ?))",
+                    (CANCELLED, now, broadcast_id, PENDING, SENDING, now)
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return bool(updated)
+
+    def is_cancelled(self, delivery_id: int) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT b.cancelled_at FROM deliveries d JOIN broadcasts b ON b.id = d.broadcast_id "
+                "WHERE d.id = ?", (delivery_id,)
+            ).fetchone()
+        return row is None or row["cancelled_at"] is not None
+
+    def summary(self, broadcast_id: str) -> Optional[Dict]:
+        """A broadcast with its delivery counts by status"""
+        with self._lock:
+            broadcast = self._db.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+            if broadcast is None:
+                return None
+            counts = dict(self._db.execute(
+                "SELECT status, COUNT(*) FROM deliveries WHERE broadcast_id = ? GROUP BY status", (broadcast_id,)
+            ).fetchall())
+        return _summary(broadcast, counts)
+
+    def list_broadcasts(self, limit: int = 50) -> List[Dict]:
+        """Most recent broadcasts first"""
+        with self._lock:
+            broadcasts = self._db.execute(
+                "SELECT * FROM broadcasts ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+            counts: Dict[str, Dict[str, int]] = {}
+            for broadcast_id, status, count in self._db.execute(
+                "SELECT broadcast_id, status, COUNT(*) FROM deliveries WHERE broadcast_id IN "
+                f"({','.join('?' * len(broadcasts))}) GROUP BY broadcast_id, status",
+                [broadcast["id"] for broadcast in broadcasts]
+            ).fetchall():
+                counts.setdefault(broadcast_id, {})[status] = count
+        return [_summary(broadcast, counts.get(broadcast["id"], {})) for broadcast in broadcasts]
+
+    def deliveries(self, broadcast_id: str, status: Optional[str] = None,
+                   limit: int = 100, offset: int = 0) -> List[Dict]:
+        """Per-recipient delivery state of a broadcast"""
+        query = ("SELECT recipient, status, attempts, message_sid, error_code, error, updated_at "
+                 "FROM deliveries WHERE broadcast_id = ?")
+        params: list = [broadcast_id]
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY id LIMIT ? OFFSET ?"
+        params.extend([limit, offset])
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [{
+            **dict(row),
+            "updated_at": datetime.datetime.fromtimestamp(row["updated_at"]).isoformat(),
+        } for row in rows]
+
+    def next_due(self) -> Optional[float]:
+        """When the earliest open delivery is due, or None if there is none"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(due_at) FROM deliveries WHERE status IN (?, ?)", OPEN_STATES
+            ).fetchone()
+        return row[0]
+
+    def status_counts(self) -> Dict:
+        """Deliveries per status, for /metrics"""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM deliveries GROUP BY status").fetchall()
+        return {(status,): count for status, count in rows}
+
+def _advances(current: str, status: str) -> bool:
+    """Whether a callback status moves a delivery on from its current status"""
+    if status in TWILIO_FAILURES:
+        # A failure after delivery (out of order callbacks) doesn't undo it
+        return STATUS_RANK.get(current, 99) < STATUS_RANK["delivered"]
+    return current not in TWILIO_FAILURES and STATUS_RANK.get(status, -1) > STATUS_RANK.get(current, 99)
+
+def _summary(broadcast: sqlite3.Row, counts: Dict[str, int]) -> Dict:
+    open_count = sum(counts.get(state, 0) for state in OPEN_STATES)
+    if broadcast["cancelled_at"]:
+        status = CANCELLED
+    elif open_count:
+        status = "sending"
+    else:
+        status = "completed"
+    return {
+        "broadcast_id": broadcast["id"],
+        "name": broadcast["name"],
+        "status": status,
+        "recipients": sum(counts.values()),
+        "deliveries": counts,
+        "created_at": broadcast["created_at"],
+        "cancelled_at": broadcast["cancelled_at"],
+    }
+
+class BroadcastScheduler:
+    """Sends due outbox deliveries through Twilio at the sender's rate limit"""
+
+    def __init__(self, outbox: BroadcastOutbox, client: AsyncTwilioClient, sender: str,
+                 pacing_table: BucketTable, messages_per_second: float = 20.0, workers: int = 16,
+                 max_attempts: int = 5, backoff_seconds: float = 2.0, max_backoff_seconds: float = 300.0,
+                 status_callback_url: Optional[str] = None):
+        """
+        Args:
+            outbox: Persistent broadcasts and deliveries
+            client: Async Twilio Messages client
+            sender: Twilio WhatsApp number the broadcasts are sent from
+            pacing_table: Bucket table shared by the app's workers (the rate limiter's)
+            messages_per_second: Sends per second from this sender, across all workers
+            workers: Sends in flight at once from this process
+            max_attempts: Attempts before a retryable error fails a delivery
+            backoff_seconds: Delay before the first retry; doubles on each attempt
+            max_backoff_seconds: Longest delay between attempts
+            status_callback_url: Public URL of /webhook/whatsapp/status, passed to Twilio
+        """
+        self.outbox = outbox
+        self.client = client
+        self.sender = sender if sender.startswith("whatsapp:") else f"whatsapp:{sender}"
+        self.pacing_table = pacing_table
+        self.pace = RateLimit(burst=max(1.0, messages_per_second), per_minute=messages_per_second * 60)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.status_callback_url = status_callback_url
+        self._queue: Optional[asyncio.Queue] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._paused_until = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.workers * 2)
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._dispatch(), name="broadcast-dispatch")]
+        self._tasks.extend(asyncio.create_task(self._work(), name=f"broadcast-send-{i}")
+                           for i in range(self.workers))
+        logging.info(f"Broadcast scheduler started: {self.workers} senders, "
+                     f"{self.pace.per_second:g} messages/s from {self.sender}")
+
+    async def stop(self):
+        """Stop sending; claimed deliveries not yet sent go back to the outbox"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        unsent = []
+        while self._queue is not None and not self._queue.empty():
+            unsent.append(self._queue.get_nowait()[0])
+        if unsent:
+            await run_in_threadpool(self.outbox.release, unsent)
+
+    def wake(self):
+        """Check the outbox now (a broadcast was just created)"""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _dispatch(self):
+        """Keep the send queue fed with due deliveries"""
+        while True:
+            try:
+                # Claim only what the senders can start soon, so leases don't expire in the queue
+                room = self._queue.maxsize - self._queue.qsize()
+                claimed = await run_in_threadpool(self.outbox.claim, room) if room > 0 else []
+                for delivery in claimed:
+                    await self._queue.put(delivery)
+                if claimed:
+                    continue
+                if room <= 0:
+                    await asyncio.sleep(0.05)
+                    continue
+                next_due = await run_in_threadpool(self.outbox.next_due)
+                wait = 5.0 if next_due is None else min(5.0, max(0.05, next_due - time.time()))
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Broadcast dispatcher error: {str(e)}")
+                await asyncio.sleep(1.0)
+
+    async def _work(self):
+        """Send queued deliveries one at a time"""
+        while True:
+            delivery = await self._queue.get()
+            try:
+                await self._send(*delivery)
+            except asyncio.CancelledError:
+                await run_in_threadpool(self.outbox.release, [delivery[0]])
+                raise
+            except Exception as e:
+                logging.error(f"Broadcast delivery {delivery[0]} error: {str(e)}")
+
+    async def _send(self, delivery_id: int, recipient: str, body: str, attempt: int):
+        if await run_in_threadpool(self.outbox.is_cancelled, delivery_id):
+            await run_in_threadpool(self.outbox.mark_cancelled, delivery_id)
+            return
+        await self._wait_for_slot()
+        # The wait can be long under a 429 pause; don't send a broadcast cancelled meanwhile
+        if await run_in_threadpool(self.outbox.is_cancelled, delivery_id):
+            await run_in_threadpool(self.outbox.mark_cancelled, delivery_id)
+            return
+        try:
+            message = await self.client.send_message(recipient, body, self.sender, self.status_callback_url)
+        except TwilioAPIError as e:
+            if e.status == 429:
+                self._pause(e.retry_after or 1.0)
+            if e.retryable and attempt < self.max_attempts:
+                delay = self._backoff(attempt, e.retry_after)
+                await run_in_threadpool(self.outbox.mark_retry, delivery_id, time.time() + delay, e)
+                broadcast_sends.inc(1, "retried")
+            else:
+                logging.warning(f"Broadcast to {recipient} failed after {attempt} attempt(s): {str(e)}")
+                await run_in_threadpool(self.outbox.mark_failed, delivery_id, e)
+                broadcast_sends.inc(1, "failed")
+            return
+        await run_in_threadpool(self.outbox.mark_accepted, delivery_id, message.get("sid"))
+        broadcast_sends.inc(1, "accepted")
+
+    async def _wait_for_slot(self):
+        """Block until the sender's shared bucket has a token and no 429 pause is in effect"""
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            allowed, retry_after = self.pacing_table.take("whatsapp_broadcast", self.sender, self.pace)
+            if allowed:
+                return
+            await asyncio.sleep(retry_after)
+
+    def _pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Full-jitter exponential backoff, never sooner than Twilio's Retry-After"""
+        ceiling = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempt - 1))
+        return max(retry_after or 0.0, random.uniform(ceiling / 2, ceiling))
+
+def broadcast_scheduler_from_env(client: Optional[AsyncTwilioClient], sender: Optional[str],
+                                 pacing_table: BucketTable) -> Tuple[BroadcastOutbox, Optional[BroadcastScheduler]]:
+    """Outbox and scheduler configured by the BROADCAST_* environment variables"""
+    outbox = BroadcastOutbox(os.getenv("BROADCAST_DB_PATH", DEFAULT_DB_PATH))
+    registry.callback(
+        "druk_broadcast_deliveries",
+        "Broadcast deliveries in the outbox, by status",
+        ["status"],
+        outbox.status_counts
+    )
+    if client is None or not sender:
+        logging.warning("Twilio is not configured; broadcasts can be queued but will not be sent")
+        return outbox, None
+    scheduler = BroadcastScheduler(
+        outbox,
+        client,
+        sender,
+        pacing_table,
+        messages_per_second=float(os.getenv("BROADCAST_MESSAGES_PER_SECOND", "20")),
+        workers=int(os.getenv("BROADCAST_WORKERS", "16")),
+        max_attempts=int(os.getenv("BROADCAST_MAX_ATTEMPTS", "5")),
+        status_callback_url=os.getenv("TWILIO_STATUS_CALLBACK_URL") or None,
+    )
+    return outbox, scheduler
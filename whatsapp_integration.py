@@ -2,7 +2,7 @@
 from fastapi import HTTPException, Request, Form
 from fastapi.responses import Response
 from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client
+from twilio.request_validator import RequestValidator
 import logging
 import hashlib
 import hmac
@@ -10,14 +10,18 @@ import os
 from datetime import datetime
 from typing import Optional
 
+from tracing import tracer
+from twilio_transport import twilio_client_from_env
+
 # Twilio configuration
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")  # Your Twilio WhatsApp number
 TWILIO_WEBHOOK_AUTH_TOKEN = os.getenv("TWILIO_WEBHOOK_AUTH_TOKEN", TWILIO_AUTH_TOKEN)
 
-# Initialize Twilio client
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN) if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN else None
+# Async Twilio client shared by every outbound send (TWILIO_API_BASE_URL can
+# point it at a local stand-in for load tests)
+twilio_client = twilio_client_from_env()
 
 # WhatsApp session mapping (phone number -> session_id)
 whatsapp_sessions = {}
@@ -46,6 +50,22 @@ def verify_twilio_signature(request: Request, body: bytes) -> bool:
     # # Compare signatures
     # return hmac.compare_digest(signature.encode('utf-8'), expected_signature)
 
+def verify_status_callback_signature(request: Request, params: dict) -> bool:
+    """
+    Verify that a message status callback came from Twilio
+    
+    Twilio signs the URL it was given plus the POST parameters with the auth
+    token. Behind a proxy the app sees a different URL, so the signature is
+    checked against TWILIO_STATUS_CALLBACK_URL when it is set. Callbacks
+    change stored broadcast state, so without a token nothing is accepted.
+    """
+    if not TWILIO_WEBHOOK_AUTH_TOKEN:
+        logging.warning("TWILIO_AUTH_TOKEN not set; rejecting status callback")
+        return False
+    url = os.getenv("TWILIO_STATUS_CALLBACK_URL") or str(request.url)
+    signature = request.headers.get("X-Twilio-Signature", "")
+    return RequestValidator(TWILIO_WEBHOOK_AUTH_TOKEN).validate(url, params, signature)
+
 def generate_session_id(phone_number: str) -> str:
     """Generate a consistent session ID for a phone number"""
     # Remove WhatsApp prefix and any special characters
@@ -156,7 +176,8 @@ def get_help_message() -> str:
 
 I understand your questions and provide detailed answers! 😊"""
 
-async def process_whatsapp_message(from_number: str, message_body: str, profile_name: str = None) -> str:
+async def process_whatsapp_message(from_number: str, message_body: str, profile_name: str = None,
+                                   background_tasks=None) -> str:
     """Process incoming WhatsApp message and return response"""
     try:
         # Import here to avoid circular imports
@@ -211,7 +232,7 @@ async def process_whatsapp_message(from_number: str, message_body: str, profile_
             message=message_body
         )
         
-        response = await chat_with_druk(chat_request)
+        response = await chat_with_druk(chat_request, background_tasks)
         
         # Format response for WhatsApp
         formatted_response = format_response_for_whatsapp(
@@ -232,13 +253,14 @@ async def send_whatsapp_message(to_number: str, message: str) -> bool:
             logging.error("Twilio client not initialized")
             return False
         
-        message = twilio_client.messages.create(
-            body=message,
-            from_=f"whatsapp:{TWILIO_PHONE_NUMBER}",
-            to=to_number
-        )
+        with tracer.stage("whatsapp_send"):
+            sent = await twilio_client.send_message(
+                to_number,
+                message,
+                f"whatsapp:{TWILIO_PHONE_NUMBER}"
+            )
         
-        logging.info(f"WhatsApp message sent to {to_number}: {message.sid}")
+        logging.info(f"WhatsApp message sent to {to_number}: {sent.get('sid')}")
         return True
         
     except Exception as e: